@@ -1,12 +1,18 @@
 # backend/app/__init__.py
 import os
-from flask import Flask
+import atexit
+from flask import Flask, jsonify
 from flask_cors import CORS # Import CORS
 from .config import Config
-from app.database import close_db_connection
+from app.database import close_db_connection, close_db, get_db_stats, is_reader_process, release_thread_connection
 # Import necessary functions/objects needing context
 from app.stocks.repository import initialize_database
 from app.stocks.manager import stock_manager
+from app.stocks.upstox_api import get_upstox_stats, upstox_client_instance
+from app.stocks.sources import get_source_health
+from app.stocks.eod import eod_scheduler
+from app.stocks.indicator_state import indicator_states # Registers its bars listener
+from app.stocks.indicator_cache import get_indicator_cache_stats
 
 # Create and configure the app
 app = Flask(__name__)
@@ -14,27 +20,43 @@ app.config.from_object(Config)
 CORS(app) # Initialize CORS for the app - allows all origins by default for now
 
 
-# Optional: Register database connection closing (still correct)
+# Return each request's DuckDB cursor to the pool; close the shared instance on process exit
 app.teardown_appcontext(close_db_connection)
+atexit.register(close_db)
+atexit.register(upstox_client_instance.close)
+
+# `python run.py` (debug=True) runs a reloader parent that only watches files and restarts the serving child, which it
+# spawns with WERKZEUG_RUN_MAIN=true. The parent never serves requests, so it must not touch the DB: DuckDB allows one
+# read-write process per file, and a lock held by the parent makes the child's startup fail.
+is_reloader_parent = os.environ.get('APP_DEBUG_RELOADER') == '1' and os.environ.get('WERKZEUG_RUN_MAIN') != 'true'
 
 # --- Perform Initialization within App Context ---
-with app.app_context():
-    # Initialize database tables
-    try:
-        initialize_database() # This call now happens within the context
-    except Exception as e:
-         print(f"CRITICAL: Database initialization failed: {e}")
-         # Decide how to handle this
-
-    # Ensure Default Stock Exists
-    try:
-        print("Ensuring default stock 'RELIANCE/NSE' metadata exists...")
-        # This call also needs the context as it uses the repository/db connection
-        stock_manager.ensure_stock_metadata('RELIANCE', 'NSE')
-    except Exception as e:
-        print(f"WARNING: Could not ensure default stock exists on startup: {e}")
+if not is_reloader_parent:
+    with app.app_context():
+        # Initialize database tables
+        try:
+            initialize_database() # This call now happens within the context
+        except Exception as e:
+             print(f"CRITICAL: Database initialization failed: {e}")
+             # Decide how to handle this
+
+        # Ensure Default Stock Exists
+        try:
+            print("Ensuring default stock 'RELIANCE/NSE' metadata exists...")
+            # This call also needs the context as it uses the repository/db connection
+            stock_manager.ensure_stock_metadata('RELIANCE', 'NSE')
+        except Exception as e:
+            print(f"WARNING: Could not ensure default stock exists on startup: {e}")
+    # Release the file until it is needed: the first request (or CLI command) reopens the process-wide instance lazily,
+    # so a process that only imports the app holds no lock
+    release_thread_connection(); close_db()
 # --- End App Context Block ---
 
+# End-of-day updater: only in the process that owns the DB (readers would all run it and forward every write)
+if Config.EOD_SCHEDULER_ENABLED and not is_reader_process() and not is_reloader_parent:
+    eod_scheduler.start()
+    atexit.register(eod_scheduler.stop)
+
 
 # Import and register blueprints AFTER app is created and context-dependent init is done
 from .stocks import routes as stock_routes
@@ -45,4 +67,34 @@ def hello():
     """Simple test route."""
     return "Hello from Flask Backend!"
 
+@app.route('/db-stats')
+def db_stats():
+    """Connection/cursor counters for the process-wide DuckDB instance."""
+    return jsonify(get_db_stats())
+
+@app.route('/upstox-stats')
+def upstox_stats():
+    """Call count/latency of the shared Upstox API client."""
+    return jsonify(get_upstox_stats())
+
+@app.route('/inflight-stats')
+def inflight_stats():
+    """How many metadata/fetch calls were coalesced onto an in-flight one (per process)."""
+    return jsonify(stock_manager.get_inflight_stats())
+
+@app.route('/source-health')
+def source_health():
+    """Circuit state, latency/error averages and negative-cache size of each upstream source, in current fetch order."""
+    return jsonify(get_source_health())
+
+@app.route('/indicator-state-stats')
+def indicator_state_stats():
+    """Tracked indicators/intervals and how many instruments were advanced incrementally vs recomputed (per process)."""
+    return jsonify(indicator_states.get_stats())
+
+@app.route('/indicator-cache-stats')
+def indicator_cache_stats():
+    """Entries, bytes vs budget and hit/miss/eviction counts of the indicator result cache (per process)."""
+    return jsonify(get_indicator_cache_stats())
+
 print("Flask app created and configured. Stocks Blueprint registered.")
\ No newline at end of file
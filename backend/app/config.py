@@ -17,13 +17,65 @@ class Config:
     # SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
     #     'sqlite:///' + os.path.join(basedir, 'app.db')
     # SQLALCHEMY_TRACK_MODIFICATIONS = False
-    DB_PATH = os.path.join(basedir, 'data', 'stocks.db') # Example path if using SQLite/DuckDB directly
+    DB_PATH = os.environ.get('DB_PATH', os.path.join(basedir, 'data', 'stocks.db')) # Example path if using SQLite/DuckDB directly
+    DB_CURSOR_POOL_SIZE = int(os.environ.get('DB_CURSOR_POOL_SIZE', 8)) # Idle cursors kept per pool (read/write) on the shared DuckDB instance
+    INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 250000)) # Rows staged per chunk by repository.add_ohlcv_bulk
+    # Daily/weekly/monthly price columns: FLOAT (float32, halves price storage) or DOUBLE. Existing tables are converted on startup.
+    OHLCV_FLOAT32_PRICES = os.environ.get('OHLCV_FLOAT32_PRICES', 'false').lower() in ('1', 'true', 'yes')
+    # Cold tier: bars older than the hot window are archived to Hive-partitioned Parquet next to the DB (see archive.py)
+    COLD_STORAGE_DIR = os.environ.get('COLD_STORAGE_DIR', os.path.join(basedir, 'data', 'cold'))
+    HOT_DATA_YEARS = int(os.environ.get('HOT_DATA_YEARS', 2)) # Current year + (N-1) previous calendar years stay in DuckDB
+    # Process roles: 'single' (one process owns the DB, default), 'writer' (ingest.py - owns the DB, serves writes and
+    # publishes read-only snapshots) or 'reader' (web workers - read the latest snapshot, forward writes to the writer)
+    DB_ACCESS_MODE = os.environ.get('DB_ACCESS_MODE', 'single').lower()
+    SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', os.path.join(basedir, 'data', 'snapshots'))
+    SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', 30)) # At most one snapshot (CHECKPOINT + full DB copy) per interval, only when dirty
+    SNAPSHOT_POLL_SECONDS = float(os.environ.get('SNAPSHOT_POLL_SECONDS', 1)) # How often readers look for a newer snapshot
+    INGEST_SERVICE_HOST = os.environ.get('INGEST_SERVICE_HOST', '127.0.0.1')
+    INGEST_SERVICE_PORT = int(os.environ.get('INGEST_SERVICE_PORT', 6001))
+    INGEST_SERVICE_AUTHKEY = os.environ.get('INGEST_SERVICE_AUTHKEY', '') # Shared secret of the writer and its readers - required in those modes, no default
 
     # API Keys
     UPSTOX_API_KEY = os.environ.get('UPSTOX_API_KEY')
     UPSTOX_API_SECRET = os.environ.get('UPSTOX_API_SECRET')
     UPSTOX_REDIRECT_URI = os.environ.get('UPSTOX_REDIRECT_URI')
-    UPSTOX_ACCESS_TOKEN = os.environ.get('UPSTOX_ACCESS_TOKEN')
+    UPSTOX_ACCESS_TOKEN = os.environ.get('UPSTOX_ACCESS_TOKEN') # Re-read from .env when the file changes (see stocks/upstox_api.py)
+    UPSTOX_API_HOST = os.environ.get('UPSTOX_API_HOST') # Override the SDK's https://api.upstox.com (e.g. benchmarks/fake_upstox_server.py)
+    UPSTOX_POOL_SIZE = int(os.environ.get('UPSTOX_POOL_SIZE', 10)) # Keep-alive connections kept by the shared Upstox client
+    UPSTOX_TIMEOUT_SECONDS = float(os.environ.get('UPSTOX_TIMEOUT_SECONDS', 30))
+    UPSTOX_FETCH_CONCURRENCY = int(os.environ.get('UPSTOX_FETCH_CONCURRENCY', 4)) # Date windows of long ranges fetched in parallel (process-wide)
+    UPSTOX_WINDOW_RETRIES = int(os.environ.get('UPSTOX_WINDOW_RETRIES', 2)) # Extra attempts for failed windows only
+    # Upstream rate limits as 'requests/seconds' buckets, all enforced (Upstox standard API: 50/s, 500/min, 2000/30min)
+    UPSTOX_RATE_LIMITS = os.environ.get('UPSTOX_RATE_LIMITS', '50/1,500/60,2000/1800')
+    YF_RATE_LIMITS = os.environ.get('YF_RATE_LIMITS', '2/1,2000/3600') # Unofficial API - stay well below its throttling
+    BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', 8)) # Concurrent symbols per backfill job
+    YF_BATCH_SIZE = int(os.environ.get('YF_BATCH_SIZE', 50)) # Tickers per yf.download in batched (backfill fallback) fetches
+    # End-of-day updater (stocks/eod.py): after the close, appends the new daily bars of every stored stock so chart
+    # requests find today's bar locally. Runs in the DB-owning process ('single'/'writer'), never in readers.
+    EOD_SCHEDULER_ENABLED = os.environ.get('EOD_SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    EOD_UPDATE_TIME = os.environ.get('EOD_UPDATE_TIME', '16:00') # HH:MM IST, Mon-Fri (NSE/BSE close at 15:30)
+    EOD_BATCH_SIZE = int(os.environ.get('EOD_BATCH_SIZE', 200)) # Symbols fetched and stored per ingest transaction
+    EOD_WORKERS = int(os.environ.get('EOD_WORKERS', 8)) # Concurrent Upstox fetches within a batch
+    # Incremental indicator state (stocks/indicator_state.py): recursive indicators advanced over new bars on every ingest
+    INDICATOR_STATE_SPECS = os.environ.get('INDICATOR_STATE_SPECS', 'EMA_20,EMA_50,EMA_200,RSI_14,MACD_12_26_9') # EMA/RSI/MACD only (SMA has no state)
+    INDICATOR_STATE_INTERVALS = os.environ.get('INDICATOR_STATE_INTERVALS', '1D,1W,1M') # Stored daily bars and the W/M bars derived from them
+    # Indicator result cache (stocks/indicator_cache.py): computed columns per series, indicator and data version (LRU)
+    INDICATOR_CACHE_MB = float(os.environ.get('INDICATOR_CACHE_MB', 64)) # Memory budget per process; 0 disables the cache
+    # Materialized indicators (repository, ohlcv_daily_indicators): daily indicator columns computed in DuckDB, refreshed on ingest
+    MATERIALIZED_INDICATORS = os.environ.get('MATERIALIZED_INDICATORS', 'SMA_50,SMA_200,EMA_20,EMA_50,RSI_14') # SMA_n/EMA_n/RSI_n; empty disables
+    # Upstream source health (stocks/sources.py): preferred order, circuit breaker and negative cache
+    SOURCE_ORDER = os.environ.get('SOURCE_ORDER', 'upstox,yfinance') # Later sources must be SOURCE_FALLBACK_PENALTY x faster to go first
+    SOURCE_FALLBACK_PENALTY = float(os.environ.get('SOURCE_FALLBACK_PENALTY', 3))
+    SOURCE_FAILURE_THRESHOLD = int(os.environ.get('SOURCE_FAILURE_THRESHOLD', 3)) # Consecutive failures that open a source's circuit
+    SOURCE_OPEN_SECONDS = float(os.environ.get('SOURCE_OPEN_SECONDS', 60)) # Doubles on each re-open...
+    SOURCE_MAX_OPEN_SECONDS = float(os.environ.get('SOURCE_MAX_OPEN_SECONDS', 900)) # ...up to this
+    NEGATIVE_CACHE_SECONDS = float(os.environ.get('NEGATIVE_CACHE_SECONDS', 6 * 3600)) # Symbols a source does not know are not retried for this long
+    # Instrument master download (stocks/instruments.py); the URL template takes {exchange}, e.g. a fake server's /instruments/{exchange}.json.gz
+    UPSTOX_INSTRUMENTS_URL = os.environ.get('UPSTOX_INSTRUMENTS_URL', 'https://assets.upstox.com/market-quote/instruments/exchange/{exchange}.json.gz')
+    INSTRUMENT_CACHE_DIR = os.environ.get('INSTRUMENT_CACHE_DIR', os.path.join(basedir, 'data'))
+    # Upstream record/replay (stocks/recorder.py): 'live', 'record' (save responses as fixtures) or 'replay' (offline)
+    UPSTREAM_MODE = os.environ.get('UPSTREAM_MODE', 'live').lower()
+    UPSTREAM_FIXTURES_DIR = os.environ.get('UPSTREAM_FIXTURES_DIR', os.path.join(basedir, 'data', 'fixtures'))
     # Add other API keys as needed (e.g., for yFinance if needed, or other brokers)
 
     # Create data directory if it doesn't exist
@@ -1,7 +1,12 @@
 # backend/app/database.py
 import duckdb
+import json
 import os
-from flask import g # Import Flask's context global 'g'
+import shutil
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+from flask import g, has_app_context # Import Flask's context global 'g'
 from .config import Config
 
 # Ensure the data directory exists
@@ -9,39 +14,235 @@ data_dir = os.path.dirname(Config.DB_PATH)
 if not os.path.exists(data_dir):
     os.makedirs(data_dir)
 
-def get_db_connection():
+# --- Process-wide Database Instance ---
+# The DuckDB database is opened ONCE per process and kept open for its lifetime, so the
+# catalog and buffer cache stay warm between requests. Requests/threads never get the
+# instance itself; they borrow a cheap cursor from a small pool and hand it back on teardown.
+_db_lock = threading.Lock()
+_db_instance: Optional[duckdb.DuckDBPyConnection] = None
+# Idle cursors keyed by read_only. The read_only=True pool is only a SEPARATE pool for query-only callers: in 'single'/
+# 'writer' mode its cursors can still write, because DuckDB cannot open one file with two access modes in one process
+# (and access_mode cannot change on a running database). Only reader processes enforce it (read-only snapshot instance).
+_idle_cursors: Dict[bool, List[duckdb.DuckDBPyConnection]] = {False: [], True: []}
+_thread_cursors = threading.local() # Cursors for code running outside a Flask app context (jobs, CLI)
+
+_db_stats = {
+    'db_connects': 0, 'db_closes': 0,
+    'cursors_created': 0, 'cursors_reused': 0, 'cursors_released': 0, 'cursors_closed': 0,
+}
+
+# --- Reader Mode (Snapshots) ---
+# DuckDB allows ONE read-write process per file. With DB_ACCESS_MODE='reader' (web workers) this process never opens
+# DB_PATH: it opens the newest read-only snapshot published by the writer process (ingest.py) and switches to a
+# newer one as it appears. Cursors of a superseded snapshot are closed when handed back instead of pooled.
+SNAPSHOT_POINTER_FILE = 'CURRENT' # JSON {"generation": n, "file": "stocks.snapshot.<n>.db"} inside Config.SNAPSHOT_DIR
+_snapshot_state = {'generation': 0, 'checked_at': 0.0, 'min_generation': 0}
+_cursor_generations: Dict[int, int] = {} # id(cursor) -> snapshot generation it was created on
+checkpoint_lock = threading.Lock() # Held while checkpointing/copying the DB file for a snapshot
+
+def is_reader_process() -> bool:
+    return Config.DB_ACCESS_MODE == 'reader'
+
+def read_snapshot_pointer() -> Optional[Tuple[int, str]]:
+    """(generation, absolute path) of the newest published snapshot, or None."""
+    try:
+        with open(os.path.join(Config.SNAPSHOT_DIR, SNAPSHOT_POINTER_FILE), 'r', encoding='utf-8') as f: pointer = json.load(f)
+        return int(pointer['generation']), os.path.join(Config.SNAPSHOT_DIR, pointer['file'])
+    except FileNotFoundError: return None
+
+def publish_snapshot(generation: int, keep: int = 2) -> str:
     """
-    Connects to the DuckDB database for the current application context.
-    If a connection doesn't exist for this context, it creates one.
+    Writer side: checkpoints the live DB and publishes a byte copy as snapshot 'generation' (atomic pointer swap).
+    The writer runs with automatic checkpoints disabled, so the data file only changes inside this lock.
     """
-    # Check if a connection exists in the current context (g)
-    if '_database' not in g:
-        try:
-            print(f"CONTEXT: Attempting to connect to DuckDB at: {Config.DB_PATH}")
-            # Store the connection in the current context (g)
-            g._database = duckdb.connect(database=Config.DB_PATH, read_only=False)
-            print("CONTEXT: DuckDB connection successful.")
-        except Exception as e:
-            print(f"CONTEXT: Error connecting to DuckDB: {e}")
-            g._database = None # Ensure it's None on failure
-            raise # Reraise the exception
-
-    if g._database is None:
-         raise ConnectionError("CONTEXT: Failed to establish database connection.")
-
-    return g._database
+    os.makedirs(Config.SNAPSHOT_DIR, exist_ok=True)
+    file_name = f"stocks.snapshot.{generation}.db"; target = os.path.join(Config.SNAPSHOT_DIR, file_name)
+    with checkpoint_lock:
+        cursor = _get_db_instance().cursor()
+        try: cursor.execute("CHECKPOINT")
+        finally: cursor.close()
+        shutil.copyfile(Config.DB_PATH, target + '.tmp')
+    os.replace(target + '.tmp', target)
+    pointer_tmp = os.path.join(Config.SNAPSHOT_DIR, SNAPSHOT_POINTER_FILE + '.tmp')
+    with open(pointer_tmp, 'w', encoding='utf-8') as f: json.dump({'generation': generation, 'file': file_name}, f)
+    os.replace(pointer_tmp, os.path.join(Config.SNAPSHOT_DIR, SNAPSHOT_POINTER_FILE))
+    for old_generation in range(generation - keep, 0, -1): # Readers may still hold the previous one open
+        old_path = os.path.join(Config.SNAPSHOT_DIR, f"stocks.snapshot.{old_generation}.db")
+        if not os.path.exists(old_path): break
+        try: os.remove(old_path)
+        except OSError: pass # Still open on Windows - removed on a later publish
+    return target
+
+def get_snapshot_generation() -> int:
+    """Reader side: generation the next cursor will come from at the least (opened or already required)."""
+    with _db_lock: return max(_snapshot_state['generation'], _snapshot_state['min_generation'])
+
+def require_snapshot_generation(generation: int):
+    """Reader side: the next cursor handed out must come from snapshot 'generation' or newer (read-your-writes)."""
+    with _db_lock: _snapshot_state['min_generation'] = max(_snapshot_state['min_generation'], generation)
+
+def wal_is_dirty() -> bool:
+    """True when the live DB has commits not yet checkpointed into the data file (i.e. not in any snapshot)."""
+    wal_path = Config.DB_PATH + '.wal'
+    return os.path.exists(wal_path) and os.path.getsize(wal_path) > 0
+
+def _open_snapshot_instance() -> duckdb.DuckDBPyConnection:
+    """Reader side: returns the instance for the newest snapshot, re-reading the pointer at most every SNAPSHOT_POLL_SECONDS."""
+    global _db_instance
+    now = time.monotonic()
+    with _db_lock:
+        stale = _db_instance is None or _snapshot_state['min_generation'] > _snapshot_state['generation']
+        if not stale and now - _snapshot_state['checked_at'] < Config.SNAPSHOT_POLL_SECONDS: return _db_instance
+        _snapshot_state['checked_at'] = now
+    pointer = read_snapshot_pointer()
+    if pointer is None:
+        if _db_instance is not None: return _db_instance
+        raise RuntimeError(f"No database snapshot published in {Config.SNAPSHOT_DIR} yet - is the ingest service (ingest.py) running?")
+    generation, path = pointer
+    with _db_lock:
+        if _db_instance is not None and generation <= _snapshot_state['generation']: return _db_instance
+        print(f"DB: Opening read-only snapshot generation {generation}: {path}")
+        _db_instance = duckdb.connect(database=path, read_only=True)
+        _snapshot_state['generation'] = generation; _db_stats['db_connects'] += 1
+        stale_cursors = _idle_cursors[False] + _idle_cursors[True]
+        _idle_cursors[False] = []; _idle_cursors[True] = []
+    for cursor in stale_cursors: _close_cursor(cursor) # The old instance closes once its last borrowed cursor is gone
+    return _db_instance
+
+def _get_db_instance() -> duckdb.DuckDBPyConnection:
+    """Returns the process-wide DuckDB instance, opening it on first use."""
+    global _db_instance
+    if is_reader_process(): return _open_snapshot_instance()
+    if _db_instance is not None: return _db_instance
+    with _db_lock:
+        if _db_instance is None:
+            try:
+                print(f"DB: Opening process-wide DuckDB instance at: {Config.DB_PATH}")
+                _db_instance = duckdb.connect(database=Config.DB_PATH, read_only=False)
+                if Config.DB_ACCESS_MODE == 'writer': # Snapshots copy the data file - only checkpoint in publish_snapshot
+                    _db_instance.execute("SET wal_autocheckpoint = '1TB'")
+                _db_stats['db_connects'] += 1
+                print("DB: DuckDB instance opened.")
+            except Exception as e:
+                print(f"DB: Error opening DuckDB instance: {e}")
+                raise # Reraise the exception
+    return _db_instance
+
+def checkpoint():
+    """Explicit CHECKPOINT that never overlaps a snapshot copy."""
+    with checkpoint_lock:
+        cursor = _get_db_instance().cursor()
+        try: cursor.execute("CHECKPOINT")
+        finally: cursor.close()
+
+def _acquire_cursor(read_only: bool) -> duckdb.DuckDBPyConnection:
+    """Takes an idle cursor from the pool, or creates a new one on the shared instance."""
+    instance = _get_db_instance()
+    with _db_lock:
+        pool = _idle_cursors[read_only]
+        if pool:
+            _db_stats['cursors_reused'] += 1
+            return pool.pop()
+    cursor = instance.cursor()
+    with _db_lock:
+        _db_stats['cursors_created'] += 1
+        if is_reader_process(): _cursor_generations[id(cursor)] = _snapshot_state['generation']
+    return cursor
+
+def _is_stale_cursor(cursor: duckdb.DuckDBPyConnection) -> bool:
+    if not is_reader_process(): return False
+    _open_snapshot_instance() # Rate-limited check for a newer snapshot
+    return _cursor_generations.get(id(cursor)) != _snapshot_state['generation']
+
+def _release_cursor(cursor: duckdb.DuckDBPyConnection, read_only: bool):
+    """Returns a cursor to the pool (or closes it if the pool is full)."""
+    if is_reader_process() and _cursor_generations.get(id(cursor)) != _snapshot_state['generation']:
+        _close_cursor(cursor); return # Belongs to a superseded snapshot
+    try:
+        if not read_only: cursor.rollback() # Drop any transaction left open by a failed request
+    except duckdb.Error: pass # No open transaction - nothing to roll back
+    except Exception as e:
+        print(f"DB: Discarding cursor that could not be reset: {e}")
+        _close_cursor(cursor); return
+    with _db_lock:
+        pool = _idle_cursors[read_only]
+        if len(pool) < Config.DB_CURSOR_POOL_SIZE:
+            pool.append(cursor); _db_stats['cursors_released'] += 1
+            return
+    _close_cursor(cursor)
+
+def _close_cursor(cursor: duckdb.DuckDBPyConnection):
+    try: cursor.close()
+    except Exception as e: print(f"DB: Error closing cursor: {e}")
+    with _db_lock: _db_stats['cursors_closed'] += 1; _cursor_generations.pop(id(cursor), None)
+
+def get_db_connection(read_only: bool = False):
+    """
+    Returns a DuckDB cursor for the current application context (or current thread when
+    called outside of Flask, e.g. from background jobs).
+    The cursor is borrowed from the process-wide instance; read_only=True hands out a
+    cursor from the separate query pool, used by query-only repository functions - a separate pool, NOT a read-only
+    connection: outside reader processes nothing stops a write on it (see _idle_cursors).
+    In a reader process every cursor is a read cursor on the newest snapshot (writes are forwarded, see ingest_service).
+    """
+    if is_reader_process(): read_only = True
+    if has_app_context():
+        ctx_key = '_database_query' if read_only else '_database'
+        cursor = g.get(ctx_key)
+        if cursor is not None and _is_stale_cursor(cursor): # A newer snapshot was published mid-request
+            g.pop(ctx_key); _release_cursor(cursor, read_only); cursor = None
+        if cursor is None:
+            cursor = _acquire_cursor(read_only)
+            setattr(g, ctx_key, cursor)
+        return cursor
+
+    attr = 'query_cursor' if read_only else 'write_cursor'
+    cursor = getattr(_thread_cursors, attr, None)
+    if cursor is not None and _is_stale_cursor(cursor):
+        setattr(_thread_cursors, attr, None); _release_cursor(cursor, read_only); cursor = None
+    if cursor is None:
+        cursor = _acquire_cursor(read_only)
+        setattr(_thread_cursors, attr, cursor)
+    return cursor
 
 def close_db_connection(exception=None):
-    """Closes the database connection stored in the current application context (g)."""
-    db = g.pop('_database', None) # Get connection from g, removing it
+    """Returns the cursors borrowed by the current application context (g) to the pool."""
+    for ctx_key, read_only in (('_database', False), ('_database_query', True)):
+        cursor = g.pop(ctx_key, None) # Get cursor from g, removing it
+        if cursor is not None: _release_cursor(cursor, read_only)
+
+def release_thread_connection():
+    """Returns the cursors held by the current (non-Flask) thread to the pool."""
+    for attr, read_only in (('write_cursor', False), ('query_cursor', True)):
+        cursor = getattr(_thread_cursors, attr, None)
+        if cursor is not None:
+            setattr(_thread_cursors, attr, None)
+            _release_cursor(cursor, read_only)
+
+def close_db():
+    """Closes all pooled cursors and the process-wide instance (after app startup and at process shutdown); the next use reopens it."""
+    global _db_instance
+    with _db_lock:
+        cursors = _idle_cursors[False] + _idle_cursors[True]
+        _idle_cursors[False] = []; _idle_cursors[True] = []
+        instance = _db_instance; _db_instance = None
+    for cursor in cursors: _close_cursor(cursor)
+    if instance is not None:
+        print("DB: Closing process-wide DuckDB instance.")
+        instance.close()
+        with _db_lock: _db_stats['db_closes'] += 1
 
-    if db is not None:
-        print("CONTEXT: Closing DuckDB connection.")
-        db.close()
+def get_db_stats() -> Dict[str, int]:
+    """Returns connect/close and cursor reuse counters for this process."""
+    with _db_lock:
+        stats = dict(_db_stats)
+        stats['idle_cursors'] = len(_idle_cursors[False]); stats['idle_query_cursors'] = len(_idle_cursors[True])
+        stats['pool_size'] = Config.DB_CURSOR_POOL_SIZE
+        stats['access_mode'] = Config.DB_ACCESS_MODE
+        if is_reader_process(): stats['snapshot_generation'] = _snapshot_state['generation']
+    return stats
 
-# We still need init_app or similar registration if we want to ensure
-# close_db_connection is called automatically.
-# The registration in app/__init__.py using app.teardown_appcontext(close_db_connection)
-# handles this - ensure that line is still present in app/__init__.py
+# close_db_connection is registered with app.teardown_appcontext in app/__init__.py so every
+# request hands its cursor back; close_db is registered with atexit there as well.
 
-print("DuckDB database module loaded (Using Flask g context)")
\ No newline at end of file
+print(f"DuckDB database module loaded (Process-wide instance, pooled cursors, mode={Config.DB_ACCESS_MODE})")
@@ -37,27 +37,15 @@ def get_indicator(indicator_name_with_params: str) -> Optional[Any]:
     indicator_class = reg_info['class']
 
     try:
-        # Basic parameter handling based on common patterns (can be improved)
-        if indicator_id == "SMA" and len(parts) == 2:
-            length = int(parts[1])
-            print(f"Factory: Creating {indicator_class.__name__}(length={length})")
-            return indicator_class(length=length)
-        # === Add elif blocks here for other indicators as needed ===
-        # elif indicator_id == "EMA" and len(parts) == 2:
-        #     length = int(parts[1])
-        #     print(f"Factory: Creating {indicator_class.__name__}(length={length})")
-        #     return indicator_class(length=length)
-        # elif indicator_id == "RSI" and len(parts) == 2:
-        #     # ... parse params ... create instance ...
-        #     pass
-        # elif indicator_id == "MACD" and len(parts) == 4:
-        #     # ... parse params ... create instance ...
-        #     pass
+        # Parameters follow the ID in constructor order: SMA_50, EMA_10, RSI_14, MACD_12_26_9
+        params = [int(p) for p in parts[1:] if p]
+        if params:
+            print(f"Factory: Creating {indicator_class.__name__}{tuple(params)}")
+            return indicator_class(*params)
         else:
-             # Attempt default instantiation if format unexpected or no params needed
-             # This might fail if __init__ requires arguments not provided
+             # No parameters given - use the class defaults (the registry's default_params)
              print(f"Factory: Attempting default instantiation for {indicator_class.__name__} (request: {indicator_name_with_params})")
-             return indicator_class() # Assumes default __init__ works if format is wrong/simple
+             return indicator_class()
 
     except (ValueError, IndexError, TypeError) as e:
         print(f"Factory: Error parsing parameters or instantiating '{indicator_name_with_params}': {e}")
@@ -76,6 +64,9 @@ def get_available_indicator_info() -> List[Dict]:
     print(f"Factory: Returning info for {len(available_list)} available indicators.")
     return available_list
 
+# Batched NumPy engine used by all indicator classes (and by the manager for a whole request at once)
+from .engine import IndicatorBatch, calculate_indicator_columns, calculate_indicators, max_lookback
+
 # --- IMPORTANT: Import indicator modules AFTER registry/functions are defined ---
 # This ensures the classes exist and the register_indicator function is ready
 # when the modules are loaded and try to register themselves.
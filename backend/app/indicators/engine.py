@@ -0,0 +1,204 @@
+# backend/app/indicators/engine.py
+# NumPy indicator engine: all requested indicators of a chart are computed in ONE pass over the close array instead of
+# one pandas_ta accessor call (and Series allocation) each. Shared intermediates are computed once per pass - every SMA
+# length comes from a single cumulative sum, EMAs are memoized per length (MACD reuses EMA_12/EMA_26 if also
+# requested) and RSI lengths share one price-change array. Results match pandas_ta 0.3.14b (non-TA-Lib mode):
+#   SMA  rolling mean, min_periods=length
+#   EMA  seeded with the SMA of the first `length` closes, then ewm(span=length, adjust=False)
+#   RSI  Wilder's RMA: ewm(alpha=1/length, adjust=True, min_periods=length) of gains/losses
+#   MACD EMA(fast) - EMA(slow); signal = EMA(signal) of the MACD line from its first valid value
+# Like pandas_ta, an indicator needs at least `length` rows (MACD: max(fast, slow, signal)) - else it yields nothing.
+# Each indicator also declares its lookback(): bars needed before the first output bar for a settled value. The manager
+# reads that much extra history, computes, and trims back to the requested range.
+# The recursive ones (EMA, RSI, MACD) can also continue from a state snapshot: state(batch) captures what they need after
+# the batch's last bar (JSON-able), step(state, close) advances one new bar in O(1) - see stocks/indicator_state.py.
+
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+print("Indicator engine module loaded (NumPy, batched)")
+
+SCAN_MAX_EXPONENT = 300.0 # Scan blocks keep decay**-i below e**300, far from float64 overflow
+WARMUP_TIME_CONSTANTS = 10 # Recursive warm-up: the seed's weight has decayed to e**-10 (~5e-5) at the first output bar
+
+# --- Lookback (warm-up bars) ---
+def ema_lookback(length: int) -> int:
+    """SMA seed (length-1 bars) + WARMUP_TIME_CONSTANTS time constants of span=length smoothing ((length+1)/2 bars each)."""
+    return length - 1 + int(np.ceil(WARMUP_TIME_CONSTANTS * (length + 1) / 2))
+
+def rma_lookback(length: int) -> int:
+    """One bar for the price change + min_periods + WARMUP_TIME_CONSTANTS time constants of alpha=1/length smoothing."""
+    return length + WARMUP_TIME_CONSTANTS * length
+
+def max_lookback(indicators: List[Any]) -> int:
+    return max((indicator.lookback() for indicator in indicators), default=0)
+
+# --- Kernels ---
+def linear_scan(b: np.ndarray, decay: float, y0: float = 0.0) -> np.ndarray:
+    """
+    y[t] = decay * y[t-1] + b[t] with y[-1] = y0, vectorized: within a block, y[j] = (decay*y0 + cumsum(b * decay**-i))[j] / decay**-j.
+    Blocks are short enough for decay**-i to stay finite; the error stays at float64 rounding of the smoothed magnitude.
+    """
+    n = len(b); out = np.empty(n)
+    if n == 0: return out
+    if decay <= 0.0: out[:] = b; return out
+    block = n if decay >= 1.0 else max(1, min(n, int(SCAN_MAX_EXPONENT / -np.log(decay))))
+    powers = np.power(decay, -np.arange(block, dtype=np.float64))
+    prev = y0
+    for start in range(0, n, block):
+        seg = b[start:start + block]; p = powers[:len(seg)]
+        out[start:start + len(seg)] = (decay * prev + np.cumsum(seg * p)) / p
+        prev = out[start + len(seg) - 1]
+    return out
+
+def rolling_means(close: np.ndarray, lengths: Iterable[int]) -> Dict[int, np.ndarray]:
+    """Rolling means (min_periods=length) for every length from ONE cumulative sum; NaN closes are skipped like pandas."""
+    n = len(close); valid = ~np.isnan(close)
+    base = close[valid][0] if valid.any() else 0.0 # Summing deviations keeps the cumulative sum small (less rounding)
+    sums = np.concatenate(([0.0], np.cumsum(np.where(valid, close - base, 0.0))))
+    counts = np.concatenate(([0], np.cumsum(valid))) if not valid.all() else None
+    means = {}
+    for length in lengths:
+        out = np.full(n, np.nan)
+        if length <= n:
+            window_sums = sums[length:] - sums[:-length]
+            if counts is None: out[length - 1:] = window_sums / length + base
+            else:
+                window_counts = counts[length:] - counts[:-length]
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    out[length - 1:] = np.where(window_counts >= length, window_sums / window_counts + base, np.nan)
+        means[length] = out
+    return means
+
+def ema(close: np.ndarray, length: int, raw: Optional[np.ndarray] = None) -> np.ndarray:
+    """SMA-seeded EMA (pandas_ta default); NaN before index length-1. The seed is averaged in raw's dtype (float32 columns), like pandas."""
+    n = len(close); out = np.full(n, np.nan); raw = close if raw is None else raw
+    if np.isnan(close).any(): # Gaps: ewm's NaN weighting is not a plain recursion - let pandas do it
+        seeded = pd.Series(close).copy(); seeded.iloc[length - 1] = pd.Series(raw[:length]).mean(); seeded.iloc[:length - 1] = np.nan
+        return seeded.ewm(span=length, adjust=False).mean().to_numpy()
+    alpha = 2.0 / (length + 1)
+    out[length - 1] = raw[:length].mean()
+    out[length:] = linear_scan(alpha * close[length:], 1.0 - alpha, out[length - 1])
+    return out
+
+def rma(values: np.ndarray, length: int, first: int) -> np.ndarray:
+    """Wilder's moving average = ewm(alpha=1/length, adjust=True, min_periods=length) of values[first:] (NaN before)."""
+    n = len(values); out = np.full(n, np.nan)
+    tail = values[first:]
+    if np.isnan(tail).any():
+        out[first:] = pd.Series(tail).ewm(alpha=1.0 / length, min_periods=length).mean().to_numpy(); return out
+    decay = 1.0 - 1.0 / length
+    observations = np.arange(1, len(tail) + 1, dtype=np.float64)
+    weights = (1.0 - np.power(decay, observations)) / (1.0 - decay) if decay > 0.0 else np.ones(len(tail)) # adjust=True denominator
+    smoothed = linear_scan(tail, decay) / weights
+    smoothed[:length - 1] = np.nan
+    out[first:] = smoothed
+    return out
+
+# --- One Pass ---
+class IndicatorBatch:
+    """Shared state of one engine pass over a close array; each intermediate is computed at most once."""
+
+    def __init__(self, close: Any):
+        raw = np.asarray(close); self.raw = raw if raw.dtype.kind == 'f' else raw.astype(np.float64)
+        self.close = self.raw.astype(np.float64, copy=False); self.n = len(self.close) # Float32 price columns are widened once
+        self._sma: Dict[int, np.ndarray] = {}; self._ema: Dict[int, np.ndarray] = {}; self._rsi: Dict[int, np.ndarray] = {}
+        self._changes: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def prepare(self, requirements: Dict[str, Set[int]]):
+        """Batch-computes what the pass's indicators declared (Indicator.requires()) - all SMA lengths in one cumsum."""
+        sma_lengths = [length for length in requirements.get('sma', ()) if length not in self._sma and length <= self.n]
+        if sma_lengths: self._sma.update(rolling_means(self.close, sma_lengths))
+
+    def sma(self, length: int) -> Optional[np.ndarray]:
+        if length > self.n: return None
+        if length not in self._sma: self._sma.update(rolling_means(self.close, [length]))
+        return self._sma[length]
+
+    def ema(self, length: int) -> Optional[np.ndarray]:
+        if length > self.n: return None
+        if length not in self._ema: self._ema[length] = ema(self.close, length, self.raw)
+        return self._ema[length]
+
+    def rsi(self, length: int, scalar: float = 100.0) -> Optional[np.ndarray]:
+        if length > self.n: return None
+        if length not in self._rsi:
+            if self._changes is None: # Gains and losses (as magnitudes) of close.diff(1), shared by all RSI lengths
+                diff = np.empty(self.n); diff[0] = np.nan; diff[1:] = np.diff(self.raw) # In the column's dtype, like Series.diff()
+                self._changes = (np.where(diff > 0, diff, np.where(np.isnan(diff), np.nan, 0.0)),
+                                 np.where(diff < 0, -diff, np.where(np.isnan(diff), np.nan, 0.0)))
+            gains, losses = self._changes
+            avg_gain = rma(gains, length, 1); avg_loss = rma(losses, length, 1)
+            with np.errstate(invalid='ignore', divide='ignore'): self._rsi[length] = scalar * avg_gain / (avg_gain + avg_loss)
+        return self._rsi[length]
+
+    def macd(self, fast: int, slow: int, signal: int) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """(macd line, histogram, signal line); None when the MACD line is shorter than the signal length."""
+        fast, slow = min(fast, slow), max(fast, slow) # pandas_ta swaps them too
+        if max(slow, signal) > self.n or self.n - (slow - 1) < signal: return None
+        line = self.ema(fast) - self.ema(slow)
+        signal_line = np.full(self.n, np.nan); signal_line[slow - 1:] = ema(line[slow - 1:], signal)
+        return line, line - signal_line, signal_line
+
+# --- Incremental State ---
+# States are plain dicts of floats/lists (stored as JSON). Stepping reproduces the batch kernels bar by bar: the EMA
+# seed is the mean of the first `length` values, RSI keeps the adjust=True numerators of its gain/loss averages.
+def ema_state(values: np.ndarray, length: int, smoothed: Optional[np.ndarray]) -> Dict[str, Any]:
+    """State after values (smoothed = their EMA, None if too short): the seed values until `length` are seen, then the last EMA."""
+    n = len(values)
+    if n < length or smoothed is None: return {'n': n, 'seed': [float(v) for v in values], 'value': None}
+    return {'n': n, 'seed': [], 'value': float(smoothed[-1])}
+
+def ema_step(state: Dict[str, Any], value: float, length: int) -> Tuple[float, Dict[str, Any]]:
+    n = state['n'] + 1; value = float(value)
+    if n < length: return np.nan, {'n': n, 'seed': state['seed'] + [value], 'value': None}
+    if n == length: smoothed = float(np.mean(state['seed'] + [value]))
+    else: alpha = 2.0 / (length + 1); smoothed = (1.0 - alpha) * state['value'] + alpha * value
+    return smoothed, {'n': n, 'seed': [], 'value': smoothed}
+
+def rsi_state(close: np.ndarray, length: int) -> Dict[str, Any]:
+    """State after close: the last close and the decayed sums of gains/losses (their ratio is the RSI)."""
+    n = len(close)
+    if n == 0: return {'n': 0, 'prev': None, 'gain': 0.0, 'loss': 0.0}
+    diff = np.diff(close); decay = 1.0 - 1.0 / length
+    gain = linear_scan(np.where(diff > 0, diff, 0.0), decay); loss = linear_scan(np.where(diff < 0, -diff, 0.0), decay)
+    return {'n': n, 'prev': float(close[-1]), 'gain': float(gain[-1]) if n > 1 else 0.0, 'loss': float(loss[-1]) if n > 1 else 0.0}
+
+def rsi_step(state: Dict[str, Any], close: float, length: int, scalar: float = 100.0) -> Tuple[float, Dict[str, Any]]:
+    close = float(close); n = state['n'] + 1
+    if state['prev'] is None: return np.nan, {'n': n, 'prev': close, 'gain': 0.0, 'loss': 0.0}
+    diff = close - state['prev']; decay = 1.0 - 1.0 / length
+    gain = decay * state['gain'] + max(diff, 0.0); loss = decay * state['loss'] + max(-diff, 0.0)
+    # avg_gain / (avg_gain + avg_loss): the adjust=True denominators cancel; min_periods counts price changes (n - 1)
+    value = scalar * gain / (gain + loss) if n - 1 >= length and gain + loss > 0 else np.nan
+    return value, {'n': n, 'prev': close, 'gain': gain, 'loss': loss}
+
+def collect_requirements(indicators: List[Any]) -> Dict[str, Set[int]]:
+    requirements: Dict[str, Set[int]] = {}
+    for indicator in indicators:
+        for kind, lengths in indicator.requires().items(): requirements.setdefault(kind, set()).update(lengths)
+    return requirements
+
+def calculate_indicator_columns(df: pd.DataFrame, indicators: List[Any]) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Computes every indicator over df['close'] in one pass; returns {indicator.get_column_name(): {column: values}}.
+    Indicators with too little data or a calculation error are skipped (logged), like a None from pandas_ta.
+    """
+    if df is None or 'close' not in df.columns or not indicators: return {}
+    batch = IndicatorBatch(df['close'].to_numpy())
+    batch.prepare(collect_requirements(indicators))
+    results: Dict[str, Dict[str, np.ndarray]] = {}
+    for indicator in indicators:
+        try: result = indicator.compute(batch)
+        except Exception as e: print(f"Error calculating {indicator.get_column_name()}: {e}"); continue
+        if result is None: print(f"Warning: Not enough rows ({batch.n}) for {indicator.get_column_name()}."); continue
+        results[indicator.get_column_name()] = result
+    print(f"Indicator engine: {sum(len(r) for r in results.values())} columns from {len(indicators)} indicators over {batch.n} rows.")
+    return results
+
+def calculate_indicators(df: pd.DataFrame, indicators: List[Any]) -> pd.DataFrame:
+    """calculate_indicator_columns() as one frame of columns, indexed like df."""
+    results = calculate_indicator_columns(df, indicators)
+    return pd.DataFrame({col: values for result in results.values() for col, values in result.items()}, index=df.index if df is not None else None)
@@ -1,7 +1,8 @@
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 from . import register_indicator
+from .engine import IndicatorBatch, calculate_indicators, ema_lookback, ema_state, ema_step
 
 print("MACD indicator module loaded.")
 
@@ -9,27 +10,52 @@ class MACDIndicator:
     indicator_name = "MACD"
 
     def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        if min(fast, slow, signal) <= 0:
+            raise ValueError("MACD periods must be positive.")
         self.fast = fast
         self.slow = slow
         self.signal = signal
         self.prefix = f"{self.indicator_name}_{self.fast}_{self.slow}_{self.signal}"
 
+    def requires(self) -> Dict[str, Tuple[int, ...]]:
+        return {'ema': (self.fast, self.slow)}
+
+    def lookback(self) -> int:
+        return ema_lookback(max(self.fast, self.slow)) + ema_lookback(self.signal) # Signal EMA starts where the MACD line does
+
+    def compute(self, batch: IndicatorBatch) -> Optional[Dict[str, np.ndarray]]:
+        result = batch.macd(self.fast, self.slow, self.signal)
+        if result is None: return None
+        line, histogram, signal_line = result
+        # Same columns as the pandas_ta version, which renamed df.ta.macd()'s (MACD, MACDh, MACDs) by position -
+        # so '_signal' holds the histogram and '_hist' the signal line. Kept as-is for existing clients.
+        return {f"{self.prefix}_line": line, f"{self.prefix}_signal": histogram, f"{self.prefix}_hist": signal_line}
+
+    def state(self, batch: IndicatorBatch) -> Dict[str, Any]:
+        """Snapshot after the batch's last bar, for step(): both EMAs and the signal EMA of the MACD line."""
+        fast, slow = min(self.fast, self.slow), max(self.fast, self.slow)
+        signal_state = ema_state(np.empty(0), self.signal, None)
+        if batch.n >= slow: # The MACD line (and its signal EMA) starts at the slow EMA's first value
+            result = batch.macd(self.fast, self.slow, self.signal)
+            line = batch.ema(fast) - batch.ema(slow)
+            signal_state = ema_state(line[slow - 1:], self.signal, result[2][slow - 1:] if result is not None else None)
+        return {'fast': ema_state(batch.close, fast, batch.ema(fast)), 'slow': ema_state(batch.close, slow, batch.ema(slow)), 'signal': signal_state}
+
+    def step(self, state: Dict[str, Any], close: float) -> Tuple[Dict[str, float], Dict[str, Any]]:
+        """Advances one new bar in O(1): (this bar's values, the next state)."""
+        fast, slow = min(self.fast, self.slow), max(self.fast, self.slow)
+        fast_value, fast_state = ema_step(state['fast'], close, fast)
+        slow_value, slow_state = ema_step(state['slow'], close, slow)
+        line = fast_value - slow_value; signal_value, signal_state = np.nan, state['signal']
+        if not np.isnan(line): signal_value, signal_state = ema_step(state['signal'], line, self.signal)
+        values = {f"{self.prefix}_line": line, f"{self.prefix}_signal": line - signal_value, f"{self.prefix}_hist": signal_value} # Swapped naming, as in compute()
+        return values, {'fast': fast_state, 'slow': slow_state, 'signal': signal_state}
+
     def calculate(self, df: pd.DataFrame) -> Optional[pd.DataFrame]:
         if df is None or 'close' not in df.columns:
             return None
-        try:
-            macd_df = df.ta.macd(fast=self.fast, slow=self.slow, signal=self.signal)
-            if macd_df is not None:
-                # Rename columns to unique names based on input config
-                macd_df = macd_df.rename(columns={
-                    macd_df.columns[0]: f"{self.prefix}_line",
-                    macd_df.columns[1]: f"{self.prefix}_signal",
-                    macd_df.columns[2]: f"{self.prefix}_hist"
-                })
-                return macd_df
-        except Exception as e:
-            print(f"Error calculating MACD: {e}")
-        return None
+        columns = calculate_indicators(df, [self])
+        return columns if len(columns.columns) else None
 
     def get_column_name(self) -> str:
         return self.prefix  # Used only for display/ID, not for direct column insertion
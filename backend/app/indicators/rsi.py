@@ -1,7 +1,8 @@
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
-from typing import Optional
+from typing import Any, Dict, Optional, Tuple
 from . import register_indicator
+from .engine import IndicatorBatch, calculate_indicators, rma_lookback, rsi_state, rsi_step
 
 print("RSI indicator module loaded.")
 
@@ -15,16 +16,29 @@ class RSIIndicator:
         self.length = length
         self.column_name = f"{self.indicator_name}_{self.length}"
 
+    def requires(self) -> Dict[str, Tuple[int, ...]]:
+        return {'rsi': (self.length,)}
+
+    def lookback(self) -> int:
+        return rma_lookback(self.length)
+
+    def compute(self, batch: IndicatorBatch) -> Optional[Dict[str, np.ndarray]]:
+        values = batch.rsi(self.length)
+        return None if values is None else {self.column_name: values}
+
+    def state(self, batch: IndicatorBatch) -> Dict[str, Any]:
+        """Snapshot after the batch's last bar, for step()."""
+        return rsi_state(batch.close, self.length)
+
+    def step(self, state: Dict[str, Any], close: float) -> Tuple[Dict[str, float], Dict[str, Any]]:
+        """Advances one new bar in O(1): (this bar's values, the next state)."""
+        value, state = rsi_step(state, close, self.length)
+        return {self.column_name: value}, state
+
     def calculate(self, df: pd.DataFrame) -> Optional[pd.Series]:
         if df is None or 'close' not in df.columns: return None
-        try:
-            rsi_series = df.ta.rsi(length=self.length)
-            if rsi_series is not None:
-                rsi_series.name = self.column_name
-                return rsi_series
-        except Exception as e:
-            print(f"Error calculating {self.column_name}: {e}")
-        return None
+        columns = calculate_indicators(df, [self])
+        return columns[self.column_name] if self.column_name in columns else None
 
     def get_column_name(self) -> str:
         return self.column_name
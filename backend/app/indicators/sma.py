@@ -1,10 +1,11 @@
 # backend/app/indicators/sma.py
+import numpy as np
 import pandas as pd
-import pandas_ta as ta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 # --- IMPORTANT: Import the registry function ---
 from . import register_indicator
+from .engine import IndicatorBatch, calculate_indicators
 
 print("SMA indicator module loaded (Class-based)")
 
@@ -19,20 +20,24 @@ class SMAIndicator:
         self.length = length
         self.column_name = f"{self.indicator_name}_{self.length}"
 
+    def requires(self) -> Dict[str, Tuple[int, ...]]:
+        return {'sma': (self.length,)} # All SMA lengths of a pass come from one cumulative sum
+
+    def lookback(self) -> int:
+        return self.length - 1 # Exact: the first full window
+
+    def compute(self, batch: IndicatorBatch) -> Optional[Dict[str, np.ndarray]]:
+        values = batch.sma(self.length)
+        return None if values is None else {self.column_name: values}
+
     def calculate(self, df: pd.DataFrame) -> Optional[pd.Series]:
-        # ... (calculation logic) ...
         if df is None or not isinstance(df, pd.DataFrame): return None
         if 'close' not in df.columns: return None
         if len(df) < self.length: print(f"Warning calculating {self.column_name}...")
-        try:
-            sma_series = df.ta.sma(length=self.length)
-            if sma_series is None: return None
-            if sma_series.name != self.column_name: sma_series.rename(self.column_name, inplace=True)
-            print(f"{self.column_name} calculation successful.")
-            return sma_series
-        except Exception as e:
-            print(f"Error calculating {self.column_name}: {e}")
-            return None
+        columns = calculate_indicators(df, [self])
+        if self.column_name not in columns: return None
+        print(f"{self.column_name} calculation successful.")
+        return columns[self.column_name]
 
     def get_column_name(self) -> str:
         return self.column_name
@@ -0,0 +1,252 @@
+# backend/app/ingest_service.py
+# Single-writer ingestion: ONE process (ingest.py, DB_ACCESS_MODE='writer') owns the DuckDB file. Reader processes
+# (web workers, DB_ACCESS_MODE='reader') send repository writes to it over a local multiprocessing connection; the
+# writer applies them one at a time from a queue and publishes read-only snapshots the readers switch to.
+# A write is acknowledged as soon as it commits; a snapshot is published at most once per SNAPSHOT_INTERVAL_SECONDS,
+# and only while the WAL is dirty. Requests never trigger one: chart requests overlay the bars their process stored on
+# the snapshot read (stocks/pending_bars.py); batch jobs that must read their own writes wait with sync_writes().
+# Cost: each snapshot is a CHECKPOINT plus a full copy of the DB file - per GB of database 1 GB read + 1 GB written,
+# e.g. a 4 GB DB republished every 30 s while writes arrive is ~270 MB/s of sustained IO. Every reader also opens the
+# new file cold (its DuckDB buffer cache starts empty). Size SNAPSHOT_INTERVAL_SECONDS to the DB; each publish is logged.
+# Messages are JSON (DataFrames/Arrow tables as Arrow IPC), never pickles, and the connection is authenticated with
+# INGEST_SERVICE_AUTHKEY - 'writer'/'reader' processes refuse to start without it.
+
+import base64
+import dataclasses
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from datetime import date, datetime
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from app.config import Config
+from app import database
+from app.stocks.models import Stock
+
+def require_authkey() -> bytes:
+    if not Config.INGEST_SERVICE_AUTHKEY:
+        raise RuntimeError(f"INGEST_SERVICE_AUTHKEY is not set - refusing to run in DB_ACCESS_MODE='{Config.DB_ACCESS_MODE}' without "
+                           "an explicit shared secret for the ingest service (set the same value for ingest.py and its readers)")
+    return Config.INGEST_SERVICE_AUTHKEY.encode()
+
+if Config.DB_ACCESS_MODE in ('writer', 'reader'): require_authkey() # Fail at startup, not on the first forwarded write
+
+print("Ingest service module loaded")
+
+# --- Wire Format ---
+# Each message is one JSON document. Values JSON has no type for are tagged: {"__frame__": ...} (DataFrame, index and
+# dtypes preserved), {"__arrow__": ...} (pyarrow Table/RecordBatch), {"__datetime__"/"__date__": ISO}, {"__stock__": fields}.
+def _arrow_ipc(table: pa.Table) -> str:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer: writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+def _read_arrow_ipc(payload: str) -> pa.Table:
+    return pa.ipc.open_stream(base64.b64decode(payload)).read_all()
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, pd.DataFrame): return {'__frame__': _arrow_ipc(pa.Table.from_pandas(value))}
+    if isinstance(value, pa.RecordBatch): value = pa.Table.from_batches([value])
+    if isinstance(value, pa.Table): return {'__arrow__': _arrow_ipc(value)}
+    if isinstance(value, datetime): return {'__datetime__': value.isoformat()} # Includes pd.Timestamp
+    if isinstance(value, date): return {'__date__': value.isoformat()}
+    if isinstance(value, Stock): return {'__stock__': dataclasses.asdict(value)}
+    if isinstance(value, np.ndarray): return value.tolist()
+    if isinstance(value, np.generic): return value.item()
+    raise TypeError(f"Cannot send {type(value).__name__} to the ingest service")
+
+def _decode_value(obj: Dict[str, Any]) -> Any:
+    if len(obj) != 1: return obj
+    key, value = next(iter(obj.items()))
+    if key == '__frame__': return _read_arrow_ipc(value).to_pandas()
+    if key == '__arrow__': return _read_arrow_ipc(value)
+    if key == '__datetime__': return datetime.fromisoformat(value)
+    if key == '__date__': return date.fromisoformat(value)
+    if key == '__stock__': return Stock(**value)
+    return obj
+
+def _send(conn, message: Any): conn.send_bytes(json.dumps(message, default=_encode_value).encode('utf-8'))
+
+def _recv(conn) -> Any: return json.loads(conn.recv_bytes(), object_hook=_decode_value)
+
+# --- Write Operation Registry ---
+WRITE_OPERATIONS: Dict[str, Callable] = {} # name -> undecorated repository function (executed by the writer)
+SNAPSHOT_REQUEST = '__snapshot__' # Not a write: waits for a snapshot of at least the given generation
+
+def writer_operation(failure_value: Any = None):
+    """
+    Marks a repository function as a write. In a reader process the call is forwarded to the writer process and
+    returns its result (or failure_value if the writer is unreachable); elsewhere it runs locally.
+    """
+    def decorator(func: Callable) -> Callable:
+        WRITE_OPERATIONS[func.__name__] = func
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not database.is_reader_process(): return func(*args, **kwargs)
+            return _call_writer(func.__name__, args, kwargs, failure_value)
+        return wrapper
+    return decorator
+
+# --- Reader Side (Client) ---
+_client_local = threading.local() # One persistent connection per reader thread
+_written = {'generation': 0} # First snapshot generation that contains every write this process forwarded
+_written_lock = threading.Lock()
+
+def _writer_connection():
+    conn = getattr(_client_local, 'conn', None)
+    if conn is None:
+        conn = Client((Config.INGEST_SERVICE_HOST, Config.INGEST_SERVICE_PORT), authkey=require_authkey())
+        _client_local.conn = conn
+    return conn
+
+def _request_writer(op_name: str, args: tuple, kwargs: dict) -> Optional[tuple]:
+    """One request/reply with the writer: (status, result, generation), or None if it is unreachable."""
+    for attempt in range(2): # Reconnect once if the writer was restarted
+        try:
+            conn = _writer_connection()
+            _send(conn, [op_name, args, kwargs])
+            return tuple(_recv(conn))
+        except (OSError, EOFError, AuthenticationError) as e:
+            _client_local.conn = None
+            if attempt == 1: print(f"Ingest client: Writer unreachable for {op_name} ({e}).")
+    return None
+
+def _call_writer(op_name: str, args: tuple, kwargs: dict, failure_value: Any) -> Any:
+    """Sends one write to the writer and returns its result once committed (not yet visible in our snapshot)."""
+    reply = _request_writer(op_name, args, kwargs)
+    if reply is None: return failure_value
+    status, result, generation = reply
+    if status != 'ok': print(f"Ingest client: Writer failed {op_name}: {result}"); return failure_value
+    with _written_lock: _written['generation'] = max(_written['generation'], generation)
+    return result
+
+def written_generation() -> int:
+    """First snapshot generation that contains every write this process forwarded so far."""
+    return _written['generation']
+
+def sync_writes() -> bool:
+    """
+    Read-your-writes for batch jobs: makes the next cursor of this process come from a snapshot containing every write
+    it forwarded, waiting for the writer's next scheduled publish (up to SNAPSHOT_INTERVAL_SECONDS) if needed - not for
+    request paths. A no-op (no round trip) outside reader processes or when the current snapshot already has them.
+    False if the writer is unreachable.
+    """
+    if not database.is_reader_process(): return True
+    target = _written['generation']
+    if target <= database.get_snapshot_generation(): return True
+    reply = _request_writer(SNAPSHOT_REQUEST, (target,), {})
+    if reply is None or reply[0] != 'ok': return False
+    database.require_snapshot_generation(reply[2])
+    return True
+
+# --- Writer Side (Service) ---
+class IngestService:
+    """Accepts forwarded writes, applies them serially on one worker thread and publishes snapshots."""
+
+    def __init__(self):
+        self._jobs: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._publish_cond = threading.Condition()
+        self._publishing = False # A checkpoint + copy is running: commits made meanwhile may miss it
+        pointer = database.read_snapshot_pointer()
+        self.generation = pointer[0] if pointer else 0
+        self._force_publish = True # The DB may have changed since the last snapshot (e.g. used in 'single' mode meanwhile)
+        self.stats = {'ops': 0, 'op_errors': 0, 'snapshots': 0, 'last_snapshot_seconds': None, 'last_snapshot_bytes': None, 'snapshot_bytes_copied': 0}
+        self._stop = threading.Event()
+
+    # Worker: the only thread executing forwarded writes
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None: return
+            op_name, args, kwargs, future = job
+            try: future.set_result(WRITE_OPERATIONS[op_name](*args, **kwargs))
+            except Exception as e: traceback.print_exc(); future.set_exception(e)
+            finally: database.release_thread_connection()
+
+    # Publisher: the only trigger - checks right away (initial snapshot), then every SNAPSHOT_INTERVAL_SECONDS
+    def _publisher(self):
+        while not self._stop.is_set():
+            if database.wal_is_dirty() or self._force_publish: self._publish()
+            self._stop.wait(Config.SNAPSHOT_INTERVAL_SECONDS)
+
+    def _publish(self):
+        started = time.perf_counter()
+        with self._publish_cond: self._publishing = True
+        try:
+            for attempt in range(600): # CHECKPOINT refuses while another write transaction is open - retry for up to a minute
+                try: path = database.publish_snapshot(self.generation + 1); break
+                except Exception as e:
+                    if attempt == 599: print(f"Ingest service: Snapshot publish failed: {e}"); return
+                    time.sleep(0.1)
+            size = os.path.getsize(path)
+            with self._publish_cond:
+                self.generation += 1; self.stats['snapshots'] += 1; self._force_publish = False
+                self.stats['last_snapshot_seconds'] = round(time.perf_counter() - started, 3)
+                self.stats['last_snapshot_bytes'] = size; self.stats['snapshot_bytes_copied'] += size
+        finally:
+            with self._publish_cond: self._publishing = False; self._publish_cond.notify_all()
+        seconds = self.stats['last_snapshot_seconds']
+        print(f"Ingest service: Published snapshot {self.generation} ({path}): copied {size / 2**20:.1f} MB in {seconds}s "
+              f"({size / 2**20 / max(seconds, 1e-3):.0f} MB/s; {self.stats['snapshot_bytes_copied'] / 2**30:.2f} GB since start)")
+
+    def committed_generation(self) -> int:
+        """First snapshot generation that will contain everything committed so far (no waiting)."""
+        with self._publish_cond:
+            if self._publishing: return self.generation + 2 # The running publish may have checkpointed before the commit
+            return self.generation + 1 if database.wal_is_dirty() else self.generation
+
+    def wait_for_generation(self, target: int, timeout: Optional[float] = None) -> int:
+        """
+        Blocks until snapshot 'target' (or one with everything committed) is published by the regular schedule - never
+        publishes early - for up to the interval plus a minute; returns the current generation.
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else Config.SNAPSHOT_INTERVAL_SECONDS + 60)
+        with self._publish_cond:
+            while self.generation < target and not self._stop.is_set():
+                if not self._publishing and not database.wal_is_dirty(): break # Nothing committed is missing from the current one
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                self._publish_cond.wait(remaining)
+            return self.generation
+
+    # One thread per reader connection: queue its ops and reply once committed (snapshots are published separately)
+    def _serve_connection(self, conn):
+        try:
+            while True:
+                op_name, args, kwargs = _recv(conn)
+                if op_name == SNAPSHOT_REQUEST: _send(conn, ['ok', None, self.wait_for_generation(*args)]); continue
+                if op_name not in WRITE_OPERATIONS: _send(conn, ['error', f"Unknown write operation '{op_name}'", self.generation]); continue
+                future: Future = Future(); self._jobs.put((op_name, args, kwargs, future)); self.stats['ops'] += 1
+                try: result = future.result()
+                except Exception as e: self.stats['op_errors'] += 1; _send(conn, ['error', repr(e), self.generation]); continue
+                _send(conn, ['ok', result, self.committed_generation()])
+        except (EOFError, OSError): pass # Reader went away
+        except (ValueError, TypeError) as e: print(f"Ingest service: Dropped connection after a malformed message: {e}")
+        finally: conn.close()
+
+    def serve_forever(self):
+        authkey = require_authkey() # Before any thread starts: no service without an explicit secret
+        threading.Thread(target=self._worker, name='ingest-worker', daemon=True).start()
+        threading.Thread(target=self._publisher, name='ingest-snapshots', daemon=True).start() # Publishes the initial snapshot
+        address = (Config.INGEST_SERVICE_HOST, Config.INGEST_SERVICE_PORT)
+        with Listener(address, authkey=authkey) as listener:
+            print(f"Ingest service: Listening on {address[0]}:{address[1]} (snapshots in {Config.SNAPSHOT_DIR})")
+            while not self._stop.is_set():
+                try: conn = listener.accept()
+                except Exception as e: print(f"Ingest service: Rejected connection: {e}"); continue
+                threading.Thread(target=self._serve_connection, args=(conn,), name='ingest-conn', daemon=True).start()
+
+    def stop(self):
+        self._stop.set(); self._jobs.put(None)
+        with self._publish_cond: self._publish_cond.notify_all()
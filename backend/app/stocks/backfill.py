@@ -0,0 +1,172 @@
+# backend/app/stocks/backfill.py
+# Universe backfill: fetches metadata + history for many symbols through a worker pool. Upstream requests are paced by
+# the shared token buckets in ratelimit.py; per-symbol outcomes are stored (backfill_items) so a job can be resumed.
+# Workers fetch from Upstox only; symbols it fails for are fetched from yfinance afterwards in batches (one request
+# per Config.YF_BATCH_SIZE symbols) instead of one yfinance call per symbol.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from app.config import Config
+from app.database import release_thread_connection
+from app.ingest_service import sync_writes
+from . import repository
+from . import fetcher
+from .manager import stock_manager
+from .ratelimit import upstox_limiter, yfinance_limiter
+
+print("Backfill module loaded")
+
+BACKFILL_PROGRESS_SECONDS = 10 # Progress line at most this often
+
+def get_universe(exchange: str, symbols: Optional[List[str]] = None, limit: Optional[int] = None) -> List[str]:
+    """Explicit symbols, or every EQ instrument of the exchange from the instrument list; optionally the first `limit`."""
+    universe = [s.strip().upper() for s in symbols if s.strip()] if symbols else [item['symbol'] for item in fetcher.get_cached_instrument_list(exchange)]
+    return universe[:limit] if limit else universe
+
+def default_job_id(exchange: str, interval: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> str:
+    """Same arguments -> same job, so re-running an interrupted command resumes it. Built from the dates as given: the
+    defaults move with today, so an open range gets a fixed id and the job keeps the range it resolved first."""
+    return f"{exchange.upper()}-{interval.upper()}-{start_date or '10Y'}-{end_date or 'OPEN'}"
+
+class BackfillJob:
+    """One backfill run over the pending symbols of a job; run() blocks, start() runs it on a background thread."""
+
+    def __init__(self, job_id: str, exchange: str, symbols: List[str], interval: str, start_date: str, end_date: str,
+                 workers: Optional[int] = None):
+        self.job_id = job_id; self.exchange = exchange.upper(); self.symbols = symbols; self.interval = interval.upper()
+        self.start_date = start_date; self.end_date = end_date; self.workers = workers or Config.BACKFILL_WORKERS
+        self._lock = threading.Lock(); self._cancel = threading.Event(); self._thread: Optional[threading.Thread] = None
+        self.state = 'created'; self.pending_at_start = 0; self.done = 0; self.failed = 0; self.rows = 0
+        self.yf_fallback: List[str] = []; self.yf_batches = 0
+        self.started_at: Optional[float] = None; self.finished_at: Optional[float] = None; self._last_report = 0.0
+
+    # --- Worker ---
+    def _backfill_one(self, symbol: str):
+        if self._cancel.is_set(): return
+        try:
+            stock_info = fetcher.get_instrument_info(symbol, self.exchange) # Name/key from the instrument list - no per-symbol info call
+            rows = stock_manager.backfill_symbol(symbol, self.exchange, self.start_date, self.end_date, self.interval,
+                                                 stock_info=stock_info, yf_fallback=False)
+            error = None if rows is not None else "Fetch/store failed (see logs)"
+        except Exception as e: rows = None; error = repr(e)
+        finally: release_thread_connection()
+        if error is not None:
+            print(f"Backfill {self.job_id}: {symbol} failed from Upstox ({error}) - queued for the yfinance batch fallback")
+            with self._lock: self.yf_fallback.append(symbol)
+            return
+        self._record(symbol, rows, None)
+
+    def _backfill_yf_batches(self, symbols: List[str]):
+        """yfinance fallback for the symbols Upstox failed for, Config.YF_BATCH_SIZE symbols per request/ingest."""
+        batch_size = max(1, Config.YF_BATCH_SIZE); symbols = sorted(symbols)
+        print(f"Backfill {self.job_id}: {len(symbols)} symbols falling back to yfinance in batches of {batch_size}")
+        for offset in range(0, len(symbols), batch_size):
+            if self._cancel.is_set(): return
+            batch = symbols[offset:offset + batch_size]; error = None
+            try:
+                stock_infos = {symbol: fetcher.get_instrument_info(symbol, self.exchange) for symbol in batch}
+                results = stock_manager.backfill_yf_batch(batch, self.exchange, self.start_date, self.end_date, self.interval, stock_infos=stock_infos)
+            except Exception as e: results = {}; error = repr(e)
+            finally: release_thread_connection()
+            with self._lock: self.yf_batches += 1
+            for symbol in batch:
+                rows = results.get(symbol)
+                self._record(symbol, rows, error or (None if rows is not None else "Fetch/store failed from Upstox and yfinance (see logs)"))
+
+    def _record(self, symbol: str, rows: Optional[int], error: Optional[str]):
+        repository.mark_backfill_item(self.job_id, symbol, 'done' if error is None else 'failed', rows, error)
+        release_thread_connection()
+        with self._lock:
+            if error is None: self.done += 1; self.rows += rows
+            else: self.failed += 1
+            report = time.monotonic() - self._last_report >= BACKFILL_PROGRESS_SECONDS
+            if report: self._last_report = time.monotonic()
+        if error is not None: print(f"Backfill {self.job_id}: {symbol} failed: {error}")
+        if report: self._print_progress()
+
+    # --- Run ---
+    def run(self) -> Dict[str, Any]:
+        self.state = 'running'; self.started_at = time.time(); self._last_report = time.monotonic()
+        pending = repository.create_backfill_job(self.job_id, self.exchange, self.interval, self.start_date, self.end_date, self.symbols)
+        if pending is None: self.state = 'failed'; self.finished_at = time.time(); return self.progress()
+        sync_writes(); todo = repository.get_backfill_pending(self.job_id); release_thread_connection() # Reads the items just created
+        self.pending_at_start = len(todo)
+        print(f"Backfill {self.job_id}: {len(todo)} of {len(self.symbols)} symbols to do ({self.interval} [{self.start_date} to {self.end_date}], {self.workers} workers)")
+        with ThreadPoolExecutor(self.workers, thread_name_prefix='backfill') as pool:
+            list(pool.map(self._backfill_one, todo))
+        if self.yf_fallback and not self._cancel.is_set(): self._backfill_yf_batches(self.yf_fallback)
+        if self._cancel.is_set(): self.state = 'cancelled'
+        else:
+            self.state = 'finished'
+            if self.failed == 0: repository.finish_backfill_job(self.job_id); release_thread_connection()
+        self.finished_at = time.time(); self._print_progress()
+        return self.progress()
+
+    def start(self) -> 'BackfillJob':
+        self._thread = threading.Thread(target=self.run, name=f"backfill-{self.job_id}", daemon=True); self._thread.start()
+        return self
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Waits for a start()ed job; returns True once it has stopped."""
+        if self._thread is not None: self._thread.join(timeout)
+        return self._thread is None or not self._thread.is_alive()
+
+    def cancel(self): self._cancel.set() # Symbols already in flight finish; the rest stay pending for a resume
+
+    # --- Progress ---
+    def progress(self) -> Dict[str, Any]:
+        with self._lock:
+            elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+            processed = self.done + self.failed
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            remaining = self.pending_at_start - processed
+            return {'job_id': self.job_id, 'state': self.state, 'exchange': self.exchange, 'interval': self.interval,
+                    'start_date': self.start_date, 'end_date': self.end_date, 'workers': self.workers,
+                    'universe': len(self.symbols), 'to_do': self.pending_at_start, 'done': self.done, 'failed': self.failed,
+                    'remaining': remaining, 'rows_stored': self.rows, 'yf_fallback': len(self.yf_fallback), 'yf_batches': self.yf_batches, 'elapsed_seconds': round(elapsed, 1),
+                    'symbols_per_second': round(rate, 2), 'rows_per_second': round(self.rows / elapsed, 1) if elapsed > 0 else 0.0,
+                    'eta_seconds': round(remaining / rate) if rate > 0 and self.state == 'running' else None,
+                    'rate_limits': {'upstox': upstox_limiter.get_stats(), 'yfinance': yfinance_limiter.get_stats()}}
+
+    def _print_progress(self):
+        p = self.progress()
+        eta = f", ETA {p['eta_seconds']}s" if p['eta_seconds'] is not None else ""
+        print(f"Backfill {self.job_id} [{p['state']}]: {p['done'] + p['failed']}/{p['to_do']} symbols ({p['failed']} failed), "
+              f"{p['rows_stored']} rows, {p['symbols_per_second']} symbols/s, {p['rows_per_second']} rows/s{eta}")
+
+# --- Job Registry (jobs started by this process) ---
+_jobs: Dict[str, BackfillJob] = {}
+_jobs_lock = threading.Lock()
+
+def start_backfill(exchange: str = 'NSE', symbols: Optional[List[str]] = None, interval: str = '1D', start_date: Optional[str] = None,
+                   end_date: Optional[str] = None, workers: Optional[int] = None, limit: Optional[int] = None,
+                   job_id: Optional[str] = None, background: bool = True) -> Optional[BackfillJob]:
+    """Creates (or resumes) a backfill job; default range is the same 10 years as the on-demand bulk fetch."""
+    repository.get_storage_interval(interval) # Raises ValueError for unsupported intervals
+    job_id = job_id or default_job_id(exchange, interval, start_date, end_date)
+    stored = repository.get_backfill_job(job_id) # A resume keeps the stored range for dates left open
+    if stored is not None: start_date = start_date or str(stored['start_date']); end_date = end_date or str(stored['end_date'])
+    end_date = end_date or date.today().strftime('%Y-%m-%d')
+    start_date = start_date or (date.today() - timedelta(days=365 * 10)).strftime('%Y-%m-%d')
+    universe = get_universe(exchange, symbols, limit)
+    if not universe: print(f"Backfill: Empty universe for {exchange}."); return None
+    with _jobs_lock:
+        running = _jobs.get(job_id)
+        if running is not None and running.state in ('created', 'running'): print(f"Backfill {job_id}: Already running."); return running
+        job = _jobs[job_id] = BackfillJob(job_id, exchange, universe, interval, start_date, end_date, workers)
+        job.state = 'running' # Before the lock is released, so a concurrent start for the same id returns this job
+    if background: job.start()
+    else: job.run()
+    return job
+
+def get_backfill_progress(job_id: str) -> Optional[Dict[str, Any]]:
+    """Live progress for jobs of this process, else the stored summary (e.g. a job run from the CLI)."""
+    job = _jobs.get(job_id)
+    if job is not None: return job.progress()
+    stored = repository.get_backfill_job(job_id)
+    if stored is not None: stored['state'] = 'finished' if stored['finished_at'] else 'stopped'
+    return stored
@@ -0,0 +1,159 @@
+# backend/app/stocks/eod.py
+# End-of-day incremental update: after the close, every stock with stored daily bars gets only its NEW bars - fetched
+# from its newest stored bar on (re-fetched, in case it was a provisional bar stored during the session). Symbols go in
+# batches of Config.EOD_BATCH_SIZE: Upstox per symbol (concurrently, paced by the shared rate limiter), one batched
+# yfinance request for the symbols Upstox failed for, then ONE multi-symbol add_ohlcv_bulk per batch - a single
+# transaction that also re-aggregates the touched weekly/monthly bars. Coverage is recorded through today, so chart
+# requests the next day are served from the DB. EodScheduler runs it Mon-Fri at Config.EOD_UPDATE_TIME (IST).
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.config import Config
+from app.database import release_thread_connection
+from . import repository
+from . import fetcher
+from .sources import upstream_sources
+
+print("EOD updater module loaded")
+
+SCHEDULER_POLL_SECONDS = 60 # The scheduler re-reads the clock at least this often (survives suspend/clock changes)
+
+def now_ist() -> pd.Timestamp:
+    return pd.Timestamp.now(tz=fetcher.INTRADAY_TIMEZONE)
+
+def _update_time_today(now: pd.Timestamp) -> pd.Timestamp:
+    hour, minute = (int(part) for part in Config.EOD_UPDATE_TIME.split(':'))
+    return now.normalize() + pd.Timedelta(hours=hour, minutes=minute)
+
+def market_closed(now: pd.Timestamp) -> bool:
+    """True on weekends and after EOD_UPDATE_TIME - today's bar is final then."""
+    return now.weekday() >= 5 or now >= _update_time_today(now)
+
+# --- One Batch ---
+def _fetch_batch(exchange: str, last_dates: Dict[str, date], end_str: str) -> Dict[str, Optional[pd.DataFrame]]:
+    """Upstox per symbol, then the symbols it failed for from yfinance in one batched request; None = no source answered."""
+    def fetch_one(symbol: str) -> Tuple[str, Optional[pd.DataFrame]]:
+        try: frame, _ = upstream_sources.fetch_ohlcv(symbol, exchange, '1D', last_dates[symbol].strftime('%Y-%m-%d'), end_str, sources=['upstox'])
+        except Exception as e: print(f"EOD {exchange}: Upstox fetch raised for {symbol}: {e}"); frame = None
+        return symbol, frame
+    with ThreadPoolExecutor(max(1, min(Config.EOD_WORKERS, len(last_dates))), thread_name_prefix='eod') as pool:
+        frames = dict(pool.map(fetch_one, last_dates))
+    failed = [symbol for symbol, frame in frames.items() if frame is None]
+    if failed:
+        start_str = min(last_dates[symbol] for symbol in failed).strftime('%Y-%m-%d')
+        print(f"EOD {exchange}: {len(failed)} symbols failed from Upstox - fetching them from yfinance in batches")
+        yf_frames = fetcher.fetch_stock_data_yf_batch(failed, start_str, end_str, exchange, interval='1D')
+        frames.update({symbol: yf_frames.get(symbol) for symbol in failed})
+    return frames
+
+def _update_batch(exchange: str, last_dates: Dict[str, date], today: date, closed: bool) -> Tuple[int, List[str]]:
+    """Fetches and stores one batch; returns (bars inserted or revised, symbols no source answered for)."""
+    frames = _fetch_batch(exchange, last_dates, today.strftime('%Y-%m-%d'))
+    failed = [symbol for symbol, frame in frames.items() if frame is None]
+    new_bars = []
+    for symbol, frame in frames.items():
+        if frame is None or frame.empty: continue
+        frame = frame.set_axis(pd.to_datetime(frame.index)).rename_axis('date') # Upstox daily index holds date objects
+        frame = frame[frame.index >= pd.Timestamp(last_dates[symbol])] # yfinance batches span the whole batch's range
+        if not frame.empty: new_bars.append(frame.assign(symbol=symbol))
+    rows = 0
+    if new_bars:
+        counts = repository.add_ohlcv_bulk(None, exchange, pd.concat(new_bars), interval='1D')
+        if counts is None: print(f"EOD {exchange}: Storing the batch failed ({len(new_bars)} symbols)."); return 0, list(last_dates)
+        rows = counts['inserted'] + counts['updated']
+    coverage_end = today if closed else today - timedelta(days=1) # During the session today's bar is still provisional
+    for symbol, last_date in last_dates.items():
+        if symbol not in failed and last_date <= coverage_end: repository.record_coverage(symbol, exchange, '1D', last_date, coverage_end)
+    return rows, failed
+
+# --- Full Run ---
+_run_lock = threading.Lock()
+
+def run_eod_update(exchange: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """One incremental pass over every stored stock (or one exchange's). None if a run is already in progress."""
+    if not _run_lock.acquire(blocking=False): print("EOD: An update is already running."); return None
+    try:
+        started = now_ist(); started_local = datetime.now(); t0 = time.perf_counter()
+        today = started.date(); closed = market_closed(started)
+        stocks = repository.get_last_daily_bars(exchange)
+        by_exchange: Dict[str, Dict[str, date]] = {}
+        for symbol, stock_exchange, last_date in stocks: by_exchange.setdefault(stock_exchange, {})[symbol] = last_date
+        summary = {'run_date': today.isoformat(), 'market_closed': closed, 'symbols': len(stocks), 'batches': 0, 'rows_stored': 0, 'failed': 0}
+        print(f"EOD: Updating {len(stocks)} stocks through {today} ({'after close' if closed else 'during session'}), batches of {Config.EOD_BATCH_SIZE}...")
+        batch_size = max(1, Config.EOD_BATCH_SIZE)
+        for stock_exchange, last_dates in by_exchange.items():
+            symbols = list(last_dates)
+            for offset in range(0, len(symbols), batch_size):
+                batch = {symbol: last_dates[symbol] for symbol in symbols[offset:offset + batch_size]}
+                rows, failed = _update_batch(stock_exchange, batch, today, closed)
+                summary['batches'] += 1; summary['rows_stored'] += rows; summary['failed'] += len(failed)
+                if failed: print(f"EOD {stock_exchange}: No source answered for {len(failed)} symbols: {failed[:10]}")
+        summary['seconds'] = round(time.perf_counter() - t0, 1)
+        # Only a full run after the close counts as today's update (the scheduler's catch-up check reads it)
+        if closed and exchange is None: repository.record_eod_run(today, started_local, datetime.now(), summary['symbols'], summary['rows_stored'], summary['failed'])
+        print(f"EOD: Done - {summary['rows_stored']} bars stored for {summary['symbols']} stocks in {summary['batches']} batches "
+              f"({summary['failed']} failed, {summary['seconds']}s).")
+        return summary
+    finally:
+        release_thread_connection(); _run_lock.release()
+
+def start_eod_update(exchange: Optional[str] = None) -> bool:
+    """run_eod_update() on a background thread; False if a run is already in progress."""
+    if _run_lock.locked(): return False
+    threading.Thread(target=run_eod_update, args=(exchange,), name='eod-update', daemon=True).start()
+    return True
+
+# --- Scheduler ---
+class EodScheduler:
+    """Runs run_eod_update() Mon-Fri at Config.EOD_UPDATE_TIME (IST); on start, catches up today's run if it was missed."""
+
+    def __init__(self):
+        self._stop = threading.Event(); self._thread: Optional[threading.Thread] = None
+        self.next_run_at: Optional[pd.Timestamp] = None; self.last_result: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def next_run_after(now: pd.Timestamp) -> pd.Timestamp:
+        run_at = _update_time_today(now)
+        while run_at <= now or run_at.weekday() >= 5: run_at += pd.Timedelta(days=1)
+        return run_at
+
+    def _first_run_at(self, now: pd.Timestamp) -> pd.Timestamp:
+        """Now if today's run time has passed without a finished run (process was down at the close), else the next run time."""
+        if now.weekday() < 5 and now >= _update_time_today(now):
+            last_run = repository.get_last_eod_run(); release_thread_connection()
+            if last_run is None or last_run['run_date'] < now.date(): return now
+        return self.next_run_after(now)
+
+    def _loop(self):
+        self.next_run_at = self._first_run_at(now_ist())
+        print(f"EOD Scheduler: Next update at {self.next_run_at}")
+        while not self._stop.is_set():
+            wait_seconds = (self.next_run_at - now_ist()).total_seconds()
+            if wait_seconds > 0: self._stop.wait(min(wait_seconds, SCHEDULER_POLL_SECONDS)); continue
+            try: self.last_result = run_eod_update() or self.last_result
+            except Exception as e: print(f"EOD Scheduler: Update failed: {e}")
+            self.next_run_at = self.next_run_after(now_ist())
+            print(f"EOD Scheduler: Next update at {self.next_run_at}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive(): return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='eod-scheduler', daemon=True); self._thread.start()
+        print(f"EOD Scheduler: Started (Mon-Fri at {Config.EOD_UPDATE_TIME} {fetcher.INTRADAY_TIMEZONE}).")
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self) -> Dict[str, Any]:
+        return {'scheduled': self._thread is not None and self._thread.is_alive(), 'update_time': Config.EOD_UPDATE_TIME,
+                'next_run_at': self.next_run_at.isoformat() if self.next_run_at is not None else None,
+                'running': _run_lock.locked(), 'last_result': self.last_result, 'last_stored_run': repository.get_last_eod_run()}
+
+# --- Instantiate the scheduler ---
+eod_scheduler = EodScheduler()
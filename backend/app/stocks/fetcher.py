@@ -3,33 +3,24 @@
 
 import yfinance as yf
 import pandas as pd
-from typing import Optional, Dict, List, Any
+try: from yfinance import shared as yf_shared # Per-ticker download errors (private API) - yf.shared is not an attribute of the package
+except ImportError: yf_shared = None
+from typing import Optional, Dict, List, Any, Tuple
 from datetime import date, timedelta, datetime
-import time # Import time for cache age check
-import os
-import requests
-import json
-import gzip
-
-# --- Upstox SDK Imports ---
-try:
-    import upstox_client
-    from upstox_client.configuration import Configuration
-    from upstox_client.api_client import ApiClient
-    from upstox_client.rest import ApiException
-    from upstox_client.api.history_api import HistoryApi
-    print("Upstox SDK base and HistoryApi imported successfully.")
-    UPSTOX_SDK_AVAILABLE = True
-except ImportError as e:
-    print(f"WARNING: Failed to import Upstox SDK components ({e}). Upstox fetching will fail.")
-    upstox_client = None; Configuration = None; ApiClient = None; ApiException = Exception; HistoryApi = None
-    UPSTOX_SDK_AVAILABLE = False
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # --- App Config ---
 # Config import needed ONLY for access token, not basedir anymore
 from app.config import Config
+from .instruments import get_instrument_index
+from .upstox_api import UPSTOX_SDK_AVAILABLE, ApiException, upstox_client_instance, get_access_token
+from .ratelimit import yfinance_limiter
+from .recorder import upstream_recorder
 
 print("Stock fetcher module loaded (File Key Lookup v7)")
+if not hasattr(yf_shared, '_ERRORS'): print("WARNING: yfinance.shared._ERRORS not available - empty yfinance results are treated as errors, never as 'no data'.")
 
 # --- Interval Mapping ---
 # --- Interval Mapping ---
@@ -38,161 +29,141 @@ YFINANCE_INTERVAL_MAP = {
     "1H": "1h", # Added Hourly for yfinance
     "60M": "60m", # Alternate yfinance hourly
     "60MIN": "60m",
-    # Add 5m, 15m etc later: "5M": "5m", "15M": "15m"
+    "5M": "5m", "5MIN": "5m", "15M": "15m", "15MIN": "15m",
 }
 UPSTOX_INTERVAL_MAP = {
     "1D": "day", "1W": "week", "1WK": "week", "1M": "month", "1MO": "month",
     "1H": "60minute", # Added Hourly for Upstox (check exact string needed!)
     "60MIN": "60minute",
-    # Add "5MIN": "5minute" etc. later
-}
-# --- Instrument Data Storage ---
-_instrument_list_cache: Dict[str, List[Dict[str, Any]]] = {} # {'NSE': [...], 'BSE': [...]}
-_instrument_key_cache: Dict[str, Optional[str]] = {} # {'TCS_NSE': 'NSE_EQ|...'}
-
-# --- URLs for Upstox Instrument Files (Verify These!) ---
-UPSTOX_INSTRUMENT_URLS = {
-    "NSE": "https://assets.upstox.com/market-quote/instruments/exchange/NSE.json.gz",
-    "BSE": "https://assets.upstox.com/market-quote/instruments/exchange/BSE.json.gz",
+    "5M": "5minute", "5MIN": "5minute", "15M": "15minute", "15MIN": "15minute", # (check exact strings needed!)
 }
-# Correct path calculation for backend/data/ directory
-INSTRUMENT_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'data'))
-
-
-# --- Load/Download Instrument List Function ---
-def _load_or_download_instruments(exchange: str) -> Optional[List[Dict[str, Any]]]:
-    """Loads instrument list from local cache or downloads if missing/older than a day."""
-    global _instrument_list_cache
-    exchange_upper = exchange.upper()
-    if exchange_upper not in UPSTOX_INSTRUMENT_URLS:
-        print(f"Error: No download URL for exchange: {exchange_upper}"); return None
-
-    # Check memory cache
-    if exchange_upper in _instrument_list_cache:
-        print(f"Using in-memory instrument list cache for {exchange_upper}."); return _instrument_list_cache[exchange_upper]
-
-    # Check file cache
-    cache_file_name = f"upstox_{exchange_upper}_instruments.json"
-    cache_file_path = os.path.join(INSTRUMENT_CACHE_DIR, cache_file_name)
-    needs_download = True # Assume download needed unless valid cache found
-
-    if os.path.exists(cache_file_path):
-        try:
-            file_mod_time = os.path.getmtime(cache_file_path)
-            age_seconds = time.time() - file_mod_time
-            # Re-download if older than ~23 hours
-            if age_seconds < (23 * 60 * 60):
-                print(f"Loading instruments for {exchange_upper} from file cache (age: {age_seconds/3600:.1f} hours)...")
-                with open(cache_file_path, 'r', encoding='utf-8') as f:
-                    instrument_list = json.load(f)
-                print(f"Loaded {len(instrument_list)} instruments from file.")
-                _instrument_list_cache[exchange_upper] = instrument_list # Store in memory
-                return instrument_list # Return cached data
-            else:
-                 print(f"Cache file for {exchange_upper} is older than 1 day. Re-downloading...")
-                 needs_download = True # Explicitly set
-        except Exception as e:
-            print(f"Error reading/checking cache file {cache_file_path}: {e}. Will attempt download.")
-            needs_download = True
-
-    # Download if needed
-    if needs_download:
-        url = UPSTOX_INSTRUMENT_URLS[exchange_upper]
-        print(f"Downloading instrument list for {exchange_upper} from {url}...")
-        try:
-            headers = {'Accept-Encoding': 'gzip, deflate'}
-            response = requests.get(url, headers=headers, timeout=60)
-            response.raise_for_status()
-            # Use response.content for manual gzip handling
-            try:
-                 decompressed_bytes = gzip.decompress(response.content)
-                 json_data = json.loads(decompressed_bytes.decode('utf-8'))
-                 print("Manual gzip decompression successful.")
-            except Exception as gz_err:
-                 print(f"Manual gzip decompression failed: {gz_err}, trying response.text...")
-                 # Fallback to requests' automatic decoding (might fail if headers wrong)
-                 json_data = response.json()
-                 print("Used response.text fallback.")
+YF_INTRADAY_MAX_HIST_DAYS = 59 # yfinance only serves ~60 days of intraday history (slightly less for safety)
+INTRADAY_TIMEZONE = 'Asia/Kolkata' # Intraday bars are stored as naive IST wall-clock timestamps
+
+def _to_naive_ist(ts: pd.Series) -> pd.Series:
+    if getattr(ts.dt, 'tz', None) is None: return ts
+    return ts.dt.tz_convert(INTRADAY_TIMEZONE).dt.tz_localize(None)
+
+def get_yf_fetch_start(interval: str, start_date: str, end_date: str) -> str:
+    """Earliest start yfinance can serve for interval (intraday history is capped), as 'YYYY-MM-DD'."""
+    yf_interval = YFINANCE_INTERVAL_MAP.get(interval.upper())
+    if yf_interval is None or yf_interval in ['1d', '1wk', '1mo', '3mo']: return start_date
+    limit_start_dt = pd.Timestamp.today().normalize() - pd.Timedelta(days=YF_INTRADAY_MAX_HIST_DAYS) # Limit counts back from today
+    return max(pd.to_datetime(start_date), limit_start_dt).strftime('%Y-%m-%d')
+
+# Fetchers return None on errors and an EMPTY frame when the source answered but had no bars
+# for the range (weekends/holidays); the manager records the latter as checked coverage.
+def _empty_ohlcv_frame() -> pd.DataFrame:
+    return pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'], index=pd.Index([], name='date'))
+
+# --- Instrument Key Lookup (hash index, see instruments.py) ---
+def _upstox_exchange(exchange: str) -> Optional[str]:
+    exchange = exchange.upper()
+    return "NSE" if exchange in ["NSE", "NS"] else ("BSE" if exchange == "BSE" else None)
 
-
-            if not isinstance(json_data, list):
-                 print(f"Error: Downloaded data for {exchange_upper} is not a JSON list."); return None
-
-            _instrument_list_cache[exchange_upper] = json_data # Store in memory
-            print(f"Successfully downloaded/parsed {len(json_data)} instruments for {exchange_upper}.")
-
-            # Save to file cache
-            try:
-                 os.makedirs(INSTRUMENT_CACHE_DIR, exist_ok=True)
-                 with open(cache_file_path, 'w', encoding='utf-8') as f: json.dump(json_data, f)
-                 print(f"Saved instrument list to cache file: {cache_file_path}")
-            except Exception as e: print(f"Warning: Could not save cache file {cache_file_path}: {e}")
-
-            return json_data
-        except requests.exceptions.RequestException as e: print(f"Error downloading instrument list for {exchange_upper}: {e}"); return None
-        except Exception as e: print(f"Error processing downloaded instrument list for {exchange_upper}: {e}"); return None
-    # This part should not be reached if needs_download was false and file load succeeded
-    return None # Should not happen in normal flow
-
-# --- Instrument Key Lookup (Uses File/Cache) ---
 def get_instrument_key(symbol: str, exchange: str) -> Optional[str]:
-    """Gets Upstox instrument key by searching downloaded/cached list."""
-    exchange = exchange.upper(); symbol = symbol.upper()
-    # Use consistent cache key format, mapping NS to NSE
-    upstox_exchange = "NSE" if exchange in ["NSE", "NS"] else ("BSE" if exchange == "BSE" else None)
+    """Gets Upstox instrument key (EQ segment) from the exchange's instrument index."""
+    symbol = symbol.upper(); upstox_exchange = _upstox_exchange(exchange)
     if not upstox_exchange: print(f"Warning: Exchange '{exchange}' not supported."); return None
-
-    cache_key = f"{symbol}_{upstox_exchange}" # Use mapped exchange in key
-    if cache_key in _instrument_key_cache: return _instrument_key_cache[cache_key]
-
-    instruments = _load_or_download_instruments(upstox_exchange)
-    if not instruments: print(f"Error: Could not load instrument list for {upstox_exchange}."); _instrument_key_cache[cache_key] = None; return None
-
-    print(f"DEBUG Upstox Key: Searching list ({len(instruments)}) for {symbol}/{upstox_exchange} (EQ)...")
-    found_key = None
-    segment_prefix = f"{upstox_exchange}_EQ" # e.g., NSE_EQ
-    for instrument in instruments:
-        inst_exch = instrument.get('exchange', '').upper()
-        inst_symbol = instrument.get('trading_symbol', '').upper()
-        inst_type = instrument.get('instrument_type', '').upper()
-        inst_segment = instrument.get('segment', '').upper()
-        # Match criteria
-        if (inst_exch == upstox_exchange and inst_symbol == symbol and inst_type == 'EQ' and inst_segment == segment_prefix):
-             found_key = instrument.get('instrument_key'); print(f"DEBUG Upstox Key: Found match! Key={found_key}..."); break
-
-    print(f"DEBUG Upstox Key: Search finished. Found key: {found_key}")
-    _instrument_key_cache[cache_key] = found_key; return found_key
-
-
-# --- fetch_stock_data_upstox (No changes needed inside) ---
+    index = get_instrument_index(upstox_exchange)
+    if index is None: print(f"Error: Could not load instrument index for {upstox_exchange}."); return None
+    found_key = index.get(symbol, f"{upstox_exchange}_EQ")
+    print(f"DEBUG Upstox Key: {symbol}/{upstox_exchange} -> {found_key}")
+    return found_key
+
+def get_instrument_info(symbol: str, exchange: str) -> Optional[Dict]:
+    """Name/instrument key of an equity from the instrument index (no network call if the index is loaded)."""
+    upstox_exchange = _upstox_exchange(exchange)
+    index = get_instrument_index(upstox_exchange) if upstox_exchange else None
+    record = index.records.get((upstox_exchange, symbol.upper(), f"{upstox_exchange}_EQ")) if index else None
+    if record is None or record[1] != 'EQ': return None
+    return {"symbol": symbol.upper(), "exchange": exchange.upper(), "name": record[2] or symbol.upper(), "instrument_key": record[0]}
+
+def upstox_symbol_not_found(symbol: str, exchange: str) -> bool:
+    """True only if the exchange's instrument index is available and has no EQ instrument for symbol."""
+    upstox_exchange = _upstox_exchange(exchange)
+    if not upstox_exchange: return True
+    index = get_instrument_index(upstox_exchange)
+    return index is not None and index.get(symbol, f"{upstox_exchange}_EQ") is None
+
+def upstox_available() -> bool:
+    """SDK installed and an access token configured (or replaying fixtures) - otherwise Upstox is skipped without a request."""
+    return upstream_recorder.replaying or (UPSTOX_SDK_AVAILABLE and bool(get_access_token()))
+
+# --- Upstox Window Splitting ---
+# Upstox serves at most this many days of candles per historical request (longer ranges are truncated/slow)
+UPSTOX_MAX_WINDOW_DAYS = {
+    "1minute": 30, "5minute": 30, "15minute": 30, "30minute": 365, "60minute": 365,
+    "day": 365, "week": 3650, "month": 3650,
+}
+_window_executor = ThreadPoolExecutor(max_workers=Config.UPSTOX_FETCH_CONCURRENCY, thread_name_prefix='upstox-window') # Shared: bounds in-flight windows per process
+
+def split_date_windows(start_date: str, end_date: str, window_days: int) -> List[Tuple[str, str]]:
+    """Inclusive [start, end] -> consecutive inclusive windows of at most window_days days, oldest first."""
+    windows = []; window_start = pd.to_datetime(start_date).date(); last = pd.to_datetime(end_date).date()
+    while window_start <= last:
+        window_end = min(last, window_start + timedelta(days=window_days - 1))
+        windows.append((window_start.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d'))); window_start = window_end + timedelta(days=1)
+    return windows
+
+def _is_retryable(error: Exception) -> bool:
+    status = getattr(error, 'status', None) # ApiException: client errors other than 429 will not succeed on retry
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+
+def _fetch_upstox_window(instrument_key: str, upstox_interval: str, window: Tuple[str, str]) -> list:
+    """Candles of one window; raises on API errors/non-success responses so the window can be retried."""
+    return upstream_recorder.call('upstox', (instrument_key, upstox_interval, window[0], window[1]),
+                                  lambda: _request_upstox_window(instrument_key, upstox_interval, window))
+
+def _request_upstox_window(instrument_key: str, upstox_interval: str, window: Tuple[str, str]) -> list:
+    api_response = upstox_client_instance.get_historical_candle_data(instrument_key, upstox_interval, window[1], window[0])
+    if api_response is None: raise RuntimeError("Upstox Access Token not configured")
+    if getattr(api_response, 'status', 'error') != 'success' or not getattr(api_response, 'data', None):
+        raise RuntimeError(f"Error/empty data from Upstox API. Status: {getattr(api_response, 'status', 'N/A')}")
+    return getattr(api_response.data, 'candles', None) or [] # Success without candles: holidays/weekends only
+
+def _fetch_upstox_candles(instrument_key: str, upstox_interval: str, start_date: str, end_date: str) -> Optional[list]:
+    """All candles of [start, end], fetched as concurrent windows; only failed windows are retried. None if any window fails."""
+    windows = split_date_windows(start_date, end_date, UPSTOX_MAX_WINDOW_DAYS.get(upstox_interval, 365))
+    results: Dict[Tuple[str, str], list] = {}; pending = list(windows); last_error: Optional[Exception] = None
+    for attempt in range(Config.UPSTOX_WINDOW_RETRIES + 1):
+        if attempt: time.sleep(0.5 * attempt); print(f"DEBUG Upstox: Retrying {len(pending)} failed window(s) (attempt {attempt + 1})...")
+        futures = {window: _window_executor.submit(_fetch_upstox_window, instrument_key, upstox_interval, window) for window in pending}
+        failed = []
+        for window, future in futures.items():
+            try: results[window] = future.result()
+            except Exception as e:
+                last_error = e; print(f"Upstox window {window[0]} to {window[1]} for {instrument_key} failed: {e}")
+                if not _is_retryable(e): return None
+                failed.append(window)
+        pending = failed
+        if not pending: break
+    if pending: print(f"Error: {len(pending)} Upstox window(s) still failing for {instrument_key} ({last_error})."); return None
+    if len(windows) > 1: print(f"DEBUG Upstox: Merged {len(windows)} windows for {instrument_key}.")
+    return [candle for window in windows for candle in results[window]]
+
+# --- fetch_stock_data_upstox (shared, pooled client - see upstox_api.py) ---
 def fetch_stock_data_upstox(symbol: str, exchange: str, interval: str, start_date: str, end_date: str) -> Optional[pd.DataFrame]:
-    # ... (Keep implementation from previous step, it calls the updated get_instrument_key) ...
-    if not UPSTOX_SDK_AVAILABLE: print("Error: Cannot fetch Upstox data, SDK not available."); return None
-    if not HistoryApi: print("Error: Cannot fetch Upstox data, SDK HistoryApi not available."); return None
+    if not upstream_recorder.replaying:
+        if not UPSTOX_SDK_AVAILABLE: print("Error: Cannot fetch Upstox data, SDK not available."); return None
+        if not get_access_token(): print("Error: Upstox Access Token not configured."); return None
     print(f"Attempting fetch from Upstox for {symbol}/{exchange} ({interval}) [{start_date} to {end_date}]")
     instrument_key = get_instrument_key(symbol, exchange) # Uses file based lookup now
     if not instrument_key: print(f"Error: Could not find/lookup Upstox instrument key for {symbol}/{exchange}."); return None
     upstox_interval = UPSTOX_INTERVAL_MAP.get(interval.upper())
     if not upstox_interval: print(f"Error: Unsupported interval for Upstox fetch: {interval}"); return None
-    access_token = Config.UPSTOX_ACCESS_TOKEN
-    if not access_token: print("Error: Upstox Access Token not configured."); return None
     try:
-        configuration = Configuration(); configuration.access_token = access_token
-        configuration.api_key['api-version'] = '2.0'; api_client = ApiClient(configuration)
-        history_instance = HistoryApi(api_client)
-        api_version = "2.0"
-        print(f"DEBUG Upstox: Calling history_instance.get_historical_candle_data1(...) key={instrument_key}, interval={upstox_interval}")
-        api_response = history_instance.get_historical_candle_data1(
-            instrument_key=instrument_key, interval=upstox_interval, to_date=end_date, from_date=start_date, api_version=api_version
-        )
-        if (not api_response or getattr(api_response, 'status', 'error') != 'success' or not getattr(api_response, 'data', None) or not getattr(api_response.data, 'candles', None)): print(f"Error/empty data from Upstox API for {symbol}/{exchange}/{interval}. Status: {getattr(api_response, 'status', 'N/A')}"); return None
-        candles = api_response.data.candles;
-        if not candles: print(f"No candles data in Upstox response for {symbol}/{exchange}/{interval}"); return None
+        candles = _fetch_upstox_candles(instrument_key, upstox_interval, start_date, end_date)
+        if candles is None: print(f"Error/empty data from Upstox API for {symbol}/{exchange}/{interval}."); return None
+        # Successful response without candles (holidays/weekends only) -> empty frame, not an error
+        if not candles: print(f"No candles data in Upstox response for {symbol}/{exchange}/{interval}"); return _empty_ohlcv_frame()
         print(f"DEBUG Upstox: Parsing {len(candles)} candles...")
         columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume', 'oi']; df = pd.DataFrame(candles, columns=columns)
-        try: df['date'] = pd.to_datetime(df['timestamp']); df['date'] = df['date'].dt.date
+        is_intraday = upstox_interval.endswith('minute')
+        try: df['date'] = pd.to_datetime(df['timestamp']); df['date'] = _to_naive_ist(df['date']) if is_intraday else df['date'].dt.date
         except Exception as ts_e: print(f"Error converting Upstox timestamp: {ts_e}. Timestamp: {df['timestamp'].iloc[0]}"); return None
         df.set_index('date', inplace=True); df.drop(columns=['timestamp', 'oi'], inplace=True, errors='ignore')
+        df = df[~df.index.duplicated(keep='last')] # Windows are disjoint, but never store a bar twice
         cols_to_convert = ['open', 'high', 'low', 'close', 'volume']
         for col in cols_to_convert:
             if col in df.columns: df[col] = pd.to_numeric(df[col], errors='coerce')
@@ -216,27 +187,26 @@ def fetch_stock_data_yf(symbol: str, start_date: str, end_date: str, exchange: s
      suffix = ""
      if exchange.upper() in ["NSE", "NS"]: suffix = ".NS"
      elif exchange.upper() == "BSE": suffix = ".BO"
-     ticker_symbol = f"{symbol.upper()}{suffix}"
+     ticker_symbol = f"{symbol.upper()}{suffix}"; _yf_local.last_error = (ticker_symbol, None)
      # --------------------------------------
      if not yf_interval: print(f"Error: Unsupported yf interval: {interval}"); return None
      is_intraday = yf_interval not in ['1d', '1wk', '1mo', '3mo'] # Rough check
-     fetch_start_date = start_date
-     if is_intraday:
-          max_hist_days = 59 # Allow slightly less than 60 for safety
-          required_start_dt = pd.to_datetime(start_date)
-          limit_start_dt = pd.to_datetime(end_date) - pd.Timedelta(days=max_hist_days)
-          if required_start_dt < limit_start_dt:
-               print(f"Warning: yfinance intraday interval '{yf_interval}' requested beyond typical limit ({max_hist_days} days). Adjusting start date from {start_date} to {limit_start_dt.strftime('%Y-%m-%d')}.")
-               fetch_start_date = limit_start_dt.strftime('%Y-%m-%d')
+     fetch_start_date = get_yf_fetch_start(interval, start_date, end_date)
+     if fetch_start_date != start_date:
+          print(f"Warning: yfinance intraday interval '{yf_interval}' requested beyond typical limit ({YF_INTRADAY_MAX_HIST_DAYS} days). Adjusting start date from {start_date} to {fetch_start_date}.")
+          if fetch_start_date > end_date: return _empty_ohlcv_frame()
 
      print(f"DEBUG yfinance: Using ticker: '{ticker_symbol}', interval: '{yf_interval}'"); print(f"Attempting yf download for {ticker_symbol} ({interval}) [{fetch_start_date} to {end_date}]...")
-     print(f"DEBUG yfinance: Using ticker: '{ticker_symbol}', interval: '{yf_interval}'"); print(f"Attempting yf download for {ticker_symbol} ({interval}) [{start_date} to {end_date}]...")
      # ... (Rest of yfinance fetch logic remains the same) ...
      try:
-         end_date_adjusted = end_date;
-         if yf_interval in ['1d', '1wk', '1mo']: end_date_adjusted = (pd.to_datetime(end_date) + timedelta(days=1)).strftime('%Y-%m-%d')
-         history = yf.download(tickers=ticker_symbol, start=start_date, end=end_date_adjusted, interval=yf_interval, progress=False, auto_adjust=False)
-         if history.empty: print(f"No data yf.download {ticker_symbol} ({interval})."); return None
+         end_date_adjusted = (pd.to_datetime(end_date) + timedelta(days=1)).strftime('%Y-%m-%d') # yf 'end' is exclusive
+         history, errors = _yf_download(tickers=ticker_symbol, start=fetch_start_date, end=end_date_adjusted, interval=yf_interval, progress=False, auto_adjust=False)
+         error = (errors or {}).get(ticker_symbol); _yf_local.last_error = (ticker_symbol, error)
+         if error and yf_error_kind(error) != 'no_data': print(f"yfinance failed for {ticker_symbol} ({interval}): {error}"); return None
+         if history.empty:
+             # Network errors also come back as an empty frame: only a reported 'no price data' error means "checked, no bars"
+             if error is None: print(f"yfinance returned nothing for {ticker_symbol} ({interval}) and no reason - treating as an error."); return None
+             print(f"No data yf.download {ticker_symbol} ({interval})."); return _empty_ohlcv_frame()
          if isinstance(history.columns, pd.MultiIndex):
              try: ticker_in_multindex = history.columns.get_level_values(1)[0]; history = history.xs(ticker_in_multindex, level=1, axis=1);
              except Exception as e: print(f"Error processing MultiIndex columns for {ticker_symbol}: {e}"); return None
@@ -244,10 +214,102 @@ def fetch_stock_data_yf(symbol: str, start_date: str, end_date: str, exchange: s
          except AttributeError as e: print(f"Error converting cols lower {ticker_symbol} ({history.columns}): {e}"); return None
          required_cols_lower = ['open', 'high', 'low', 'close', 'volume']; available_cols = [col for col in required_cols_lower if col in history.columns]
          if not available_cols or len(available_cols) < 5: print(f"Error/Warning: Missing standard OHLCV cols after processing {ticker_symbol}. Found: {available_cols}"); return None
-         history = history[available_cols]; print(f"Successfully yf downloaded/processed {len(history)} rows for {ticker_symbol} ({interval})"); return history
+         history = history[available_cols]
+         if is_intraday and isinstance(history.index, pd.DatetimeIndex) and history.index.tz is not None:
+             history.index = history.index.tz_convert(INTRADAY_TIMEZONE).tz_localize(None) # Naive IST like Upstox bars
+         print(f"Successfully yf downloaded/processed {len(history)} rows for {ticker_symbol} ({interval})"); return history
      except Exception as e: print(f"Error downloading/processing {interval} data for {ticker_symbol} from yfinance: {e}"); return None
 
 
+# --- fetch_stock_data_yf_batch (many tickers per yf.download) ---
+def _yf_ticker(symbol: str, exchange: str) -> str:
+    exchange = exchange.upper()
+    return f"{symbol.upper()}{'.NS' if exchange in ['NSE', 'NS'] else ('.BO' if exchange == 'BSE' else '')}"
+
+# yfinance reports per-ticker errors (it returns empty/all-NaN data, not an exception) only in the process-global
+# yfinance.shared._ERRORS, which every download resets. Downloads run concurrently, so a concurrent call may clear this call's
+# errors before they are read - that only loses the reason: an empty result without one is an error (never 'no data'), and
+# errors are only taken for this call's tickers. Just the copy of the dict is locked.
+_yf_errors_lock = threading.Lock()
+_yf_local = threading.local() # last_error: (ticker, error) of this thread's latest fetch_stock_data_yf, for yf_symbol_not_found
+
+def _yf_download(**kwargs) -> Tuple[pd.DataFrame, Optional[Dict[str, str]]]:
+    """
+    yf.download (rate limited, record/replay aware); returns the frame and the errors yfinance reported for this call -
+    None if they are not available (callers then treat an empty result as an error).
+    """
+    tickers = kwargs['tickers'] if isinstance(kwargs['tickers'], list) else [kwargs['tickers']]
+    def download() -> Tuple[pd.DataFrame, Optional[Dict[str, str]]]:
+        yfinance_limiter.acquire()
+        history = yf.download(**kwargs)
+        with _yf_errors_lock:
+            errors = getattr(yf_shared, '_ERRORS', None)
+            errors = dict(errors) if errors is not None else None
+        return history, {t.upper(): e for t, e in errors.items() if t.upper() in tickers} if errors is not None else None
+    return upstream_recorder.call('yfinance', tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in kwargs.items())),
+                                  download, codec='pickle')
+
+def yf_error_kind(error: str) -> str:
+    """'not_found' (unknown/delisted ticker: no timezone), 'no_data' (no prices in the range) or 'error'."""
+    if 'YFTzMissingError' in error: return 'not_found'
+    if 'YFPricesMissingError' in error: return 'no_data'
+    return 'error'
+
+def yf_symbol_not_found(symbol: str, exchange: str) -> bool:
+    """True if this thread's last fetch_stock_data_yf of symbol failed because the ticker is unknown."""
+    ticker, error = getattr(_yf_local, 'last_error', (None, None))
+    return ticker == _yf_ticker(symbol, exchange) and error is not None and yf_error_kind(error) == 'not_found'
+
+def _split_yf_ticker(history: pd.DataFrame, ticker: str, is_intraday: bool) -> Optional[pd.DataFrame]:
+    """One ticker's OHLCV out of a multi-ticker download (MultiIndex columns); None if it is missing/malformed."""
+    if history.empty: return _empty_ohlcv_frame()
+    if isinstance(history.columns, pd.MultiIndex):
+        level = next((i for i in range(history.columns.nlevels) if ticker in history.columns.get_level_values(i)), None)
+        if level is None: print(f"Error: {ticker} missing from yfinance batch result."); return None
+        frame = history.xs(ticker, level=level, axis=1)
+    else: frame = history # A one-ticker batch may come back flat
+    frame = frame.copy(); frame.columns = [str(c).lower() for c in frame.columns]
+    required_cols_lower = ['open', 'high', 'low', 'close', 'volume']
+    if not all(col in frame.columns for col in required_cols_lower): print(f"Error: Missing standard OHLCV cols for {ticker} in yfinance batch. Found: {list(frame.columns)}"); return None
+    frame = frame[required_cols_lower].dropna(subset=['open', 'high', 'low', 'close'], how='all') # Rows where only other tickers traded
+    if is_intraday and isinstance(frame.index, pd.DatetimeIndex) and frame.index.tz is not None:
+        frame.index = frame.index.tz_convert(INTRADAY_TIMEZONE).tz_localize(None)
+    return frame
+
+def fetch_stock_data_yf_batch(symbols: List[str], start_date: str, end_date: str, exchange: str = "NSE", interval: str = '1D') -> Dict[str, Optional[pd.DataFrame]]:
+    """
+    Historical OHLCV for many symbols, one yf.download per Config.YF_BATCH_SIZE tickers (split per ticker from the
+    MultiIndex result). Returns {symbol: frame} with fetch_stock_data_yf's contract: None on errors, empty frame if no bars.
+    """
+    symbols = list(dict.fromkeys(s.upper() for s in symbols))
+    yf_interval = YFINANCE_INTERVAL_MAP.get(interval.upper())
+    if not yf_interval: print(f"Error: Unsupported yf interval: {interval}"); return {symbol: None for symbol in symbols}
+    is_intraday = yf_interval not in ['1d', '1wk', '1mo', '3mo']
+    fetch_start_date = get_yf_fetch_start(interval, start_date, end_date)
+    if fetch_start_date > end_date: return {symbol: _empty_ohlcv_frame() for symbol in symbols}
+    end_date_adjusted = (pd.to_datetime(end_date) + timedelta(days=1)).strftime('%Y-%m-%d') # yf 'end' is exclusive
+    results: Dict[str, Optional[pd.DataFrame]] = {}
+    batch_size = max(1, Config.YF_BATCH_SIZE)
+    for offset in range(0, len(symbols), batch_size):
+        tickers = {_yf_ticker(symbol, exchange): symbol for symbol in symbols[offset:offset + batch_size]}
+        print(f"Attempting yf batch download for {len(tickers)} tickers ({interval}) [{fetch_start_date} to {end_date}]...")
+        try: # One request for the whole batch
+            history, errors = _yf_download(tickers=list(tickers), start=fetch_start_date, end=end_date_adjusted, interval=yf_interval,
+                                           group_by='ticker', threads=True, progress=False, auto_adjust=False)
+        except Exception as e:
+            print(f"Error in yfinance batch download ({len(tickers)} tickers, {interval}): {e}")
+            results.update({symbol: None for symbol in tickers.values()}); continue
+        for ticker, symbol in tickers.items():
+            error = (errors or {}).get(ticker)
+            if error and yf_error_kind(error) != 'no_data': print(f"yfinance batch: {ticker} failed: {error}"); results[symbol] = None; continue
+            try: results[symbol] = _split_yf_ticker(history, ticker, is_intraday)
+            except Exception as e: print(f"Error processing {ticker} from yfinance batch: {e}"); results[symbol] = None
+            if results[symbol] is not None and results[symbol].empty and error is None: # No bars and no reason: a failed download, not "no data"
+                print(f"yfinance batch: {ticker} came back empty without a reported error - treating as failed."); results[symbol] = None
+        fetched = sum(1 for symbol in tickers.values() if results[symbol] is not None)
+        print(f"yf batch: {fetched}/{len(tickers)} tickers fetched, {sum(len(results[s]) for s in tickers.values() if results[s] is not None)} rows ({interval}).")
+    return results
+
 # --- fetch_stock_info_yf (Corrected Ticker Suffix) ---
 def fetch_stock_info_yf(symbol: str, exchange: str = "NSE") -> Optional[Dict]:
     """Fetches basic stock info using yfinance (fast_info)"""
@@ -259,51 +321,22 @@ def fetch_stock_info_yf(symbol: str, exchange: str = "NSE") -> Optional[Dict]:
     # --------------------------------------
     print(f"DEBUG yfinance Info: Using ticker: '{ticker_symbol}'"); print(f"Fetching info for {ticker_symbol} using yfinance fast_info...")
     # ... (Rest of info fetch logic remains the same) ...
-    stock_info = None
-    try:
+    def request_info() -> Dict:
+        yfinance_limiter.acquire()
         stock = yf.Ticker(ticker_symbol); f_info = stock.fast_info
-        if not f_info or not hasattr(f_info, 'currency') or f_info.currency is None: print(f"Warning: Limited info via fast_info for {ticker_symbol}."); stock_info = { "symbol": symbol, "exchange": exchange, "name": symbol, "currency": "INR"}
-        else: stock_info = { "symbol": symbol, "exchange": exchange, "name": getattr(f_info, 'longName', symbol), "currency": getattr(f_info, 'currency', 'INR'), "lastPrice": getattr(f_info, 'lastPrice', None), "marketCap": getattr(f_info, 'marketCap', None), "quoteType": getattr(f_info, 'quoteType', None)}
+        if not f_info or not hasattr(f_info, 'currency') or f_info.currency is None: print(f"Warning: Limited info via fast_info for {ticker_symbol}."); return { "symbol": symbol, "exchange": exchange, "name": symbol, "currency": "INR"}
+        return { "symbol": symbol, "exchange": exchange, "name": getattr(f_info, 'longName', symbol), "currency": getattr(f_info, 'currency', 'INR'), "lastPrice": getattr(f_info, 'lastPrice', None), "marketCap": getattr(f_info, 'marketCap', None), "quoteType": getattr(f_info, 'quoteType', None)}
+    try:
+        stock_info = upstream_recorder.call('yfinance_info', (ticker_symbol,), request_info)
         print(f"Successfully fetched basic info for {ticker_symbol} via fast_info."); return stock_info
     except Exception as e: print(f"Error fetching info {ticker_symbol} (fast_info): {e}"); print(f"Providing minimal fallback metadata for {symbol}/{exchange}."); return { "symbol": symbol, "exchange": exchange, "name": symbol, "currency": "INR"}
 
-    # Add this function in backend/app/stocks/fetcher.py
-
 def get_cached_instrument_list(exchange: str) -> List[Dict[str, str]]:
-    """
-    Loads the instrument list for an exchange and returns a simplified list
-    containing equity symbols and names.
-    """
-    exchange_upper = None
-    segment_prefix = None
-    if exchange.upper() in ["NSE", "NS"]: exchange_upper = "NSE"; segment_prefix = "NSE_EQ"
-    elif exchange.upper() == "BSE": exchange_upper = "BSE"; segment_prefix = "BSE_EQ"
-    else: return [] # Return empty list for unsupported exchanges
-
-    instruments = _load_or_download_instruments(exchange_upper) # Use existing load/download function
-    if not instruments: return []
-
-    # Filter for EQ segment and extract relevant fields
-    equity_list = []
-    for instrument in instruments:
-        # Use .get() for safety
-        inst_exch = instrument.get('exchange', '').upper()
-        inst_symbol = instrument.get('trading_symbol') # Keep original case? Or upper? Let's use upper.
-        inst_name = instrument.get('name')
-        inst_type = instrument.get('instrument_type', '').upper()
-        inst_segment = instrument.get('segment', '').upper()
-
-        # Check if it's an equity on the correct exchange/segment
-        if (inst_exch == exchange_upper and
-            inst_type == 'EQ' and
-            inst_segment == segment_prefix and
-            inst_symbol and inst_name): # Ensure symbol and name exist
-             equity_list.append({
-                 "symbol": inst_symbol.upper(),
-                 "name": inst_name,
-                 "exchange": exchange_upper # <-- CORRECTED LINE: Use exchange_upper
-             })
-
-    print(f"Returning simplified list of {len(equity_list)} equities for {exchange_upper}.")
-    # Sort alphabetically by symbol
-    return sorted(equity_list, key=lambda x: x['symbol'])
\ No newline at end of file
+    """Equity symbols and names for an exchange, sorted by symbol (built once per instrument index)."""
+    upstox_exchange = _upstox_exchange(exchange)
+    if not upstox_exchange: return [] # Return empty list for unsupported exchanges
+    index = get_instrument_index(upstox_exchange)
+    if index is None: return []
+    equity_list = index.equities()
+    print(f"Returning simplified list of {len(equity_list)} equities for {upstox_exchange}.")
+    return equity_list
@@ -0,0 +1,97 @@
+# backend/app/stocks/indicator_cache.py
+# Indicator result cache: columns computed for a chart request are kept per (symbol, exchange, interval, indicator,
+# data version) and served to later requests whose date window lies inside the computed one - a different window of
+# the same series needs no recompute. The data version (repository.get_data_version) is bumped by every ingest that
+# changes the series' bars, so stale entries are never served, only replaced or evicted. LRU under a byte budget.
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import Config
+
+print("Indicator cache module loaded")
+
+SeriesKey = Tuple[str, str, str] # (symbol, exchange, interval)
+
+class CachedColumns:
+    """One indicator's columns over a series window. valid_from=None: computed from the series' first stored bar."""
+    __slots__ = ('times', 'columns', 'valid_from', 'end', 'nbytes')
+
+    def __init__(self, times: np.ndarray, columns: Dict[str, np.ndarray], valid_from: Optional[pd.Timestamp], end: pd.Timestamp):
+        self.times = times; self.columns = columns; self.valid_from = valid_from; self.end = end
+        for array in (times, *columns.values()): array.setflags(write=False) # Shared by every request it is served to
+        self.nbytes = times.nbytes + sum(values.nbytes for values in columns.values())
+
+    def covers(self, start: pd.Timestamp, end: pd.Timestamp) -> bool:
+        return (self.valid_from is None or self.valid_from <= start) and end <= self.end
+
+    def aligned(self, index: pd.DatetimeIndex) -> Dict[str, np.ndarray]:
+        """Columns for the bars of index (NaN for bars the entry does not have)."""
+        times = index.values
+        pos = np.minimum(np.searchsorted(self.times, times), max(len(self.times) - 1, 0))
+        found = (self.times[pos] == times) if len(self.times) else np.zeros(len(times), dtype=bool)
+        return {col: np.where(found, values[pos], np.nan) if len(values) else np.full(len(times), np.nan) for col, values in self.columns.items()}
+
+class IndicatorCache:
+    """Process-wide LRU of CachedColumns keyed by (symbol, exchange, interval, indicator, data version)."""
+
+    def __init__(self, budget_mb: float):
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, CachedColumns]" = OrderedDict() # Least recently used first
+        self._versions: Dict[Tuple, int] = {} # (symbol, exchange, interval, indicator) -> version cached
+        self.bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'invalidations': 0, 'too_large': 0}
+
+    @property
+    def enabled(self) -> bool: return self.budget_bytes > 0
+
+    def get(self, series: SeriesKey, indicator: str, version: int, start: Any, end: Any) -> Optional[CachedColumns]:
+        """The entry if its window covers [start, end] (dates, inclusive), else None (a miss)."""
+        if not self.enabled: return None
+        key = (*series, indicator, version)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.covers(pd.Timestamp(start), pd.Timestamp(end)): self.stats['misses'] += 1; return None
+            self._entries.move_to_end(key); self.stats['hits'] += 1
+            return entry
+
+    def put(self, series: SeriesKey, indicator: str, version: int, entry: CachedColumns):
+        """Stores (replaces) the entry; entries of older versions of the same series/indicator are dropped."""
+        if not self.enabled: return
+        if entry.nbytes > self.budget_bytes: self.stats['too_large'] += 1; return
+        base = (*series, indicator)
+        with self._lock:
+            cached_version = self._versions.get(base)
+            if cached_version is not None and cached_version > version: return # Computed from bars older than what is cached
+            if cached_version is not None and cached_version < version: self._drop((*base, cached_version)); self.stats['invalidations'] += 1
+            self._drop((*base, version))
+            self._entries[(*base, version)] = entry; self._versions[base] = version; self.bytes += entry.nbytes; self.stats['stores'] += 1
+            while self.bytes > self.budget_bytes:
+                key, _ = next(iter(self._entries.items()))
+                self._drop(key); self.stats['evictions'] += 1
+
+    def _drop(self, key: Tuple):
+        entry = self._entries.pop(key, None)
+        if entry is None: return
+        self.bytes -= entry.nbytes
+        if self._versions.get(key[:-1]) == key[-1]: del self._versions[key[:-1]]
+
+    def clear(self):
+        with self._lock: self._entries.clear(); self._versions.clear(); self.bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {'entries': len(self._entries), 'bytes': self.bytes, 'budget_bytes': self.budget_bytes,
+                    'hit_rate': round(self.stats['hits'] / lookups, 3) if lookups else None, **self.stats}
+
+# --- Instantiate the cache ---
+indicator_cache = IndicatorCache(Config.INDICATOR_CACHE_MB)
+
+def get_indicator_cache_stats() -> Dict[str, Any]:
+    return indicator_cache.get_stats()
@@ -0,0 +1,135 @@
+# backend/app/stocks/indicator_state.py
+# Incremental indicator state: the recursive indicators of Config.INDICATOR_STATE_SPECS (EMA, RSI, MACD) keep a
+# snapshot per instrument and interval - the state after the newest stored bar and the one before it. Every committed
+# ingest (chart gap fills, backfills, EOD updates, a live feed storing bars) reports its changed bars through
+# repository.add_bars_listener; the states then advance over only the new bars, O(1) each. A revised newest bar (the
+# provisional bar of a running session) restarts from the previous snapshot; a revision further back, a missing state
+# or a gap in the stored closes recomputes that instrument from its full history, in one engine pass.
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from app.config import Config
+from app.indicators import IndicatorBatch, get_indicator
+from app.indicators.engine import collect_requirements
+from . import repository
+
+print("Indicator state module loaded")
+
+STATE_INTERVALS = ('1D', '1W', '1M') # 15M/1H are bucketed on read and 5M is not charted on its own - not tracked
+DERIVED_PERIODS = {'1W': 'week', '1M': 'month'} # Re-aggregated by every daily ingest (see repository._rebuild_derived_bars)
+
+def _period_start(value: Any, period: str) -> pd.Timestamp:
+    """First day of the week (Monday, like DuckDB's date_trunc) or month containing value."""
+    day = pd.Timestamp(value).normalize()
+    return day - pd.Timedelta(days=day.weekday()) if period == 'week' else day.replace(day=1)
+
+Record = Tuple[Any, float, Dict[str, Any], Dict[str, Any], Dict[str, float]] # (time, close, state, prev, values)
+
+def _full_record(indicator: Any, batch: IndicatorBatch, times: np.ndarray, closes: np.ndarray) -> Record:
+    """Snapshot before the newest bar from the engine pass over all earlier bars, then one step over the newest bar."""
+    prev = indicator.state(batch)
+    values, state = indicator.step(prev, closes[-1])
+    return pd.Timestamp(times[-1]), float(closes[-1]), state, prev, values
+
+def _advanced_record(indicator: Any, stored: Dict[str, Any], times: np.ndarray, closes: np.ndarray) -> Optional[Record]:
+    """
+    Steps a stored state over the bars from its time on (times/closes may start earlier). None = cannot advance (its
+    bar is gone or a close is missing) - recompute instead.
+    """
+    start = int(np.searchsorted(times, np.datetime64(stored['time'])))
+    if start >= len(times) or pd.Timestamp(times[start]) != stored['time'] or np.isnan(closes[start:]).any(): return None
+    if closes[start] == stored['close']: state, prev, values = stored['state'], stored['prev'], stored['values']; start += 1
+    else: state, prev, values = stored['prev'], stored['prev'], stored['values'] # Its bar was revised: redo it from the previous snapshot
+    for close in closes[start:]:
+        prev = state; values, state = indicator.step(state, close)
+    return pd.Timestamp(times[-1]), float(closes[-1]), state, prev, values
+
+class IndicatorStateTracker:
+    """Keeps the stored indicator states current with the stored bars; called by the repository after each ingest."""
+
+    def __init__(self, specs: str, intervals: str):
+        self.indicators = []
+        for spec in (s.strip() for s in specs.split(',') if s.strip()):
+            indicator = get_indicator(spec)
+            if indicator is None or not hasattr(indicator, 'step'): print(f"Indicator state: '{spec}' is not a stateful indicator - not tracked."); continue
+            self.indicators.append(indicator)
+        self.intervals = [i for i in (s.strip().upper() for s in intervals.split(',')) if i in STATE_INTERVALS]
+        self._lock = threading.Lock() # One update at a time: listeners of concurrent ingests must not interleave their state writes
+        self.stats = {'updates': 0, 'instruments_advanced': 0, 'instruments_recomputed': 0, 'bars_stepped': 0, 'errors': 0, 'last_update_ms': None}
+
+    @property
+    def names(self) -> List[str]:
+        return [indicator.get_column_name() for indicator in self.indicators]
+
+    def on_bars_changed(self, interval: str, touched: Dict[int, List[Any]]):
+        """Bars listener: updates the states of the changed interval and, for daily bars, of the weekly/monthly ones."""
+        if not self.indicators: return
+        if interval in self.intervals: self.update(interval, touched)
+        if interval != '1D': return
+        for derived, period in DERIVED_PERIODS.items():
+            if derived in self.intervals: self.update(derived, {iid: [_period_start(lo, period), _period_start(hi, period)] for iid, (lo, hi) in touched.items()})
+
+    def update(self, interval: str, touched: Dict[int, List[Any]]) -> Optional[Dict[str, int]]:
+        """
+        Brings the states of the touched instruments ({instrument_id: [min_changed, max_changed]}) up to their newest
+        stored bar: advanced when nothing before a state's bar changed, else recomputed. One read per path, one write.
+        """
+        with self._lock:
+            started = time.perf_counter()
+            try: summary = self._update(interval, touched)
+            except Exception as e: print(f"Indicator state: {interval} update of {len(touched)} instruments failed: {e}"); self.stats['errors'] += 1; return None
+            self.stats['updates'] += 1; self.stats['instruments_advanced'] += summary['advanced']
+            self.stats['instruments_recomputed'] += summary['recomputed']; self.stats['bars_stepped'] += summary['bars_stepped']
+            self.stats['last_update_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            print(f"Indicator state: {interval} {summary} in {self.stats['last_update_ms']} ms")
+            return summary
+
+    def _update(self, interval: str, touched: Dict[int, List[Any]]) -> Dict[str, int]:
+        names = self.names; summary = {'advanced': 0, 'recomputed': 0, 'bars_stepped': 0}
+        stored = repository.get_indicator_states(list(touched), interval)
+        since: Dict[int, pd.Timestamp] = {}; recompute: List[int] = []
+        for instrument_id, (min_changed, _) in touched.items():
+            states = stored.get(instrument_id, {})
+            oldest = min((states[name]['time'] for name in names if name in states), default=None)
+            if oldest is not None and all(name in states for name in names) and pd.Timestamp(min_changed) >= oldest: since[instrument_id] = oldest
+            else: recompute.append(instrument_id) # New instrument/indicator, or history before a state's bar was revised
+
+        records: List[Tuple[int, str, Any, float, Dict[str, Any], Dict[str, Any], Dict[str, float]]] = []
+        if since:
+            history = repository.get_close_history(list(since), interval, since=since)
+            for instrument_id in since:
+                times, closes = history.get(instrument_id, (np.empty(0, 'datetime64[us]'), np.empty(0)))
+                advanced = [_advanced_record(indicator, stored[instrument_id][name], times, closes) for indicator, name in zip(self.indicators, names)]
+                if any(record is None for record in advanced): recompute.append(instrument_id); continue
+                records += [(instrument_id, name, *record) for name, record in zip(names, advanced) # Skip states that did not move
+                            if record[:2] != (stored[instrument_id][name]['time'], stored[instrument_id][name]['close'])]
+                summary['advanced'] += 1; summary['bars_stepped'] += max(0, len(times) - 1)
+        if recompute:
+            history = repository.get_close_history(recompute, interval)
+            requirements = collect_requirements(self.indicators)
+            for instrument_id in recompute:
+                if instrument_id not in history: continue
+                times, closes = history[instrument_id]
+                batch = IndicatorBatch(closes[:-1]); batch.prepare(requirements) # Shared by all tracked indicators
+                records += [(instrument_id, name, *_full_record(indicator, batch, times, closes)) for indicator, name in zip(self.indicators, names)]
+                summary['recomputed'] += 1
+        if records and not repository.save_indicator_states(interval, records): raise RuntimeError(f"saving {len(records)} states failed")
+        return summary
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'indicators': self.names, 'intervals': self.intervals, **self.stats}
+
+# --- Instantiate the tracker ---
+indicator_states = IndicatorStateTracker(Config.INDICATOR_STATE_SPECS, Config.INDICATOR_STATE_INTERVALS)
+repository.add_bars_listener(indicator_states.on_bars_changed)
+
+def get_latest_values(exchange: str, indicator: str, interval: str = '1D') -> Optional[List[Dict[str, Any]]]:
+    """Latest values of a tracked indicator for every stock of an exchange; None if the indicator is not tracked."""
+    instance = get_indicator(indicator)
+    if instance is None or instance.get_column_name() not in indicator_states.names: return None
+    return repository.get_latest_indicator_values(exchange, instance.get_column_name(), interval)
@@ -0,0 +1,206 @@
+# backend/app/stocks/instruments.py
+# Upstox instrument master: one hash index per exchange, built once per download and kept on disk as a pickle
+# (loads in milliseconds) instead of the full JSON list that used to be scanned on every lookup.
+# Downloads are streamed: decompressed, parsed and filtered to the equity segment chunk by chunk.
+
+import codecs
+import json
+import os
+import pickle
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+
+from app.config import Config
+from .recorder import upstream_recorder
+
+print("Instrument index module loaded")
+
+# --- URLs for Upstox Instrument Files ---
+UPSTOX_INSTRUMENT_URLS = {exchange: Config.UPSTOX_INSTRUMENTS_URL.format(exchange=exchange) for exchange in ("NSE", "BSE")}
+INSTRUMENT_CACHE_DIR = os.path.abspath(Config.INSTRUMENT_CACHE_DIR) # backend/data/ by default
+INSTRUMENT_INDEX_MAX_AGE_SECONDS = 23 * 60 * 60 # Re-download if older than ~23 hours
+INSTRUMENT_INDEX_FORMAT = 2 # Bump when the pickled layout changes; older files are rebuilt (2: equity segment only)
+INSTRUMENT_DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+IndexKey = Tuple[str, str, str] # (exchange, trading_symbol, segment), all upper case
+
+class InstrumentIndex:
+    """
+    Compact lookup over one exchange's instrument master.
+    records: (exchange, trading_symbol, segment) -> (instrument_key, instrument_type, name)
+    """
+
+    def __init__(self, exchange: str, records: Dict[IndexKey, Tuple[str, str, Optional[str]]], built_at: float):
+        self.exchange = exchange; self.records = records; self.built_at = built_at
+        self._equities: Optional[List[Dict[str, str]]] = None
+
+    @classmethod
+    def from_instruments(cls, exchange: str, instruments: Iterable[Dict[str, Any]]) -> 'InstrumentIndex':
+        """Builds the index from raw Upstox instrument dicts (any iterable, consumed once); strings used by many records are interned."""
+        records = {}
+        for instrument in instruments:
+            inst_symbol = (instrument.get('trading_symbol') or '').upper(); inst_key = instrument.get('instrument_key')
+            if not inst_symbol or not inst_key: continue
+            key = (sys.intern((instrument.get('exchange') or '').upper()), inst_symbol, sys.intern((instrument.get('segment') or '').upper()))
+            records[key] = (inst_key, sys.intern((instrument.get('instrument_type') or '').upper()), instrument.get('name'))
+        return cls(exchange, records, time.time())
+
+    def get(self, symbol: str, segment: str, instrument_type: Optional[str] = 'EQ') -> Optional[str]:
+        """Instrument key for symbol in segment (e.g. 'NSE_EQ'), optionally requiring an instrument_type."""
+        record = self.records.get((self.exchange, symbol.upper(), segment.upper()))
+        if record is None or (instrument_type and record[1] != instrument_type): return None
+        return record[0]
+
+    def equities(self) -> List[Dict[str, str]]:
+        """Named EQ instruments of the exchange's equity segment, sorted by symbol (computed once per index)."""
+        if self._equities is None:
+            segment = f"{self.exchange}_EQ"
+            self._equities = sorted(
+                ({"symbol": symbol, "name": name, "exchange": self.exchange}
+                 for (exch, symbol, seg), (_, inst_type, name) in self.records.items()
+                 if exch == self.exchange and seg == segment and inst_type == 'EQ' and name),
+                key=lambda x: x['symbol'])
+        return self._equities
+
+    def __len__(self) -> int: return len(self.records)
+
+    # --- On-disk form ---
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'format': INSTRUMENT_INDEX_FORMAT, 'exchange': self.exchange, 'built_at': self.built_at, 'records': self.records},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path) # Readers never see a half-written index
+
+    @classmethod
+    def load(cls, path: str) -> Optional['InstrumentIndex']:
+        with open(path, 'rb') as f: state = pickle.load(f)
+        if not isinstance(state, dict) or state.get('format') != INSTRUMENT_INDEX_FORMAT: return None
+        return cls(state['exchange'], state['records'], state['built_at'])
+
+# --- Loading / Download ---
+_indexes: Dict[str, InstrumentIndex] = {} # {'NSE': InstrumentIndex, ...}
+_index_lock = threading.Lock() # One download per exchange even with concurrent requests
+_retry_after: Dict[str, float] = {} # exchange -> time before which a stale index is served without re-downloading
+INSTRUMENT_RETRY_SECONDS = 300
+
+def get_index_path(exchange: str) -> str:
+    return os.path.join(INSTRUMENT_CACHE_DIR, f"upstox_{exchange}_instruments.idx")
+
+def get_indexed_segments(exchange: str) -> Tuple[str, ...]:
+    """Segments kept from the exchange's instrument file - only the cash equity segment is looked up."""
+    return (f"{exchange}_EQ",)
+
+def _iter_decompressed(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Gunzips a byte stream chunk by chunk (passes it through if it is not gzip, e.g. already decoded by the server)."""
+    chunks = iter(chunks); decompressor = None
+    for chunk in chunks:
+        if not chunk: continue
+        if decompressor is None:
+            if chunk[:2] != b'\x1f\x8b': yield chunk; yield from chunks; return
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        data = decompressor.decompress(chunk)
+        if data: yield data
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if tail: yield tail
+
+def iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Yields the elements of a top-level JSON array from UTF-8 byte chunks, holding only the unparsed tail in memory."""
+    decoder = json.JSONDecoder(); utf8 = codecs.getincrementaldecoder('utf-8')()
+    buf = ''; pos = 0; started = False; finished = False
+    whitespace = ' \t\r\n'
+    def more(chunk: bytes, final: bool = False):
+        nonlocal buf, pos
+        buf = buf[pos:] + utf8.decode(chunk, final); pos = 0
+    for chunk in chunks:
+        more(chunk)
+        while not finished:
+            while pos < len(buf) and buf[pos] in whitespace: pos += 1
+            if pos >= len(buf): break
+            if not started:
+                if buf[pos] != '[': raise ValueError("Instrument file is not a JSON list")
+                started = True; pos += 1; continue
+            if buf[pos] == ',': pos += 1; continue
+            if buf[pos] == ']': finished = True; break
+            try: item, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError: break # Element continues in the next chunk
+            pos = end; yield item
+    more(b'', final=True)
+    if not finished and buf[pos:].strip(): raise ValueError("Instrument file ended inside the JSON list")
+    if not started: raise ValueError("Instrument file is empty")
+
+def _iter_download(url: str) -> Iterator[bytes]:
+    with requests.get(url, headers={'Accept-Encoding': 'gzip, deflate'}, timeout=60, stream=True) as response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=INSTRUMENT_DOWNLOAD_CHUNK_BYTES) # Undoes any Content-Encoding; the .gz body itself is gunzipped later
+
+def _recorded_download(exchange: str, url: str) -> Iterator[bytes]:
+    """Record/replay (see recorder.py): the whole file is saved/served as one fixture, then chunked like a download."""
+    body = upstream_recorder.call('instruments', (exchange,), lambda: b''.join(_iter_download(url)), codec='bytes') # Keyed by exchange, not host
+    for offset in range(0, len(body), INSTRUMENT_DOWNLOAD_CHUNK_BYTES): yield body[offset:offset + INSTRUMENT_DOWNLOAD_CHUNK_BYTES]
+
+def _stream_instruments(exchange: str) -> Iterator[Dict[str, Any]]:
+    """Downloads the exchange's instrument file, yielding only instruments in the indexed segments."""
+    url = UPSTOX_INSTRUMENT_URLS[exchange]; segments = get_indexed_segments(exchange)
+    print(f"Downloading instrument list for {exchange} from {url} (streaming, segments {', '.join(segments)})...")
+    chunks = _iter_download(url) if upstream_recorder.mode == 'live' else _recorded_download(exchange, url)
+    seen = 0
+    for instrument in iter_json_array(_iter_decompressed(chunks)):
+        seen += 1
+        if isinstance(instrument, dict) and (instrument.get('segment') or '').upper() in segments: yield instrument
+    print(f"Streamed {seen} instruments for {exchange}.")
+
+def _download_index(exchange: str) -> Optional[InstrumentIndex]:
+    try: index = InstrumentIndex.from_instruments(exchange, _stream_instruments(exchange))
+    except requests.exceptions.RequestException as e: print(f"Error downloading instrument list for {exchange}: {e}"); return None
+    except Exception as e: print(f"Error processing downloaded instrument list for {exchange}: {e}"); return None
+    if not len(index): print(f"Error: No {'/'.join(get_indexed_segments(exchange))} instruments in the {exchange} instrument list."); return None
+    return index
+
+def _is_usable(exchange: str, index: InstrumentIndex) -> bool:
+    return time.time() - index.built_at < INSTRUMENT_INDEX_MAX_AGE_SECONDS or time.time() < _retry_after.get(exchange, 0)
+
+def get_instrument_index(exchange: str) -> Optional[InstrumentIndex]:
+    """Index for 'NSE'/'BSE' from memory, the on-disk index (if fresh) or a new download; None if unavailable."""
+    exchange = exchange.upper()
+    if exchange not in UPSTOX_INSTRUMENT_URLS: print(f"Error: No download URL for exchange: {exchange}"); return None
+    index = _indexes.get(exchange)
+    if index is not None and _is_usable(exchange, index): return index
+    with _index_lock:
+        index = _indexes.get(exchange)
+        if index is not None and _is_usable(exchange, index): return index
+
+        path = get_index_path(exchange)
+        if os.path.exists(path) and index is None:
+            try:
+                started = time.perf_counter(); loaded = InstrumentIndex.load(path)
+                if loaded is not None and time.time() - loaded.built_at < INSTRUMENT_INDEX_MAX_AGE_SECONDS:
+                    print(f"Loaded instrument index for {exchange} ({len(loaded)} instruments, age {(time.time() - loaded.built_at)/3600:.1f} hours) in {(time.perf_counter() - started)*1000:.1f} ms.")
+                    _indexes[exchange] = loaded; return loaded
+                if loaded is not None: index = loaded # Stale, but better than nothing if the download fails
+                print(f"Instrument index for {exchange} is stale or outdated. Re-downloading...")
+            except Exception as e: print(f"Error reading instrument index {path}: {e}. Will attempt download.")
+
+        downloaded = _download_index(exchange)
+        if downloaded is None:
+            if index is not None:
+                print(f"Keeping stale instrument index for {exchange} (retry in {INSTRUMENT_RETRY_SECONDS}s).")
+                _retry_after[exchange] = time.time() + INSTRUMENT_RETRY_SECONDS; _indexes[exchange] = index; return index
+            return None
+        index = downloaded
+        print(f"Built instrument index for {exchange}: {len(index)} instruments.")
+        try: index.save(path); print(f"Saved instrument index to {path}")
+        except Exception as e: print(f"Warning: Could not save instrument index {path}: {e}")
+        legacy_path = os.path.join(INSTRUMENT_CACHE_DIR, f"upstox_{exchange}_instruments.json") # Pre-index JSON cache
+        if os.path.exists(legacy_path):
+            try: os.remove(legacy_path); print(f"Removed legacy instrument cache {legacy_path}")
+            except OSError as e: print(f"Warning: Could not remove {legacy_path}: {e}")
+        _indexes[exchange] = index
+        return index
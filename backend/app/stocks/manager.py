@@ -1,38 +1,53 @@
 # backend/app/stocks/manager.py
 # Reverted to simple fetcher import - assumes fetcher.py imports cleanly
 
+import numpy as np
 import pandas as pd
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 from datetime import date, timedelta
 
 # Import necessary components
 from . import repository
 from . import fetcher # Simple import now
 from .models import Stock
-from app.indicators import get_indicator
+from .singleflight import SingleFlight
+from .sources import upstream_sources
+from app.indicators import get_indicator, calculate_indicator_columns, max_lookback
+from app.database import is_reader_process
+from .indicator_cache import indicator_cache, CachedColumns
+from .pending_bars import pending_bars
 
 print("Stock manager module loaded (Upstox Primary, yfinance Fallback - Simplified Import)")
 
 class StockManager:
     """
-    Coordinates access to stock data, handling fetching (Upstox first),
+    Coordinates access to stock data, handling fetching (healthiest upstream source first, see sources.py),
     caching, intervals, and indicators.
     """
 
     def __init__(self):
-        pass
+        # Concurrent requests for the same new symbol/range share one metadata add and one upstream fetch + insert
+        self._metadata_flight = SingleFlight('metadata'); self._fetch_flight = SingleFlight('fetch')
 
     # --- ensure_stock_metadata ---
-    # Tries Upstox first for bulk download if stock is new
-    def ensure_stock_metadata(self, symbol: str, exchange: str) -> Optional[Stock]:
+    # Bulk daily download if the stock is new (Upstox preferred, see sources.py)
+    # stock_info: known metadata (e.g. from the instrument index) skips the yfinance info call;
+    # bulk_history=False skips the 10-year daily download (callers that fill coverage gaps themselves, e.g. backfill)
+    def ensure_stock_metadata(self, symbol: str, exchange: str, stock_info: Optional[Dict] = None, bulk_history: bool = True) -> Optional[Stock]:
         symbol = symbol.upper(); exchange = exchange.upper()
         stock = repository.get_stock(symbol, exchange)
+        if stock: return stock
+        return self._metadata_flight.do((symbol, exchange, bulk_history), self._add_stock_metadata, symbol, exchange, stock_info, bulk_history)
+
+    def _add_stock_metadata(self, symbol: str, exchange: str, stock_info: Optional[Dict], bulk_history: bool) -> Optional[Stock]:
+        stock = repository.get_stock(symbol, exchange) # Another flight (e.g. other bulk_history) may have added it meanwhile
         stock_was_added_now = False
 
         if stock: return stock
 
-        print(f"Manager EnsureMeta: Metadata for {symbol}/{exchange} not found. Fetching info (yfinance)...")
-        stock_info = fetcher.fetch_stock_info_yf(symbol, exchange)
+        if not stock_info:
+            print(f"Manager EnsureMeta: Metadata for {symbol}/{exchange} not found. Fetching info (yfinance)...")
+            stock_info = fetcher.fetch_stock_info_yf(symbol, exchange)
         if not stock_info: print(f"Manager EnsureMeta: Failed fetch metadata for {symbol}/{exchange}."); return None
 
         stock = Stock(
@@ -46,35 +61,127 @@ class StockManager:
         else: print(f"Manager EnsureMeta: Failed save metadata for {symbol}/{exchange}."); return None
 
         # Trigger Bulk Historical Fetch ONLY FOR DAILY DATA if Stock was NEWLY Added
-        if stock_was_added_now:
+        if stock_was_added_now and bulk_history:
             print(f"Manager EnsureMeta: Triggering BULK *DAILY* fetch for new stock {symbol}/{exchange}...")
             hist_end_date = date.today(); hist_start_date = hist_end_date - timedelta(days=365 * 10)
             hist_start_date_str = hist_start_date.strftime('%Y-%m-%d'); hist_end_date_str = hist_end_date.strftime('%Y-%m-%d')
             interval_to_fetch = '1D'
-            historical_data = None
-
-            print(f"Manager Bulk: Attempting fetch from Upstox ({interval_to_fetch})...")
-            historical_data = fetcher.fetch_stock_data_upstox(
-                symbol, exchange, interval_to_fetch, hist_start_date_str, hist_end_date_str
-            )
 
-            if historical_data is None or historical_data.empty:
-                print(f"Manager Bulk: Upstox fetch failed/empty. Falling back to yfinance ({interval_to_fetch})...")
-                historical_data = fetcher.fetch_stock_data_yf(
-                     symbol, hist_start_date_str, hist_end_date_str, exchange, interval=interval_to_fetch
-                )
+            print(f"Manager Bulk: Attempting fetch ({interval_to_fetch}), sources in health order {upstream_sources.ordered()}...")
+            historical_data, source = upstream_sources.fetch_ohlcv(symbol, exchange, interval_to_fetch, hist_start_date_str, hist_end_date_str)
 
             if historical_data is not None and not historical_data.empty:
-                print(f"Manager Bulk: Fetch successful ({len(historical_data)} rows). Storing {interval_to_fetch} data...")
-                repository.add_ohlcv_data(symbol, exchange, historical_data, interval=interval_to_fetch)
+                print(f"Manager Bulk: Fetch successful from {source} ({len(historical_data)} rows). Storing {interval_to_fetch} data...")
+                if repository.add_ohlcv_data(symbol, exchange, historical_data, interval=interval_to_fetch):
+                    pending_bars.add(symbol, exchange, interval_to_fetch, historical_data)
+                    repository.record_coverage(symbol, exchange, interval_to_fetch, hist_start_date, hist_end_date - timedelta(days=1))
             else:
                 print(f"WARNING: Bulk {interval_to_fetch} fetch failed from all sources for {symbol}/{exchange}.")
         return stock
     # --- END ensure_stock_metadata ---
 
 
+    # --- Coverage gaps ---
+    @staticmethod
+    def _coverage_end(req_end_date: date) -> date:
+        return min(req_end_date, date.today() - timedelta(days=1)) # Today's bar is provisional - never mark it checked
+
+    def _unchecked_gaps(self, symbol: str, exchange: str, fetch_interval: str, req_start_date: date, req_end_date: date) -> List[Tuple[date, date]]:
+        coverage_end = self._coverage_end(req_end_date)
+        gaps = repository.get_coverage_gaps(symbol, exchange, fetch_interval, req_start_date, coverage_end)
+        # Weekend-only gaps have no bars - unless the gap runs into today's bar, which is fetched with it
+        return [(g_start, g_end) for g_start, g_end in gaps
+                if not pd.bdate_range(g_start, g_end).empty or (g_end == coverage_end and req_end_date > coverage_end)]
+
+    # --- fill_coverage_gaps ---
+    # Fetches only the parts of a range never checked against upstream (coverage index), not the whole range.
+    # Sources in health order via upstream_sources (yf_fallback=False: Upstox only, e.g. backfill batches the fallback itself).
+    # Returns (rows stored, gaps that failed from all sources).
+    def fill_coverage_gaps(self, symbol: str, exchange: str, fetch_interval: str, req_start_date: date, req_end_date: date,
+                           yf_fallback: bool = True) -> Tuple[int, int]:
+        key = (symbol.upper(), exchange.upper(), fetch_interval.upper(), req_start_date, req_end_date, yf_fallback)
+        return self._fetch_flight.do(key, self._fill_coverage_gaps, symbol, exchange, fetch_interval, req_start_date, req_end_date, yf_fallback)
+
+    def _fill_coverage_gaps(self, symbol: str, exchange: str, fetch_interval: str, req_start_date: date, req_end_date: date,
+                            yf_fallback: bool) -> Tuple[int, int]:
+        coverage_end = self._coverage_end(req_end_date)
+        gaps = self._unchecked_gaps(symbol, exchange, fetch_interval, req_start_date, req_end_date)
+        if gaps: print(f"Manager Gaps: {len(gaps)} unchecked {fetch_interval} range(s) for {symbol}/{exchange}: {gaps}")
+        else: print(f"Manager Gaps: {fetch_interval} range [{req_start_date} - {req_end_date}] already checked for {symbol}/{exchange}.")
+
+        rows_stored = 0; failed_gaps = 0
+        for gap_start, gap_end in gaps:
+            fetch_end = req_end_date if gap_end >= coverage_end else gap_end # Last gap also pulls today's provisional bar
+            gap_start_str = gap_start.strftime('%Y-%m-%d'); gap_end_str = fetch_end.strftime('%Y-%m-%d')
+            checked_start = gap_start
+            print(f"Manager Gaps: Attempting fetch ({fetch_interval}) [{gap_start_str} to {gap_end_str}]...")
+            fetched_data, source = upstream_sources.fetch_ohlcv(symbol, exchange, fetch_interval, gap_start_str, gap_end_str,
+                                                                sources=None if yf_fallback else ['upstox'])
+            if source == 'yfinance': # yfinance caps intraday history - only the part it could serve counts as checked
+                checked_start = max(gap_start, pd.to_datetime(fetcher.get_yf_fetch_start(fetch_interval, gap_start_str, gap_end_str)).date())
+
+            if fetched_data is None:
+                print(f"Manager Gaps: Fetch failed from all sources for {symbol}/{exchange} [{gap_start_str} to {gap_end_str}]. Not marking as checked."); failed_gaps += 1; continue
+            if not fetched_data.empty:
+                print(f"Manager Gaps: Fetch successful ({len(fetched_data)} rows). Storing {fetch_interval} data...")
+                if not repository.add_ohlcv_data(symbol, exchange, fetched_data, interval=fetch_interval): failed_gaps += 1; continue
+                rows_stored += len(fetched_data); pending_bars.add(symbol, exchange, fetch_interval, fetched_data)
+            if checked_start <= min(gap_end, coverage_end): repository.record_coverage(symbol, exchange, fetch_interval, checked_start, min(gap_end, coverage_end))
+        return rows_stored, failed_gaps
+    # --- END fill_coverage_gaps ---
+
+    # --- backfill_symbol ---
+    # Used by backfill jobs: metadata (from stock_info if given) + every unchecked range of [start, end]; None on failure
+    def backfill_symbol(self, symbol: str, exchange: str, start_date_str: str, end_date_str: str,
+                        interval: str = '1D', stock_info: Optional[Dict] = None, yf_fallback: bool = True) -> Optional[int]:
+        symbol = symbol.upper(); exchange = exchange.upper()
+        if not self.ensure_stock_metadata(symbol, exchange, stock_info=stock_info, bulk_history=False): return None
+        fetch_interval = repository.get_storage_interval(interval)
+        rows_stored, failed_gaps = self.fill_coverage_gaps(symbol, exchange, fetch_interval,
+                                                           pd.to_datetime(start_date_str).date(), pd.to_datetime(end_date_str).date(),
+                                                           yf_fallback=yf_fallback)
+        return None if failed_gaps else rows_stored
+    # --- END backfill_symbol ---
+
+    # --- backfill_yf_batch ---
+    # yfinance fallback for many symbols at once: one download per Config.YF_BATCH_SIZE tickers over the union of their
+    # unchecked ranges, stored with ONE multi-symbol ingest. Returns {symbol: rows stored, or None on failure}.
+    def backfill_yf_batch(self, symbols: List[str], exchange: str, start_date_str: str, end_date_str: str,
+                          interval: str = '1D', stock_infos: Optional[Dict[str, Optional[Dict]]] = None) -> Dict[str, Optional[int]]:
+        exchange = exchange.upper(); fetch_interval = repository.get_storage_interval(interval)
+        req_start_date = pd.to_datetime(start_date_str).date(); req_end_date = pd.to_datetime(end_date_str).date()
+        coverage_end = self._coverage_end(req_end_date)
+        results: Dict[str, Optional[int]] = {}; gap_starts: Dict[str, date] = {}
+        for symbol in dict.fromkeys(s.upper() for s in symbols):
+            if not self.ensure_stock_metadata(symbol, exchange, stock_info=(stock_infos or {}).get(symbol), bulk_history=False): results[symbol] = None; continue
+            gaps = self._unchecked_gaps(symbol, exchange, fetch_interval, req_start_date, req_end_date)
+            if gaps: gap_starts[symbol] = gaps[0][0]
+            else: results[symbol] = 0
+        if not gap_starts: return results
+
+        batch_start_str = min(gap_starts.values()).strftime('%Y-%m-%d') # Already-checked parts are re-fetched; unchanged bars are skipped on upsert
+        print(f"Manager YF Batch: Fetching {len(gap_starts)} symbols ({fetch_interval}) [{batch_start_str} to {end_date_str}] from yfinance...")
+        frames = fetcher.fetch_stock_data_yf_batch(list(gap_starts), batch_start_str, end_date_str, exchange, interval=fetch_interval)
+        fetched = {symbol: frames.get(symbol) for symbol in gap_starts if frames.get(symbol) is not None}
+        to_store = [frame.rename_axis('date').assign(symbol=symbol) for symbol, frame in fetched.items() if not frame.empty]
+        if to_store:
+            counts = repository.add_ohlcv_bulk(None, exchange, pd.concat(to_store), interval=fetch_interval)
+            if counts is None:
+                print(f"Manager YF Batch: Storing {len(to_store)} symbols failed."); results.update({symbol: None for symbol in gap_starts}); return results
+            print(f"Manager YF Batch: Stored {counts['rows']} rows for {len(to_store)} symbols in one ingest ({counts['inserted']} new, {counts['updated']} updated).")
+
+        # yfinance caps intraday history - only the part it could serve counts as checked
+        checked_start = pd.to_datetime(fetcher.get_yf_fetch_start(fetch_interval, batch_start_str, end_date_str)).date()
+        for symbol in gap_starts:
+            if symbol not in fetched: print(f"Manager YF Batch: No yfinance data for {symbol}/{exchange}. Not marking as checked."); results[symbol] = None; continue
+            start = max(checked_start, gap_starts[symbol])
+            if start <= coverage_end: repository.record_coverage(symbol, exchange, fetch_interval, start, coverage_end)
+            results[symbol] = len(fetched[symbol])
+        return results
+    # --- END backfill_yf_batch ---
+
     # --- get_stock_data ---
-    # Tries Upstox first for on-demand fetch
+    # On-demand fetch of unchecked ranges, then indicators
     def get_stock_data(self,
                        symbol: str, exchange: str, start_date_str: str, end_date_str: str,
                        interval: str = '1D', indicators: Optional[List[str]] = None
@@ -85,66 +192,87 @@ class StockManager:
         stock_meta = self.ensure_stock_metadata(symbol, exchange)
         if not stock_meta: print(f"Manager GetData: Cannot proceed without metadata for {symbol}/{exchange}."); return None
 
-        stored_data = repository.get_ohlcv_data(symbol, exchange, start_date_str, end_date_str, interval=interval)
-        needs_fetch = False; data_to_process = None
-
-        if stored_data is None or stored_data.empty:
-             print(f"Manager GetData: No/incomplete {interval} data in DB for {symbol}/{exchange} range. Fetch needed."); needs_fetch = True
-        else:
-             try:
-                 min_date_db = stored_data.index.min().date(); max_date_db = stored_data.index.max().date()
-                 req_start_date = pd.to_datetime(start_date_str).date(); req_end_date = pd.to_datetime(end_date_str).date()
-                 if min_date_db > req_start_date or max_date_db < (req_end_date - timedelta(days=1)):
-                      print(f"Manager GetData: DB {interval} data [{min_date_db} - {max_date_db}] doesn't cover request [{req_start_date} - {req_end_date}]. Fetch needed.")
-                      needs_fetch = True
-                 else:
-                      print(f"Manager GetData: {interval} Data found in DB for {symbol}/{exchange}, covers range."); data_to_process = stored_data
-             except Exception as e:
-                 print(f"Manager GetData: Error checking {interval} date range coverage: {e}. Fetch needed."); needs_fetch = True
-
-        if needs_fetch:
-            fetched_data = None
-            print(f"Manager GetData: Attempting fetch from Upstox ({interval})...")
-            fetched_data = fetcher.fetch_stock_data_upstox( symbol, exchange, interval, start_date_str, end_date_str)
-
-            if fetched_data is None or fetched_data.empty:
-                print(f"Manager GetData: Upstox fetch failed/empty for {interval}. Falling back to yfinance...")
-                fetched_data = fetcher.fetch_stock_data_yf( symbol, start_date_str, end_date_str, exchange, interval=interval)
-
-            if fetched_data is not None and not fetched_data.empty:
-                print(f"Manager GetData: Fetch successful ({len(fetched_data)} rows). Storing {interval} data...")
-                repository.add_ohlcv_data(symbol, exchange, fetched_data, interval=interval)
-                data_to_process = repository.get_ohlcv_data(symbol, exchange, start_date_str, end_date_str, interval=interval)
-            elif data_to_process is None:
-                 print(f"Manager GetData: Fetch failed from all sources and no {interval} data in DB for {symbol}/{exchange}."); return None
-            else:
-                 print(f"Manager GetData: Fetch failed, using previously stored partial {interval} data for {symbol}/{exchange}.")
-
-        # Calculate Indicators
-        if indicators and data_to_process is not None and not data_to_process.empty:
-            print(f"Manager GetData: Calculating indicators on {interval} data for {symbol}/{exchange}...")
-            for indicator_request in indicators:
-                # ... (indicator calculation loop - keep as is) ...
-                indicator_instance = get_indicator(indicator_request);
-                if indicator_instance:
-                    indicator_series = indicator_instance.calculate(data_to_process);
-                    if indicator_series is not None:
-                        if isinstance(indicator_series, pd.DataFrame):
-                            for col in indicator_series.columns:
-                                data_to_process[col] = indicator_series[col]
-                                print(f"Manager GetData: Added '{col}' (multi-column)")
-                        else:
-                            data_to_process[indicator_instance.get_column_name()] = indicator_series
-                            print(f"Manager GetData: Added '{indicator_instance.get_column_name()}' (single-column)")
-
-                else: print(f"Manager GetData: Could not create indicator for '{indicator_request}'")
+        # W/M bars are derived from daily bars inside the DB and 15M/1H from 5M bars, so coverage is checked (and upstream fetched) on 1D/5M
+        try: fetch_interval = repository.get_storage_interval(interval)
+        except ValueError as e: print(f"Manager GetData: {e}"); return None
+        is_derived = fetch_interval != interval
 
+        req_start_date = pd.to_datetime(start_date_str).date(); req_end_date = pd.to_datetime(end_date_str).date()
+        self.fill_coverage_gaps(symbol, exchange, fetch_interval, req_start_date, req_end_date)
+        # Web workers read a snapshot, published at most every SNAPSHOT_INTERVAL_SECONDS: bars this process stored that it
+        # does not have yet (e.g. just now, by this request or its flight leader) are overlaid instead of waited for
+        overlay = pending_bars.get(symbol, exchange, fetch_interval)
+
+        indicator_instances = []
+        for indicator_request in indicators or []:
+            indicator_instance = get_indicator(indicator_request)
+            if indicator_instance: indicator_instances.append(indicator_instance)
+            else: print(f"Manager GetData: Could not create indicator for '{indicator_request}'")
+        # Columns already computed for this series version over a window containing the requested one are reused. The
+        # version is read BEFORE the bars: bars read after it are never older, so an entry never holds older data than its key
+        version = repository.get_data_version(symbol, exchange, interval) if indicator_instances and indicator_cache.enabled and overlay is None else None
+        series_key = (symbol, exchange, interval); cached: Dict[str, CachedColumns] = {}
+        if version is not None:
+            for indicator in indicator_instances:
+                entry = indicator_cache.get(series_key, indicator.get_column_name(), version, req_start_date, req_end_date)
+                if entry is not None: cached[indicator.get_column_name()] = entry
+        to_compute = [indicator for indicator in indicator_instances if indicator.get_column_name() not in cached]
+        # Indicators need history before start_date to be valid from it - their warm-up is read from the DB (never fetched upstream) and trimmed after
+        lookback = max_lookback(to_compute)
+
+        # Derived intervals are read directly (W/M rollups, 15M/1H buckets of the 5M bars) - never the storage interval first
+        data_to_process = repository.get_ohlcv_data(symbol, exchange, start_date_str, end_date_str, interval=interval, lookback_bars=lookback, overlay=overlay)
+        rollup_missing = data_to_process is None and is_derived and not repository.is_intraday_interval(interval)
+        if rollup_missing and repository.get_ohlcv_date_range(symbol, exchange, fetch_interval) is not None: # A MIN/MAX lookup, not a read
+            # Daily bars exist but were stored before W/M derivation existed - build the rollups once
+            print(f"Manager GetData: No derived {interval} bars yet for {symbol}/{exchange}. Rebuilding from daily...")
+            repository.rebuild_derived_bars(symbol, exchange)
+            if is_reader_process(): # Not in our snapshot yet - aggregate the daily bars on read meanwhile
+                overlay = pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume'], index=pd.DatetimeIndex([], name='date'))
+            data_to_process = repository.get_ohlcv_data(symbol, exchange, start_date_str, end_date_str, interval=interval, lookback_bars=lookback, overlay=overlay)
+        if data_to_process is None:
+            print(f"Manager GetData: No {interval} data available for {symbol}/{exchange} in requested range."); return None
+
+        # Calculate Indicators - all missing ones in one batched engine pass over the close array, the rest from the cache
+        if to_compute and data_to_process is not None and not data_to_process.empty:
+            print(f"Manager GetData: Calculating indicators on {interval} data for {symbol}/{exchange} ({lookback} warm-up bars)...")
+            results = calculate_indicator_columns(data_to_process, to_compute)
+            for columns in results.values():
+                for col, values in columns.items(): data_to_process[col] = values
+            if results: print(f"Manager GetData: Added {[col for columns in results.values() for col in columns]}")
+            if version is not None: self._cache_indicator_columns(series_key, version, to_compute, results, data_to_process.index, req_start_date, req_end_date, lookback)
+        if cached and data_to_process is not None and not data_to_process.empty:
+            for entry in cached.values():
+                for col, values in entry.aligned(data_to_process.index).items(): data_to_process[col] = values
+            print(f"Manager GetData: Reused cached {list(cached)} (data version {version})")
+        if lookback and data_to_process is not None:
+            data_to_process = data_to_process[data_to_process.index >= pd.Timestamp(req_start_date)] # Drop the warm-up bars
+            if data_to_process.empty: print(f"Manager GetData: Only warm-up bars before {req_start_date} for {symbol}/{exchange}/{interval}."); data_to_process = None
 
         if data_to_process is None: print(f"Manager GetData: Returning None for {symbol}/{exchange}/{interval}.")
         else: print(f"Manager GetData: Returning {len(data_to_process)} records for {symbol}/{exchange}/{interval}.")
         return data_to_process
     # --- END get_stock_data ---
 
+    @staticmethod
+    def _cache_indicator_columns(series_key: Tuple[str, str, str], version: int, indicators: List, results: Dict, index: pd.DatetimeIndex,
+                                 req_start_date: date, req_end_date: date, lookback: int):
+        """
+        Caches each computed indicator from its first settled bar on: its own lookback() into the read - or the first bar,
+        when the read already started at the series' first stored bar (fewer warm-up bars than requested were found).
+        """
+        times = index.values; from_series_start = int(np.searchsorted(times, np.datetime64(pd.Timestamp(req_start_date)))) < lookback
+        for indicator in indicators:
+            columns = results.get(indicator.get_column_name())
+            first = 0 if from_series_start else indicator.lookback()
+            if columns is None or first >= len(times): continue
+            indicator_cache.put(series_key, indicator.get_column_name(), version, CachedColumns(
+                times[first:].copy(), {col: values[first:].copy() for col, values in columns.items()},
+                None if from_series_start else pd.Timestamp(times[first]), pd.Timestamp(req_end_date)))
+
+    def get_inflight_stats(self) -> Dict[str, Dict]:
+        return {'metadata': self._metadata_flight.get_stats(), 'fetch': self._fetch_flight.get_stats()}
+
 # --- Instantiate the manager ---
 print("DEBUG MANAGER: --- About to instantiate StockManager ---")
 stock_manager = StockManager()
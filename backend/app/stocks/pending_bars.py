@@ -0,0 +1,49 @@
+# backend/app/stocks/pending_bars.py
+# Read-your-writes for web workers without waiting for a snapshot: a reader process remembers the bars it stored (they
+# are committed by the writer but may not be in the snapshot it reads yet) and overlays them on reads of that series
+# (repository.get_ohlcv_data(overlay=...)) until it has opened a snapshot that contains them. Only reader processes
+# record anything; the DB-owning process reads its own writes directly.
+
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app import database
+from app.ingest_service import written_generation
+
+class PendingBars:
+    """Bars this process stored per (symbol, exchange, storage interval), with the snapshot generation that has them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frames: Dict[Tuple[str, str, str], List[Tuple[int, pd.DataFrame]]] = {}
+        self.stats = {'added': 0, 'overlaid_reads': 0}
+
+    def _prune(self):
+        visible = database.get_snapshot_generation()
+        for key in list(self._frames):
+            self._frames[key] = [(generation, frame) for generation, frame in self._frames[key] if generation > visible]
+            if not self._frames[key]: del self._frames[key]
+
+    def add(self, symbol: str, exchange: str, interval: str, frame: Optional[pd.DataFrame]):
+        """Call after the write was acknowledged (its generation is known then). Later frames win on equal times."""
+        if not database.is_reader_process() or frame is None or frame.empty: return
+        with self._lock:
+            self._prune()
+            self._frames.setdefault((symbol.upper(), exchange.upper(), interval.upper()), []).append((written_generation(), frame))
+            self.stats['added'] += 1
+
+    def get(self, symbol: str, exchange: str, interval: str) -> Optional[pd.DataFrame]:
+        """Stored bars of the series not in the current snapshot yet, in write order; None if there are none."""
+        if not database.is_reader_process(): return None
+        with self._lock:
+            self._prune()
+            frames = [frame for _, frame in self._frames.get((symbol.upper(), exchange.upper(), interval.upper()), [])]
+            if frames: self.stats['overlaid_reads'] += 1
+        return pd.concat(frames) if frames else None
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock: return {**self.stats, 'series': len(self._frames)}
+
+pending_bars = PendingBars()
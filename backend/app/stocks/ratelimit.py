@@ -0,0 +1,65 @@
+# backend/app/stocks/ratelimit.py
+# Token buckets for upstream APIs. Every Upstox/yfinance request goes through its source's limiter, so interactive
+# fetches and concurrent backfill workers share one budget per process.
+
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from app.config import Config
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens/second; acquire() blocks until one is free."""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity; self.rate = rate
+        self._tokens = capacity; self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate); self._updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Takes tokens, sleeping as needed; returns the seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic(); self._refill(now)
+                if self._tokens >= tokens: self._tokens -= tokens; return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay); waited += delay
+
+class RateLimiter:
+    """All-of several token buckets, e.g. Upstox's per-second, per-minute and per-30-minute limits."""
+
+    def __init__(self, name: str, limits: List[Tuple[int, float]]):
+        self.name = name; self.limits = limits
+        self._buckets = [TokenBucket(count, count / seconds) for count, seconds in limits]
+        self._lock = threading.Lock()
+        self.stats = {'acquired': 0, 'throttled': 0, 'waited_seconds': 0.0}
+
+    def acquire(self) -> float:
+        waited = sum(bucket.acquire() for bucket in self._buckets)
+        with self._lock:
+            self.stats['acquired'] += 1; self.stats['waited_seconds'] += waited
+            if waited > 0: self.stats['throttled'] += 1
+        return waited
+
+    def get_stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {'limits': [f"{count}/{seconds:g}s" for count, seconds in self.limits], **self.stats,
+                    'waited_seconds': round(self.stats['waited_seconds'], 3)}
+
+def parse_limits(spec: str) -> List[Tuple[int, float]]:
+    """'50/1,500/60' -> [(50, 1.0), (500, 60.0)] (requests per seconds)."""
+    limits = []
+    for part in spec.split(','):
+        if not part.strip(): continue
+        count, seconds = part.strip().split('/')
+        limits.append((int(count), float(seconds)))
+    if not limits: raise ValueError(f"No rate limits in '{spec}'")
+    return limits
+
+# --- Instantiate the limiters ---
+upstox_limiter = RateLimiter('upstox', parse_limits(Config.UPSTOX_RATE_LIMITS))
+yfinance_limiter = RateLimiter('yfinance', parse_limits(Config.YF_RATE_LIMITS))
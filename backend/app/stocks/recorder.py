@@ -0,0 +1,79 @@
+# backend/app/stocks/recorder.py
+# Record/replay for upstream calls (Upstox candles, yfinance downloads/info, instrument files), so the fetch path can
+# be benchmarked and regression-tested offline. UPSTREAM_MODE: 'live' (default, pass-through), 'record' (call upstream
+# and save each response under UPSTREAM_FIXTURES_DIR) or 'replay' (serve saved responses, never touch the network).
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+from typing import Any, Callable, Dict, Tuple
+
+from app.config import Config
+
+print("Upstream recorder module loaded")
+
+UPSTREAM_MODES = ('live', 'record', 'replay')
+FIXTURE_CODECS = {'json': 'json', 'pickle': 'pkl', 'bytes': 'bin'} # codec -> file extension
+
+class FixtureMissingError(Exception):
+    """Replay found no fixture for a call. status=404 so retry logic treats it like a permanent client error."""
+    status = 404
+
+class UpstreamRecorder:
+    """Wraps each upstream call by (kind, key); process-wide, mode fixed at startup."""
+
+    def __init__(self, mode: str, fixtures_dir: str):
+        if mode not in UPSTREAM_MODES: raise ValueError(f"UPSTREAM_MODE must be one of {UPSTREAM_MODES}, got '{mode}'")
+        self.mode = mode; self.fixtures_dir = fixtures_dir
+        self._lock = threading.Lock(); self.stats = {'recorded': 0, 'replayed': 0, 'missing': 0}
+        if mode != 'live': print(f"Upstream recorder: {mode.upper()} mode, fixtures in {fixtures_dir}")
+
+    @property
+    def replaying(self) -> bool: return self.mode == 'replay'
+
+    def fixture_path(self, kind: str, key: Tuple, codec: str) -> str:
+        """<fixtures>/<kind>/<readable prefix>-<hash of the full key>.<ext>; the same call always maps to the same file."""
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()[:12]
+        prefix = re.sub(r'[^A-Za-z0-9_.-]+', '_', '_'.join(str(part) for part in key))[:80]
+        return os.path.join(self.fixtures_dir, kind, f"{prefix}-{digest}.{FIXTURE_CODECS[codec]}")
+
+    @staticmethod
+    def _load(path: str, codec: str) -> Any:
+        with open(path, 'rb') as f:
+            if codec == 'json': return json.load(f)
+            return pickle.load(f) if codec == 'pickle' else f.read()
+
+    @staticmethod
+    def _save(path: str, codec: str, value: Any):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            if codec == 'json': f.write(json.dumps(value, default=str).encode()) # e.g. NumPy scalars from yfinance
+            elif codec == 'pickle': pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            else: f.write(value)
+        os.replace(tmp_path, path)
+
+    def call(self, kind: str, key: Tuple, fn: Callable[[], Any], codec: str = 'json') -> Any:
+        """fn() in live mode; fn() + save in record mode (exceptions are not recorded); the saved value in replay mode."""
+        if self.mode == 'live': return fn()
+        path = self.fixture_path(kind, key, codec)
+        if self.mode == 'replay':
+            if not os.path.exists(path):
+                with self._lock: self.stats['missing'] += 1
+                raise FixtureMissingError(f"No {kind} fixture for {key} ({path})")
+            value = self._load(path, codec)
+            with self._lock: self.stats['replayed'] += 1
+            return value
+        value = fn()
+        self._save(path, codec, value)
+        with self._lock: self.stats['recorded'] += 1
+        return value
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock: return {'mode': self.mode, 'fixtures_dir': self.fixtures_dir, **self.stats}
+
+# --- Instantiate the recorder ---
+upstream_recorder = UpstreamRecorder(Config.UPSTREAM_MODE, Config.UPSTREAM_FIXTURES_DIR)
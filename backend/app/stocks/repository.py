@@ -1,22 +1,53 @@
 # backend/app/stocks/repository.py
-# FINAL VERSION v3.2 - Supports 1D, 1W, 1M intervals, Clean Syntax, Robust Date Handling
+# FINAL VERSION v3.6 - Supports 1D, 1W, 1M (W/M derived from daily) + intraday 5M/15M/1H (yearly partitions), integer instrument ids, Parquet cold tier
 
 import duckdb
+import json
+import os
+import re
+import shutil
+import time
+import numpy as np
 import pandas as pd
-from typing import Optional, List, Dict, Any
-from datetime import date, datetime # Import datetime
+from typing import Optional, List, Dict, Any, Union, Tuple, Callable
+from datetime import date, datetime, timedelta # Import datetime
 
-from app.database import get_db_connection
+from app.config import Config
+from app.database import get_db_connection, is_reader_process, checkpoint
+from app.ingest_service import writer_operation
 from .models import Stock
 
-print("Stock repository module loaded (1D, 1W, 1M Support - Final v3.2)")
+print("Stock repository module loaded (1D, 1W, 1M + Intraday 5M/15M/1H Support, Instrument IDs, Cold Tier - Final v3.6)")
 
 # --- Database Schema Definitions ---
-STOCKS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS stocks ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, name VARCHAR, isin VARCHAR, instrument_key VARCHAR, added_on TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_updated TIMESTAMP, PRIMARY KEY (symbol, exchange));"""
-OHLCV_DAILY_TABLE_SQL = """CREATE TABLE IF NOT EXISTS ohlcv_daily ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, date DATE NOT NULL, open DOUBLE, high DOUBLE, low DOUBLE, close DOUBLE, volume BIGINT, PRIMARY KEY (symbol, exchange, date), FOREIGN KEY (symbol, exchange) REFERENCES stocks(symbol, exchange));"""
-OHLCV_WEEKLY_TABLE_SQL = """CREATE TABLE IF NOT EXISTS ohlcv_weekly ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, date DATE NOT NULL, open DOUBLE, high DOUBLE, low DOUBLE, close DOUBLE, volume BIGINT, PRIMARY KEY (symbol, exchange, date), FOREIGN KEY (symbol, exchange) REFERENCES stocks(symbol, exchange));"""
-OHLCV_MONTHLY_TABLE_SQL = """CREATE TABLE IF NOT EXISTS ohlcv_monthly ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, date DATE NOT NULL, open DOUBLE, high DOUBLE, low DOUBLE, close DOUBLE, volume BIGINT, PRIMARY KEY (symbol, exchange, date), FOREIGN KEY (symbol, exchange) REFERENCES stocks(symbol, exchange));"""
-# Removed ohlcv_1hour table
+# Bars reference stocks through a dense integer instrument_id (assigned from a sequence) instead of repeating
+# symbol/exchange VARCHARs in every row; databases with the old layout are migrated by _migrate_compact_schema.
+OHLCV_PRICE_TYPE = 'FLOAT' if Config.OHLCV_FLOAT32_PRICES else 'DOUBLE'
+STOCKS_ID_SEQUENCE_SQL = """CREATE SEQUENCE IF NOT EXISTS stocks_instrument_id_seq START {start};"""
+STOCKS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS stocks ( instrument_id INTEGER PRIMARY KEY DEFAULT nextval('stocks_instrument_id_seq'), symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, name VARCHAR, isin VARCHAR, instrument_key VARCHAR, added_on TIMESTAMP DEFAULT CURRENT_TIMESTAMP, last_updated TIMESTAMP, UNIQUE (symbol, exchange));"""
+OHLCV_BAR_TABLE_SQL = """CREATE TABLE IF NOT EXISTS {table} ( instrument_id INTEGER NOT NULL, date DATE NOT NULL, open {price}, high {price}, low {price}, close {price}, volume BIGINT, PRIMARY KEY (instrument_id, date), FOREIGN KEY (instrument_id) REFERENCES stocks(instrument_id));"""
+OHLCV_DAILY_TABLE_SQL = OHLCV_BAR_TABLE_SQL.format(table='ohlcv_daily', price=OHLCV_PRICE_TYPE)
+OHLCV_WEEKLY_TABLE_SQL = OHLCV_BAR_TABLE_SQL.format(table='ohlcv_weekly', price=OHLCV_PRICE_TYPE)
+OHLCV_MONTHLY_TABLE_SQL = OHLCV_BAR_TABLE_SQL.format(table='ohlcv_monthly', price=OHLCV_PRICE_TYPE)
+# Intraday bars: only the finest interval (5M) is stored, in one table per calendar year (ohlcv_5min_y2025 ...)
+# keyed by TIMESTAMP (IST wall clock) with compact FLOAT/UINTEGER columns; 15M/1H are bucketed from it on read.
+OHLCV_INTRADAY_PARTITION_SQL = """CREATE TABLE IF NOT EXISTS {table} ( instrument_id INTEGER NOT NULL, ts TIMESTAMP NOT NULL, open FLOAT, high FLOAT, low FLOAT, close FLOAT, volume UINTEGER, PRIMARY KEY (instrument_id, ts), FOREIGN KEY (instrument_id) REFERENCES stocks(instrument_id));"""
+INTRADAY_BUCKET_ORIGIN = '2000-01-03 09:15:00' # NSE/BSE session open - aligns 15M/1H buckets to 09:15, 10:15, ...
+# Parquet files holding archived (cold) bars, one per (interval, instrument, year); paths relative to Config.COLD_STORAGE_DIR
+OHLCV_COLD_ARCHIVE_TABLE_SQL = """CREATE TABLE IF NOT EXISTS ohlcv_cold_archive ( bar_interval VARCHAR NOT NULL, instrument_id INTEGER NOT NULL, year INTEGER NOT NULL, path VARCHAR NOT NULL, row_count BIGINT, min_time TIMESTAMP, max_time TIMESTAMP, archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (bar_interval, instrument_id, year));"""
+# Resumable universe backfills (backfill.py): one row per job, one per (job, symbol) with its outcome
+BACKFILL_JOBS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS backfill_jobs ( job_id VARCHAR PRIMARY KEY, exchange VARCHAR NOT NULL, bar_interval VARCHAR NOT NULL, start_date DATE NOT NULL, end_date DATE NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, finished_at TIMESTAMP);"""
+BACKFILL_ITEMS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS backfill_items ( job_id VARCHAR NOT NULL, symbol VARCHAR NOT NULL, status VARCHAR NOT NULL DEFAULT 'pending', rows_stored BIGINT, attempts INTEGER DEFAULT 0, error VARCHAR, updated_at TIMESTAMP, PRIMARY KEY (job_id, symbol));"""
+# End-of-day update runs (stocks/eod.py): one row per trading day the updater finished
+EOD_RUNS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS eod_update_runs ( run_date DATE PRIMARY KEY, started_at TIMESTAMP, finished_at TIMESTAMP, symbols INTEGER, rows_stored BIGINT, failed INTEGER);"""
+# Data version per (instrument, stored interval): bumped in every ingest transaction that inserts or revises bars, so
+# derived results (stocks/indicator_cache.py) can be keyed by it - also across processes, through the snapshots
+OHLCV_VERSIONS_TABLE_SQL = """CREATE TABLE IF NOT EXISTS ohlcv_versions ( instrument_id INTEGER NOT NULL, bar_interval VARCHAR NOT NULL, version BIGINT NOT NULL, changed_at TIMESTAMP, PRIMARY KEY (instrument_id, bar_interval));"""
+# Incremental indicator state (stocks/indicator_state.py): per (instrument, interval, indicator) the snapshot after the
+# newest stored bar and the one before it (JSON), that bar's time/close and its indicator values
+INDICATOR_STATE_TABLE_SQL = """CREATE TABLE IF NOT EXISTS indicator_state ( instrument_id INTEGER NOT NULL, bar_interval VARCHAR NOT NULL, indicator VARCHAR NOT NULL, last_time TIMESTAMP NOT NULL, last_close DOUBLE, state VARCHAR NOT NULL, latest VARCHAR, updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (instrument_id, bar_interval, indicator));"""
+# Date ranges already checked against upstream per (symbol, exchange, interval) - stored ranges never overlap/touch
+OHLCV_COVERAGE_TABLE_SQL = """CREATE TABLE IF NOT EXISTS ohlcv_coverage ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, bar_interval VARCHAR NOT NULL, start_date DATE NOT NULL, end_date DATE NOT NULL, checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, PRIMARY KEY (symbol, exchange, bar_interval, start_date));"""
 
 _db_initialized = False
 
@@ -24,35 +55,190 @@ _db_initialized = False
 def _get_ohlcv_table_name(interval: str) -> Dict[str, str]:
     """Maps interval to table name and primary time column name."""
     # THIS IS THE CORRECTED VERSION RETURNING A DICT
+    # Weekly/monthly tables are derived from ohlcv_daily ('derived_from'/'period'), see rebuild_derived_bars
+    # 15M/1H have no table of their own: they are time_bucket()ed from the 5M partitions on read ('bucket')
     interval_map = {
-        '1D': {'table': 'ohlcv_daily', 'time_col': 'date'},
-        '1W': {'table': 'ohlcv_weekly', 'time_col': 'date'},
-        '1WK': {'table': 'ohlcv_weekly', 'time_col': 'date'},
-        '1M': {'table': 'ohlcv_monthly', 'time_col': 'date'},
-        '1MO': {'table': 'ohlcv_monthly', 'time_col': 'date'},
-    } # Removed 1H/60MIN mapping
-    normalized_interval = interval.upper().replace(' ', '')
+        '1D': {'table': 'ohlcv_daily', 'time_col': 'date', 'price_type': OHLCV_PRICE_TYPE},
+        '1W': {'table': 'ohlcv_weekly', 'time_col': 'date', 'price_type': OHLCV_PRICE_TYPE, 'derived_from': '1D', 'period': 'week'},
+        '1M': {'table': 'ohlcv_monthly', 'time_col': 'date', 'price_type': OHLCV_PRICE_TYPE, 'derived_from': '1D', 'period': 'month'},
+        '5M': {'table': 'ohlcv_5min', 'time_col': 'ts', 'partitioned': True, 'price_type': 'FLOAT', 'volume_type': 'UINTEGER'},
+        '15M': {'table': 'ohlcv_5min', 'time_col': 'ts', 'partitioned': True, 'price_type': 'FLOAT', 'volume_type': 'UINTEGER', 'derived_from': '5M', 'bucket': '15 minutes'},
+        '1H': {'table': 'ohlcv_5min', 'time_col': 'ts', 'partitioned': True, 'price_type': 'FLOAT', 'volume_type': 'UINTEGER', 'derived_from': '5M', 'bucket': '1 hour'},
+    }
+    normalized_interval = _canonical_interval(interval)
     if normalized_interval in interval_map:
         return interval_map[normalized_interval] # Returns the dictionary
     else:
         raise ValueError(f"Unsupported interval for table mapping: {interval}")
 
+INTERVAL_ALIASES = {'1WK': '1W', '1MO': '1M', '5MIN': '5M', '15MIN': '15M', '60MIN': '1H', '60M': '1H'}
+INTRADAY_INTERVALS = ('5M', '15M', '1H')
+
+def _canonical_interval(interval: str) -> str:
+    normalized_interval = interval.upper().replace(' ', '')
+    return INTERVAL_ALIASES.get(normalized_interval, normalized_interval)
+
+def get_storage_interval(interval: str) -> str:
+    """Returns the interval that has to be fetched/stored to serve 'interval' (1D for derived W/M, 5M for 15M/1H)."""
+    table_info = _get_ohlcv_table_name(interval)
+    return table_info.get('derived_from', _canonical_interval(interval))
+
+def is_intraday_interval(interval: str) -> bool:
+    return _canonical_interval(interval) in INTRADAY_INTERVALS
+
+# --- Intraday Partitions & Query Helpers ---
+def _partition_table(base_table: str, year: int) -> str:
+    return f"{base_table}_y{int(year)}"
+
+def _list_partition_years(con, base_table: str) -> List[int]:
+    """Years that have a partition table for base_table, ascending."""
+    rows = con.execute("SELECT table_name FROM duckdb_tables() WHERE table_name LIKE ?", [f"{base_table}_y%"]).fetchall()
+    prefix_len = len(base_table) + 2
+    return sorted(int(name[prefix_len:]) for (name,) in rows if name[prefix_len:].isdigit())
+
+def _ohlcv_source_sql(con, table_info: Dict[str, Any], start_date: Any = None, end_date: Any = None,
+                      instrument_ids: Optional[List[int]] = None) -> Optional[str]:
+    """
+    FROM-clause (the hybrid view) for an interval: hot DuckDB rows - the table itself, or a UNION ALL of only the yearly
+    partitions overlapping the range - plus archived Parquet files of the requested instruments/years, if any.
+    A bar present in both tiers is served from the hot one.
+    """
+    hot_sql = table_info['table']
+    if table_info.get('partitioned'):
+        years = _list_partition_years(con, table_info['table'])
+        if start_date is not None: years = [y for y in years if y >= pd.to_datetime(start_date).year]
+        if end_date is not None: years = [y for y in years if y <= pd.to_datetime(end_date).year]
+        hot_sql = "(" + " UNION ALL ".join(f"SELECT * FROM {_partition_table(table_info['table'], y)}" for y in years) + ")" if years else None
+    cold_files = _cold_files(con, table_info, instrument_ids, start_date, end_date)
+    if not cold_files: return hot_sql
+    time_col = table_info['time_col']
+    cold_sql = (f"SELECT instrument_id, {time_col}, {', '.join(OHLCV_VALUE_COLS)} FROM read_parquet([" +
+                ", ".join("'" + path.replace("'", "''") + "'" for path in cold_files) + "])")
+    if hot_sql is None: return f"({cold_sql})"
+    return (f"(SELECT * FROM {hot_sql} UNION ALL SELECT c.* FROM ({cold_sql}) c ANTI JOIN {hot_sql} h "
+            f"ON h.instrument_id = c.instrument_id AND h.{time_col} = c.{time_col})")
+
+def _time_range_sql(time_col: str) -> str:
+    """Inclusive date-range predicate; intraday timestamps include the whole end day."""
+    if time_col == 'date': return f"{time_col} BETWEEN ? AND ?"
+    return f"{time_col} >= CAST(? AS DATE) AND {time_col} < CAST(? AS DATE) + INTERVAL 1 DAY"
+
+def _price_sql(table_info: Dict[str, Any], col: str) -> str:
+    """FLOAT storage is widened back to DOUBLE (rounded to paise) so callers/JSON never see float32 artifacts."""
+    return f"round(CAST({col} AS DOUBLE), 2)" if table_info.get('price_type') == 'FLOAT' else col
+
+def _ohlcv_select_sql(table_info: Dict[str, Any]) -> Tuple[str, str]:
+    """SELECT list and GROUP BY/ORDER BY tail producing (time, open, high, low, close, volume) for an interval."""
+    time_col = table_info['time_col']
+    price = lambda col: _price_sql(table_info, col)
+    volume = "CAST(volume AS BIGINT)" if table_info.get('volume_type') else "volume"
+    if 'bucket' in table_info:
+        bucket_sql = f"time_bucket(INTERVAL '{table_info['bucket']}', {time_col}, TIMESTAMP '{INTRADAY_BUCKET_ORIGIN}')"
+        select_sql = (f"{bucket_sql} AS time, {price(f'arg_min(open, {time_col})')} AS open, {price('max(high)')} AS high, "
+                      f"{price('min(low)')} AS low, {price(f'arg_max(close, {time_col})')} AS close, CAST(sum(volume) AS BIGINT) AS volume")
+        return select_sql, "GROUP BY ALL ORDER BY ALL"
+    select_sql = f"CAST({time_col} AS TIMESTAMP) AS time, {price('open')} AS open, {price('high')} AS high, {price('low')} AS low, {price('close')} AS close, {volume} AS volume"
+    return select_sql, f"ORDER BY {time_col} ASC"
+
+# Derived (weekly/monthly) tables and the date_trunc period each one aggregates daily bars into
+DERIVED_TABLE_PERIODS = {'ohlcv_weekly': 'week', 'ohlcv_monthly': 'month'}
+
+# Fields returned as wide (time x symbol) panels by get_ohlcv_data_many(pivot=True)
+PANEL_FIELDS = ('close', 'volume')
+
 # Initialize DB
 def initialize_database():
     global _db_initialized
     if _db_initialized: return
-    print("Initializing/Checking DB tables (Stocks, Daily, Weekly, Monthly)...")
+    if is_reader_process(): # Schema is created/migrated by the writer; just make sure a snapshot can be opened
+        get_db_connection(read_only=True); _db_initialized = True; return
+    print("Initializing/Checking DB tables (Stocks, Daily, Weekly, Monthly, Coverage, Cold Archive, Backfill, EOD Runs, Versions, Indicator State, Materialized Indicators)...")
     try:
         con = get_db_connection()
+        _migrate_compact_schema(con)
+        con.execute(STOCKS_ID_SEQUENCE_SQL.format(start=1))
         con.execute(STOCKS_TABLE_SQL)
         con.execute(OHLCV_DAILY_TABLE_SQL)
         con.execute(OHLCV_WEEKLY_TABLE_SQL)
         con.execute(OHLCV_MONTHLY_TABLE_SQL)
+        con.execute(OHLCV_COVERAGE_TABLE_SQL)
+        con.execute(OHLCV_COLD_ARCHIVE_TABLE_SQL)
+        con.execute(BACKFILL_JOBS_TABLE_SQL)
+        con.execute(BACKFILL_ITEMS_TABLE_SQL)
+        con.execute(EOD_RUNS_TABLE_SQL)
+        con.execute(OHLCV_VERSIONS_TABLE_SQL)
+        con.execute(INDICATOR_STATE_TABLE_SQL)
+        _seed_coverage_from_daily(con)
+        _ensure_materialized_indicators(con)
         print("Database tables checked/created successfully.")
         _db_initialized = True
     except Exception as e: print(f"Error initializing database tables: {e}"); _db_initialized = False; raise
 
+# --- Instrument IDs & Schema Migration ---
+_instrument_ids: Dict[Tuple[str, str], int] = {} # (SYMBOL, EXCHANGE) -> instrument_id; an id never changes once assigned
+
+def _get_instrument_id(con, symbol: str, exchange: str) -> Optional[int]:
+    """Resolves a stock's instrument_id (cached); None if the stock is unknown."""
+    key = (symbol.upper(), exchange.upper())
+    instrument_id = _instrument_ids.get(key)
+    if instrument_id is None:
+        row = con.execute("SELECT instrument_id FROM stocks WHERE symbol = ? AND exchange = ?", list(key)).fetchone()
+        if row: instrument_id = _instrument_ids[key] = row[0]
+    return instrument_id
+
+def _table_columns(con, table_name: str) -> Dict[str, str]:
+    rows = con.execute(""" SELECT column_name, data_type FROM duckdb_columns()
+                           WHERE database_name = current_database() AND schema_name = 'main' AND table_name = ? """, [table_name]).fetchall()
+    return dict(rows)
+
+def _migrate_compact_schema(con):
+    """
+    Rebuilds stocks + bar tables in ONE transaction when the database predates instrument ids (rows keyed by
+    symbol/exchange) or when the D/W/M price type differs from Config.OHLCV_FLOAT32_PRICES. No-op otherwise.
+    """
+    stock_cols = _table_columns(con, 'stocks')
+    if not stock_cols: return # Fresh database
+    legacy = 'instrument_id' not in stock_cols
+    daily_price_type = _table_columns(con, 'ohlcv_daily').get('open')
+    if not legacy and daily_price_type in (None, OHLCV_PRICE_TYPE): return
+    # Intraday partitions are already FLOAT/UINTEGER - they only need rebuilding when re-keyed
+    bar_tables = [(t, 'date', sql) for t, sql in (('ohlcv_daily', OHLCV_DAILY_TABLE_SQL), ('ohlcv_weekly', OHLCV_WEEKLY_TABLE_SQL), ('ohlcv_monthly', OHLCV_MONTHLY_TABLE_SQL)) if _table_columns(con, t)]
+    if legacy: bar_tables += [(_partition_table('ohlcv_5min', y), 'ts', OHLCV_INTRADAY_PARTITION_SQL.format(table=_partition_table('ohlcv_5min', y))) for y in _list_partition_years(con, 'ohlcv_5min')]
+    print(f"Migrating OHLCV schema ({'symbol/exchange keys -> instrument ids' if legacy else f'{daily_price_type} -> {OHLCV_PRICE_TYPE} prices'}) for {len(bar_tables)} tables...")
+    value_cols = ", ".join(f"o.{col}" for col in OHLCV_VALUE_COLS)
+    try:
+        con.begin()
+        if legacy: # Dense ids in (exchange, symbol) order
+            con.execute("CREATE TEMP TABLE migrate_stocks AS SELECT CAST(row_number() OVER (ORDER BY exchange, symbol) AS INTEGER) AS instrument_id, * FROM stocks")
+        for table, time_col, _ in bar_tables:
+            id_sql = "s.instrument_id" if legacy else "o.instrument_id"
+            join_sql = "JOIN migrate_stocks s ON s.symbol = o.symbol AND s.exchange = o.exchange" if legacy else ""
+            con.execute(f"CREATE TEMP TABLE migrate_{table} AS SELECT {id_sql} AS instrument_id, o.{time_col}, {value_cols} FROM {table} o {join_sql}")
+            con.execute(f"DROP TABLE {table}")
+        if legacy:
+            next_id = con.execute("SELECT COALESCE(MAX(instrument_id), 0) + 1 FROM migrate_stocks").fetchone()[0]
+            con.execute("DROP TABLE stocks")
+            con.execute(STOCKS_ID_SEQUENCE_SQL.format(start=next_id)); con.execute(STOCKS_TABLE_SQL)
+            con.execute(""" INSERT INTO stocks (instrument_id, symbol, exchange, name, isin, instrument_key, added_on, last_updated)
+                SELECT instrument_id, symbol, exchange, name, isin, instrument_key, added_on, last_updated FROM migrate_stocks """)
+            con.execute("DROP TABLE migrate_stocks")
+        for table, time_col, create_sql in bar_tables:
+            con.execute(create_sql)
+            # Written in (instrument_id, time) order so every row group covers a narrow key range
+            con.execute(f"INSERT INTO {table} SELECT * FROM migrate_{table} ORDER BY instrument_id, {time_col}")
+            con.execute(f"DROP TABLE migrate_{table}")
+        con.commit()
+    except Exception as e:
+        print(f"Error migrating OHLCV schema: {e}")
+        try: con.rollback()
+        except Exception: pass
+        raise
+    _instrument_ids.clear()
+    checkpoint() # Reclaim the space of the old tables
+    print("OHLCV schema migration complete.")
+
 # add_stock function
+@writer_operation(0)
 def add_stock(stock: Stock) -> int: # Returns 1 insert, 2 update, 0 error
     initialize_database()
     print(f"Adding/updating stock: {stock.symbol} ({stock.exchange})")
@@ -83,96 +269,836 @@ def get_stock(symbol: str, exchange: str) -> Optional[Stock]:
     print(f"Querying stock: {symbol} ({exchange})")
     sql = "SELECT symbol, exchange, name, isin, instrument_key FROM stocks WHERE symbol = ? AND exchange = ?"
     try:
-        con = get_db_connection()
+        con = get_db_connection(read_only=True)
         result = con.execute(sql, [symbol.upper(), exchange.upper()]).fetchone()
         if result: return Stock(symbol=result[0], exchange=result[1], name=result[2], isin=result[3], instrument_key=result[4])
         else: return None
     except Exception as e: print(f"Error getting stock {symbol} ({exchange}): {e}"); return None
 
-# add_ohlcv_data function (Corrected Robust Date/Index Handling)
+# add_ohlcv_data function (Upsert via the bulk ingestion path)
+@writer_operation(False)
 def add_ohlcv_data(symbol: str, exchange: str, ohlcv_df: pd.DataFrame, interval: str = '1D') -> bool:
-    """Adds historical OHLCV data to the appropriate interval table with robust date handling."""
+    """Adds/updates historical OHLCV data in the appropriate interval table. Revised bars overwrite stored ones."""
     initialize_database()
     if ohlcv_df is None or ohlcv_df.empty: print(f"No OHLCV data for {symbol}/{exchange}/{interval}. Skip."); return True
+    return add_ohlcv_bulk(symbol, exchange, ohlcv_df, interval=interval) is not None
+
+# --- Bulk Ingestion ---
+OHLCV_VALUE_COLS = ['open', 'high', 'low', 'close', 'volume']
+_TIME_COL_CANDIDATES = ('date', 'time', 'timestamp', 'datetime')
+
+def _as_ingest_source(data: Any) -> Tuple[Any, List[str], int]:
+    """
+    Normalizes bulk input (pyarrow Table/RecordBatch, dict of NumPy arrays, DataFrame) to something DuckDB
+    can scan directly, without copying column data. Returns (source, column_names, row_count).
+    """
+    if hasattr(data, 'schema') and hasattr(data, 'num_rows') and hasattr(data, 'slice'): # Arrow Table / RecordBatch
+        return data, list(data.schema.names), data.num_rows
+    if isinstance(data, dict): data = pd.DataFrame(data, copy=False) # Dict of NumPy arrays -> zero-copy frame
+    if not isinstance(data, pd.DataFrame): raise TypeError(f"Unsupported OHLCV batch type: {type(data).__name__}")
+    index_name = str(data.index.name).lower() if data.index.name is not None else None
+    has_time_col = any(str(col).lower() in _TIME_COL_CANDIDATES for col in data.columns)
+    if not has_time_col and (index_name in _TIME_COL_CANDIDATES or isinstance(data.index, pd.DatetimeIndex)):
+        data = data.reset_index() # Time lives in the index (fetcher output) - expose it as a column
+        if index_name not in _TIME_COL_CANDIDATES: data = data.rename(columns={data.columns[0]: 'time'})
+    return data, [str(col) for col in data.columns], len(data)
+
+def _slice_ingest_source(source: Any, offset: int, length: int) -> Any:
+    if isinstance(source, pd.DataFrame): return source.iloc[offset:offset + length] # View, not a copy
+    return source.slice(offset, length) # Arrow slices are zero-copy
+
+@writer_operation(None)
+def add_ohlcv_bulk(symbol: Optional[str], exchange: str, data: Any, interval: str = '1D',
+                   chunk_rows: Optional[int] = None) -> Optional[Dict[str, int]]:
+    """
+    Bulk upsert of OHLCV bars. 'data' may be a pyarrow Table/RecordBatch, a dict of NumPy arrays or a DataFrame
+    (time in a date/time column or in the index). With symbol=None the batch must carry a 'symbol' column
+    (multi-symbol ingestion). Rows are staged chunk by chunk (bounded memory) and written with
+    INSERT ... ON CONFLICT DO UPDATE only where values changed, all in ONE transaction.
+    Rows repeating a (symbol, time) of the batch keep the LAST occurrence; the earlier ones count as 'duplicates' and
+    rows without a time as 'skipped'. Returns {'rows', 'inserted', 'updated', 'unchanged', 'duplicates', 'skipped'}
+    (adding up to 'rows') or None on error. The data version of every instrument with
+    changed rows is bumped in the same transaction; bars listeners are notified after the commit.
+    """
+    initialize_database()
+    try: table_info = _get_ohlcv_table_name(interval); table_name = table_info['table']; db_time_col = table_info['time_col']
+    except ValueError as e: print(f"Error adding OHLCV: {e}"); return None
+    if 'bucket' in table_info: print(f"Error adding OHLCV: {interval} is bucketed from {table_info['derived_from']} on read - store {table_info['derived_from']} bars instead."); return None
+    try: source, columns, total_rows = _as_ingest_source(data)
+    except Exception as e: print(f"Error preparing OHLCV batch for {symbol or 'multi-symbol'}/{exchange}/{interval}: {e}"); return None
+    counts = {'rows': total_rows, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'duplicates': 0, 'skipped': 0}
+    if total_rows == 0: return counts
+
+    # Map source columns case-insensitively ('Date'/'Open' from yfinance, 'date'/'open' from Upstox ...)
+    lower_map = {col.lower(): col for col in columns}
+    time_src = next((lower_map[c] for c in _TIME_COL_CANDIDATES if c in lower_map), None)
+    if time_src is None: print(f"Error: OHLCV batch lacks a time column ({'/'.join(_TIME_COL_CANDIDATES)}). Cols: {columns}"); return None
+    missing = [col for col in OHLCV_VALUE_COLS if col not in lower_map]
+    if missing: print(f"Error: OHLCV batch missing columns {missing}. Cols: {columns}"); return None
+    if symbol is None and 'symbol' not in lower_map: print("Error: Multi-symbol OHLCV batch needs a 'symbol' column."); return None
+    symbol_expr = f'upper(CAST("{lower_map["symbol"]}" AS VARCHAR))' if symbol is None else '?'
+    time_type = 'DATE' if db_time_col == 'date' else 'TIMESTAMP'
+    # Stage with the target column types so change detection compares like with like (FLOAT/UINTEGER intraday)
+    price_type = table_info.get('price_type', 'DOUBLE'); volume_type = table_info.get('volume_type', 'BIGINT')
+
+    # Symbols are resolved to instrument ids by joining stocks; unknown symbols are an error (like the FK they replace).
+    # 'ordinal' is the row's position in the whole batch (chunk offset + position in the chunk): of rows repeating a
+    # (symbol, time) the last one wins, as it would with row-by-row upserts
+    stage_sql = f""" CREATE OR REPLACE TEMP TABLE ohlcv_ingest_stage AS
+        SELECT st.instrument_id, c.* FROM (
+            SELECT {symbol_expr} AS symbol, row_number() OVER () + ? AS ordinal, CAST("{time_src}" AS {time_type}) AS {db_time_col},
+                   TRY_CAST("{lower_map['open']}" AS {price_type}) AS open, TRY_CAST("{lower_map['high']}" AS {price_type}) AS high,
+                   TRY_CAST("{lower_map['low']}" AS {price_type}) AS low, TRY_CAST("{lower_map['close']}" AS {price_type}) AS close,
+                   TRY_CAST("{lower_map['volume']}" AS {volume_type}) AS volume
+            FROM ohlcv_ingest_chunk WHERE "{time_src}" IS NOT NULL) c
+        LEFT JOIN stocks st ON st.symbol = c.symbol AND st.exchange = ?
+        QUALIFY row_number() OVER (PARTITION BY c.symbol, c.{db_time_col} ORDER BY c.ordinal DESC) = 1 """
+    changed_cond = " OR ".join(f"t.{col} IS DISTINCT FROM s.{col}" for col in OHLCV_VALUE_COLS)
+    # Per-symbol counts and touched range of NEW or CHANGED rows (drives derived-bar refresh)
+    # {target}/{stage_filter} are filled per target table (one per yearly partition for intraday)
+    diff_sql = f""" SELECT s.instrument_id, COUNT(*) FILTER (WHERE t.{db_time_col} IS NULL) AS inserted,
+               COUNT(*) FILTER (WHERE t.{db_time_col} IS NOT NULL AND ({changed_cond})) AS updated,
+               COUNT(*) AS staged,
+               MIN(s.{db_time_col}) FILTER (WHERE t.{db_time_col} IS NULL OR {changed_cond}) AS min_changed,
+               MAX(s.{db_time_col}) FILTER (WHERE t.{db_time_col} IS NULL OR {changed_cond}) AS max_changed
+        FROM ohlcv_ingest_stage s LEFT JOIN {{target}} t
+          ON t.instrument_id = s.instrument_id AND t.{db_time_col} = s.{db_time_col}
+        {{stage_filter}} GROUP BY s.instrument_id """
+    cols_for_db = ['instrument_id', db_time_col] + OHLCV_VALUE_COLS
+    # Rows go in ordered by (instrument_id, time) so each row group's min/max zonemap stays tight for range scans
+    upsert_sql = f""" INSERT INTO {{target}} ({", ".join(cols_for_db)}) SELECT {", ".join(cols_for_db)} FROM ohlcv_ingest_stage s {{stage_filter}}
+        ORDER BY instrument_id, {db_time_col}
+        ON CONFLICT (instrument_id, {db_time_col}) DO UPDATE SET {", ".join(f"{col} = excluded.{col}" for col in OHLCV_VALUE_COLS)}
+        WHERE {" OR ".join(f"{{target}}.{col} IS DISTINCT FROM excluded.{col}" for col in OHLCV_VALUE_COLS)} """
+
+    chunk_rows = chunk_rows or Config.INGEST_CHUNK_ROWS
+    symbol_params = [] if symbol is None else [symbol.upper()]
+    touched: Dict[int, List[Any]] = {} # instrument_id -> [min_changed, max_changed]
+    print(f"Bulk ingest: {total_rows} {interval} rows for {symbol or 'multi-symbol'} ({exchange}) into {table_name} (chunks of {chunk_rows})...")
+    con = None
+    try:
+        con = get_db_connection(); con.begin()
+        for offset in range(0, total_rows, chunk_rows):
+            con.register('ohlcv_ingest_chunk', _slice_ingest_source(source, offset, chunk_rows))
+            try:
+                con.execute(stage_sql, symbol_params + [offset, exchange.upper()])
+                chunk_len, skipped = con.execute(f'SELECT COUNT(*), COUNT(*) FILTER (WHERE "{time_src}" IS NULL) FROM ohlcv_ingest_chunk').fetchone()
+                counts['skipped'] += skipped
+                counts['duplicates'] += chunk_len - skipped - con.execute("SELECT COUNT(*) FROM ohlcv_ingest_stage").fetchone()[0]
+                unknown = con.execute("SELECT list(DISTINCT symbol) FROM ohlcv_ingest_stage WHERE instrument_id IS NULL").fetchone()[0]
+                if unknown: raise ValueError(f"Unknown stocks on {exchange.upper()} (add metadata first): {sorted(unknown)[:10]}")
+                for target, stage_filter, filter_params in _ingest_targets(con, table_info):
+                    chunk_changed = False
+                    for instrument_id, inserted, updated, staged, min_changed, max_changed in con.execute(diff_sql.format(target=target, stage_filter=stage_filter), filter_params).fetchall():
+                        counts['inserted'] += inserted; counts['updated'] += updated; counts['unchanged'] += staged - inserted - updated
+                        if min_changed is not None:
+                            chunk_changed = True
+                            span = touched.setdefault(instrument_id, [min_changed, max_changed])
+                            span[0] = min(span[0], min_changed); span[1] = max(span[1], max_changed)
+                    if chunk_changed: con.execute(upsert_sql.format(target=target, stage_filter=stage_filter), filter_params) # Skip the write for unchanged chunks
+            finally: con.unregister('ohlcv_ingest_chunk')
+        if table_name == 'ohlcv_daily':
+            for instrument_id, (min_changed, max_changed) in touched.items():
+                _rebuild_derived_bars(con, instrument_id, min_changed, max_changed)
+            if touched: _refresh_materialized_indicators(con, {instrument_id: span[0] for instrument_id, span in touched.items()})
+        if touched: # Derived W/M (and bucketed 15M/1H) bars share the version of the interval they are built from
+            con.execute(""" INSERT INTO ohlcv_versions (instrument_id, bar_interval, version, changed_at) SELECT unnest(?::INTEGER[]), ?, 1, now()
+                ON CONFLICT (instrument_id, bar_interval) DO UPDATE SET version = ohlcv_versions.version + 1, changed_at = excluded.changed_at """,
+                [list(touched), _canonical_interval(interval)])
+        con.execute("DROP TABLE IF EXISTS ohlcv_ingest_stage")
+        con.commit()
+        print(f"Bulk ingest done for {symbol or f'{len(touched)} symbols'}/{exchange}/{interval}: {counts}")
+    except Exception as e:
+        print(f"Error in bulk {interval} OHLCV ingest via SQL: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return None
+    if touched: _notify_bars_changed(_canonical_interval(interval), touched)
+    return counts
+
+def get_data_version(symbol: str, exchange: str, interval: str = '1D') -> Optional[int]:
+    """
+    Version of the stored bars behind `interval` (its storage interval: 1D for 1W/1M, 5M for 15M/1H). Any ingest that
+    changes rows bumps it; 0 = unchanged since versions were introduced. None on error.
+    """
+    initialize_database()
+    try: storage_interval = get_storage_interval(interval)
+    except ValueError as e: print(f"Error getting data version: {e}"); return None
+    try:
+        row = get_db_connection(read_only=True).execute(""" SELECT v.version FROM ohlcv_versions v JOIN stocks s USING (instrument_id)
+            WHERE s.symbol = ? AND s.exchange = ? AND v.bar_interval = ? """, [symbol.upper(), exchange.upper(), storage_interval]).fetchone()
+    except Exception as e: print(f"Error getting data version for {symbol}/{exchange}/{interval}: {e}"); return None
+    return row[0] if row else 0
+
+# --- Change Listeners ---
+# Called after every committed ingest that inserted or revised bars, as listener(interval, {instrument_id: [min_changed,
+# max_changed]}), in the process that wrote them (the writer in reader/writer mode). Daily changes imply the weekly and
+# monthly bars of the touched periods. Listener errors are logged; the ingest has already succeeded.
+BarsListener = Callable[[str, Dict[int, List[Any]]], None]
+_bars_listeners: List[BarsListener] = []
+
+def add_bars_listener(listener: BarsListener):
+    if listener not in _bars_listeners: _bars_listeners.append(listener)
+
+def _notify_bars_changed(interval: str, touched: Dict[int, List[Any]]):
+    for listener in _bars_listeners:
+        try: listener(interval, touched)
+        except Exception as e: print(f"Error in bars listener {getattr(listener, '__name__', listener)} ({interval}, {len(touched)} instruments): {e}")
+
+def _ingest_targets(con, table_info: Dict[str, Any]) -> List[Tuple[str, str, list]]:
+    """(target table, stage filter, params) for the staged chunk; creates missing yearly intraday partitions."""
+    if not table_info.get('partitioned'): return [(table_info['table'], "", [])]
+    targets = []
+    for (year,) in con.execute(f"SELECT DISTINCT year({table_info['time_col']}) FROM ohlcv_ingest_stage ORDER BY 1").fetchall():
+        partition = _partition_table(table_info['table'], year)
+        con.execute(OHLCV_INTRADAY_PARTITION_SQL.format(table=partition))
+        targets.append((partition, f"WHERE year(s.{table_info['time_col']}) = ?", [year]))
+    return targets
+
+# --- Derived Weekly/Monthly Bars ---
+def _rebuild_derived_bars(con, instrument_id: int, start_date: Optional[date] = None, end_date: Optional[date] = None):
+    """
+    Re-aggregates weekly/monthly bars from ohlcv_daily for every period touching [start_date, end_date]
+    (all periods when no range is given). Runs on the caller's cursor/transaction.
+    """
+    for table_name, period in DERIVED_TABLE_PERIODS.items():
+        range_sql = ""; params = [instrument_id]
+        if start_date is not None and end_date is not None:
+            # Widen the range to whole periods so partially touched weeks/months are fully re-aggregated
+            range_sql = f" AND date >= date_trunc('{period}', ?::DATE) AND date < date_trunc('{period}', ?::DATE) + INTERVAL 1 {period.upper()}"
+            params += [start_date, end_date]
+        con.execute(f"DELETE FROM {table_name} WHERE instrument_id = ?{range_sql}", params)
+        # Periods are widened by up to a month on each side, so the daily source covers archived years too
+        daily_sql = _ohlcv_source_sql(con, _get_ohlcv_table_name('1D'), start_date and pd.to_datetime(start_date) - timedelta(days=31),
+                                      end_date and pd.to_datetime(end_date) + timedelta(days=31), [instrument_id])
+        con.execute(f""" INSERT INTO {table_name} (instrument_id, date, open, high, low, close, volume)
+            SELECT instrument_id, date_trunc('{period}', date)::DATE AS period_start,
+                   arg_min(open, date), max(high), min(low), arg_max(close, date), sum(volume)
+            FROM {daily_sql} WHERE instrument_id = ?{range_sql}
+            GROUP BY instrument_id, period_start """, params)
+
+# --- Materialized Indicators ---
+# Config.MATERIALIZED_INDICATORS (SMA_n, EMA_n, RSI_n) are columns of ohlcv_daily_indicators - one row per daily bar,
+# computed in SQL over the whole stored history (hot + cold tier) - so universe-wide screens are one query instead of
+# a pandas pass per symbol. SMA is a window AVG. EMA and RSI are recursions y[t] = decay * y[t-1] + b[t], which window
+# functions cannot express directly: they are evaluated as exponentially weighted running sums restarted every
+# segment of rows (keeping decay**-offset finite) plus the carried sum of the previous segment; terms older than that
+# (weight < e**-MATERIALIZED_SEGMENT_TIME_CONSTANTS) are dropped. Semantics match the NumPy engine (SMA-seeded EMA,
+# Wilder RSI). Each daily ingest rewrites the touched instruments' rows from their first changed bar on, inside its
+# transaction; a changed column set rebuilds the table. The table is derived data and stays hot (never archived).
+MATERIALIZED_TABLE = 'ohlcv_daily_indicators'
+MATERIALIZED_LATEST_VIEW = 'latest_daily_indicators' # Newest row per stock, with symbol/exchange
+MATERIALIZED_SEGMENT_TIME_CONSTANTS = 36 # e**-36 < 2.3e-16: the dropped terms are below double precision
+
+def _parse_materialized_specs(specs: str) -> List[Tuple[str, str, int]]:
+    """'SMA_50,RSI_14' -> [(column, kind, length)]; unsupported specs are logged and skipped."""
+    parsed = []
+    for spec in (s.strip().upper() for s in specs.split(',') if s.strip()):
+        match = re.fullmatch(r'(SMA|EMA|RSI)_(\d+)', spec)
+        if match is None or int(match.group(2)) <= 0: print(f"Materialized indicators: '{spec}' not supported (SMA_n, EMA_n, RSI_n) - skipped."); continue
+        if spec not in [column for column, _, _ in parsed]: parsed.append((spec, match.group(1), int(match.group(2))))
+    return parsed
+
+MATERIALIZED_SPECS = _parse_materialized_specs(Config.MATERIALIZED_INDICATORS)
+
+def _segment_rows(decay: float) -> int:
+    """Rows per running-sum segment: decay**-(rows-1) stays below e**MATERIALIZED_SEGMENT_TIME_CONSTANTS."""
+    return 1 if decay <= 0.0 else max(1, int(np.ceil(MATERIALIZED_SEGMENT_TIME_CONSTANTS / -np.log(decay))))
+
+def _decayed_sum_ctes(name: str, value_col: str, first_rn: int, decay: float) -> List[str]:
+    """CTEs defining `name`(instrument_id, rn, s) with s[t] = sum over rn first_rn..t of decay**(t-j) * value[j]."""
+    rows = _segment_rows(decay); d = f"CAST({decay!r} AS DOUBLE)"
+    return [f"""{name}_terms AS (SELECT instrument_id, rn, seg, off, SUM({value_col} * pow({d}, -off)) OVER (PARTITION BY instrument_id, seg ORDER BY rn ROWS UNBOUNDED PRECEDING) AS cum
+                FROM (SELECT instrument_id, rn, {value_col}, (rn - {first_rn}) // {rows} AS seg, (rn - {first_rn}) % {rows} AS off FROM materialized_bars WHERE rn >= {first_rn}))""",
+            f"""{name}_totals AS (SELECT instrument_id, seg + 1 AS next_seg, arg_max(cum, rn) AS total FROM {name}_terms GROUP BY instrument_id, seg)""",
+            f"""{name} AS (SELECT t.instrument_id, t.rn, pow({d}, t.off) * t.cum + COALESCE(pow({d}, t.off + {rows}) * p.total, 0) AS s
+                FROM {name}_terms t LEFT JOIN {name}_totals p ON p.instrument_id = t.instrument_id AND p.next_seg = t.seg)"""]
+
+def _materialized_select_sql(source_sql: str, price_sql: str, instrument_filter: str) -> str:
+    """SELECT of (instrument_id, date, <one column per spec>) for every bar of the filtered instruments."""
+    ctes = [f"""materialized_bars AS (SELECT instrument_id, date, close, row_number() OVER w - 1 AS rn,
+                greatest(close - lag(close) OVER w, 0) AS gain, greatest(lag(close) OVER w - close, 0) AS loss
+                FROM (SELECT instrument_id, date, {price_sql} AS close FROM {source_sql} WHERE {instrument_filter})
+                WINDOW w AS (PARTITION BY instrument_id ORDER BY date))"""]
+    columns = []; joins = []
+    for column, kind, length in MATERIALIZED_SPECS:
+        name = column.lower()
+        if kind == 'SMA':
+            columns.append(f'''CASE WHEN b.rn >= {length - 1} THEN AVG(b.close) OVER (PARTITION BY b.instrument_id ORDER BY b.date ROWS BETWEEN {length - 1} PRECEDING AND CURRENT ROW) END AS "{column}"''')
+        elif kind == 'EMA': # y[length-1] = SMA seed, then y[t] = decay * y[t-1] + alpha * close[t]
+            alpha = 2.0 / (length + 1); decay = 1.0 - alpha
+            ctes += _decayed_sum_ctes(name, 'close', length, decay)
+            ctes.append(f"""{name}_seed AS (SELECT instrument_id, avg(close) AS seed FROM materialized_bars WHERE rn < {length} GROUP BY instrument_id HAVING count(*) = {length})""")
+            joins += [f"LEFT JOIN {name}_seed ON {name}_seed.instrument_id = b.instrument_id", f"LEFT JOIN {name} ON {name}.instrument_id = b.instrument_id AND {name}.rn = b.rn"]
+            columns.append(f'''CASE WHEN b.rn >= {length - 1} THEN {name}_seed.seed * pow(CAST({decay!r} AS DOUBLE), b.rn - {length - 1}) + {alpha!r} * COALESCE({name}.s, 0) END AS "{column}"''')
+        else: # Wilder RSI: the ratio of the decayed gain/loss sums (adjust=True denominators cancel), from `length` price changes on
+            decay = 1.0 - 1.0 / length
+            ctes += _decayed_sum_ctes(f"{name}_g", 'gain', 1, decay) + _decayed_sum_ctes(f"{name}_l", 'loss', 1, decay)
+            joins += [f"LEFT JOIN {name}_g ON {name}_g.instrument_id = b.instrument_id AND {name}_g.rn = b.rn", f"LEFT JOIN {name}_l ON {name}_l.instrument_id = b.instrument_id AND {name}_l.rn = b.rn"]
+            columns.append(f'''CASE WHEN b.rn >= {length} AND {name}_g.s + {name}_l.s > 0 THEN 100 * {name}_g.s / ({name}_g.s + {name}_l.s) END AS "{column}"''')
+    return f"WITH {', '.join(ctes)} SELECT b.instrument_id, b.date, {', '.join(columns)} FROM materialized_bars b {' '.join(joins)}"
+
+def _ensure_materialized_indicators(con):
+    """Creates the table/view for the configured columns; a different column set recreates and fully rebuilds it."""
+    wanted = {column: 'DOUBLE' for column, _, _ in MATERIALIZED_SPECS}
+    existing = _table_columns(con, MATERIALIZED_TABLE)
+    if existing and {k.upper(): v for k, v in existing.items() if k not in ('instrument_id', 'date')} == wanted: return
+    con.execute(f"DROP VIEW IF EXISTS {MATERIALIZED_LATEST_VIEW}"); con.execute(f"DROP TABLE IF EXISTS {MATERIALIZED_TABLE}")
+    if not MATERIALIZED_SPECS: return
+    column_sql = "".join(f', "{column}" DOUBLE' for column in wanted)
+    con.execute(f"CREATE TABLE {MATERIALIZED_TABLE} ( instrument_id INTEGER NOT NULL, date DATE NOT NULL{column_sql}, PRIMARY KEY (instrument_id, date));")
+    con.execute(f""" CREATE VIEW {MATERIALIZED_LATEST_VIEW} AS SELECT s.symbol, s.exchange, m.* FROM
+        (SELECT * FROM {MATERIALIZED_TABLE} QUALIFY row_number() OVER (PARTITION BY instrument_id ORDER BY date DESC) = 1) m JOIN stocks s USING (instrument_id) """)
+    started = time.perf_counter(); con.begin()
+    try: rows = _refresh_materialized_indicators(con); con.commit()
+    except Exception: con.rollback(); raise
+    print(f"Materialized indicators: Built {MATERIALIZED_TABLE} ({', '.join(wanted)}) - {rows} rows in {time.perf_counter() - started:.1f}s")
+
+def _refresh_materialized_indicators(con, changed_from: Optional[Dict[int, Any]] = None) -> int:
+    """
+    Rewrites materialized rows: per instrument from changed_from[instrument_id] on, or all rows (None).
+    Runs on the caller's cursor/transaction. Returns the number of rows written.
+    """
+    if not MATERIALIZED_SPECS: return 0
+    table_info = _get_ohlcv_table_name('1D')
+    ids = sorted(changed_from) if changed_from is not None else None
+    source_sql = _ohlcv_source_sql(con, table_info, instrument_ids=ids)
+    columns = ", ".join(f'"{column}"' for column, _, _ in MATERIALIZED_SPECS)
+    if changed_from is None:
+        con.execute(f"DELETE FROM {MATERIALIZED_TABLE}")
+        select_sql = _materialized_select_sql(source_sql, _price_sql(table_info, 'close'), "TRUE")
+        return con.execute(f"INSERT INTO {MATERIALIZED_TABLE} (instrument_id, date, {columns}) {select_sql}").fetchone()[0]
+    # Each instrument's rows are computed over its whole history (row numbers and running sums start at its first bar)
+    select_sql = _materialized_select_sql(source_sql, _price_sql(table_info, 'close'), "instrument_id IN (SELECT unnest(?::INTEGER[]))")
+    from_dates = [pd.Timestamp(changed_from[i]).date() for i in ids]
+    return con.execute(f""" INSERT OR REPLACE INTO {MATERIALIZED_TABLE} (instrument_id, date, {columns}) SELECT m.instrument_id, m.date, {columns}
+        FROM ({select_sql}) m JOIN (SELECT unnest(?::INTEGER[]) AS instrument_id, unnest(?::DATE[]) AS from_date) f USING (instrument_id)
+        WHERE m.date >= f.from_date """, [ids, ids, from_dates]).fetchone()[0]
+
+@writer_operation(None)
+def rebuild_materialized_indicators() -> Optional[int]:
+    """Recomputes the whole materialized table (e.g. after a manual data fix). Returns rows written, None on error."""
+    initialize_database()
+    if not MATERIALIZED_SPECS: print("Materialized indicators: None configured (MATERIALIZED_INDICATORS)."); return 0
+    con = None
+    try:
+        con = get_db_connection(); con.begin(); rows = _refresh_materialized_indicators(con); con.commit(); return rows
+    except Exception as e:
+        print(f"Error rebuilding materialized indicators: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return None
+
+def screen_materialized_indicators(exchange: str, indicator: Optional[str] = None, min_value: Optional[float] = None,
+                                   max_value: Optional[float] = None) -> Optional[List[Dict[str, Any]]]:
+    """
+    Newest materialized row of every stock of an exchange - one query over the latest-row view - optionally filtered to
+    min_value <= indicator <= max_value and ordered by it. None if the indicator is not materialized (or on error).
+    """
+    initialize_database()
+    columns = [column for column, _, _ in MATERIALIZED_SPECS]
+    if not columns or (indicator is not None and indicator.upper() not in columns): return None
+    where = ["exchange = ?"]; params: List[Any] = [exchange.upper()]
+    if indicator is not None:
+        indicator = indicator.upper(); where.append(f'"{indicator}" IS NOT NULL')
+        if min_value is not None: where.append(f'"{indicator}" >= ?'); params.append(min_value)
+        if max_value is not None: where.append(f'"{indicator}" <= ?'); params.append(max_value)
+    order = f'"{indicator}", symbol' if indicator is not None else "symbol"
+    try:
+        result = get_db_connection(read_only=True).execute(f""" SELECT symbol, CAST(date AS TIMESTAMP) AS time, {", ".join(f'"{c}"' for c in columns)}
+            FROM {MATERIALIZED_LATEST_VIEW} WHERE {" AND ".join(where)} ORDER BY {order} """, params)
+        names = [d[0] for d in result.description]
+        return [dict(zip(names, row)) for row in result.fetchall()]
+    except Exception as e: print(f"Error screening materialized indicators ({exchange}): {e}"); return None
+
+@writer_operation(False)
+def rebuild_derived_bars(symbol: str, exchange: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> bool:
+    """Rebuilds weekly/monthly bars for a stock from its stored daily bars (full history if no range)."""
+    initialize_database()
+    print(f"Rebuilding derived W/M bars for {symbol} ({exchange}) [{start_date or 'all'} to {end_date or 'all'}]")
+    con = None
+    try:
+        con = get_db_connection()
+        instrument_id = _get_instrument_id(con, symbol, exchange)
+        if instrument_id is None: print(f"Cannot rebuild derived bars: unknown stock {symbol}/{exchange}."); return False
+        con.begin()
+        _rebuild_derived_bars(con, instrument_id, start_date, end_date)
+        con.commit(); return True
+    except Exception as e:
+        print(f"Error rebuilding derived bars for {symbol}/{exchange}: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return False
 
-    try: table_info = _get_ohlcv_table_name(interval); table_name = table_info['table']; db_time_col = table_info['time_col'] # time_col is 'date' for D/W/M
-    except ValueError as e: print(f"Error adding OHLCV: {e}"); return False
-
-    print(f"Adding {len(ohlcv_df)} {interval} records for {symbol} ({exchange}) to {table_name}...")
-    df = ohlcv_df.copy()
-
-    # --- Robust Time Column Handling ---
-    time_col_in_df = None
-    # Check index first (case-insensitive check against expected DB col name)
-    if df.index.name is not None and df.index.name.lower() == db_time_col:
-        print(f"DEBUG REPO Add ({interval}): Index named '{df.index.name}' found. Resetting index.")
-        df.reset_index(inplace=True)
-        # After reset, the column name will match the original index name ('Date' or 'time' etc.)
-        time_col_in_df = df.columns[0] # Assume it's the first column after reset
-        # Rename immediately if needed before checking other columns
-        if time_col_in_df.lower() == db_time_col and time_col_in_df != db_time_col:
-             df.rename(columns={time_col_in_df: db_time_col}, inplace=True)
-             time_col_in_df = db_time_col # Update the name
-    else: # Check if column exists (case-insensitive)
-        for col in df.columns:
-            if col.lower() == db_time_col: time_col_in_df = col; break
-
-    if not time_col_in_df: print(f"Error: DataFrame lacks required time column '{db_time_col}'. Cols: {df.columns}"); return False
-    print(f"DEBUG REPO Add ({interval}): Using time data from column '{time_col_in_df}' -> target '{db_time_col}'")
-
-    # Ensure the target time column exists and has correct type
-    try:
-        df[db_time_col] = pd.to_datetime(df[time_col_in_df]) # Convert source column to target column as datetime
-        if db_time_col == 'date': df[db_time_col] = df[db_time_col].dt.date # Keep only date part if DB wants DATE
-        print(f"DEBUG REPO Add ({interval}): Time column '{db_time_col}' processed.")
-    except Exception as date_err: print(f"Error processing time column '{time_col_in_df}'->'{db_time_col}': {date_err}"); return False
-
-    # Rename if original column name was different and target is now correct
-    if time_col_in_df != db_time_col and time_col_in_df in df.columns:
-        df.drop(columns=[time_col_in_df], inplace=True) # Drop original if different name and conversion done
-
-    df['symbol'] = symbol.upper(); df['exchange'] = exchange.upper()
-    required_value_cols = ['open', 'high', 'low', 'close', 'volume']
-    if not all(col in df.columns for col in required_value_cols): print(f"Error: DataFrame missing OHLCV columns."); return False
-    cols_for_db = ['symbol', 'exchange', db_time_col] + required_value_cols
-    df_to_insert = df[cols_for_db]
-    # --- End Time Handling ---
-
-    try: # Insert data
-        con = get_db_connection(); con.register('ohlcv_temp_view', df_to_insert)
-        insert_sql = f""" INSERT OR IGNORE INTO {table_name} ({", ".join(cols_for_db)}) SELECT {", ".join(cols_for_db)} FROM ohlcv_temp_view """
-        result = con.execute(insert_sql); inserted_count = result.fetchone(); inserted_count = inserted_count[0] if inserted_count else 0; con.commit(); con.unregister('ohlcv_temp_view')
-        print(f"Processed {len(df_to_insert)} records for {symbol}/{exchange}/{interval}. New rows: {inserted_count}"); return True
-    except Exception as e: print(f"Error adding {interval} OHLCV data via SQL: {e}"); return False
 
+# --- Read Output Formats ---
+# 'pandas' -> DataFrame indexed by 'time'; 'arrow' -> pyarrow.Table straight from DuckDB (no pandas copies);
+# 'numpy'  -> dict of contiguous NumPy arrays ('time' as datetime64). Arrow/NumPy skip the DataFrame build entirely.
+READ_OUTPUT_FORMATS = ('pandas', 'arrow', 'numpy')
+
+def _fetch_ohlcv_result(result, output: str):
+    """Materializes a DuckDB result in the requested output format. Returns None when empty."""
+    if output == 'arrow':
+        table = result.fetch_arrow_table()
+        return table if table.num_rows else None
+    if output == 'numpy':
+        arrays = result.fetchnumpy()
+        return arrays if len(arrays['time']) else None
+    df = result.fetchdf()
+    return df if not df.empty else None
+
+def _lookback_start(con, table_info: Dict[str, Any], instrument_id: int, start_date: Any, lookback_bars: int) -> Optional[date]:
+    """
+    Day of the lookback_bars-th stored bar before start_date (the earliest one if there are fewer), None if there is none.
+    Bucketed intervals count base bars (a 1H bucket = 12 x 5M) plus one bucket of slack for a partial first bucket.
+    """
+    time_col = table_info['time_col']
+    if 'bucket' in table_info: lookback_bars = (lookback_bars + 1) * int(pd.Timedelta(table_info['bucket']) / pd.Timedelta(minutes=5))
+    source_sql = _ohlcv_source_sql(con, table_info, None, start_date, [instrument_id])
+    if source_sql is None: return None
+    sql = f""" SELECT min({time_col}) FROM (SELECT {time_col} FROM {source_sql} WHERE instrument_id = ? AND {time_col} < CAST(? AS DATE)
+               ORDER BY {time_col} DESC LIMIT ?) """
+    first = con.execute(sql, [instrument_id, start_date, lookback_bars]).fetchone()[0]
+    return pd.Timestamp(first).date() if first is not None else None
 
 # get_ohlcv_data function
-def get_ohlcv_data(symbol: str, exchange: str, start_date: str, end_date: str, interval: str = '1D') -> Optional[pd.DataFrame]:
-    """Retrieves OHLCV data, returns DataFrame with DatetimeIndex named 'time'."""
+def get_ohlcv_data(symbol: str, exchange: str, start_date: str, end_date: str, interval: str = '1D',
+                   output: str = 'pandas', lookback_bars: int = 0, overlay: Optional[pd.DataFrame] = None) -> Optional[Union[pd.DataFrame, Any]]:
+    """
+    Retrieves OHLCV data. Default returns DataFrame with DatetimeIndex named 'time';
+    output='arrow' / 'numpy' return the raw Arrow table / dict of NumPy arrays (see READ_OUTPUT_FORMATS).
+    lookback_bars > 0 also returns (up to) that many stored bars before start_date - indicator warm-up; callers trim.
+    overlay: bars of the storage interval (see get_storage_interval) this process just wrote, which a reader's snapshot
+    may not have yet - they replace stored bars at the same times and derived intervals are aggregated on read.
+    """
     initialize_database();
-    try: table_info = _get_ohlcv_table_name(interval); table_name = table_info['table']; time_col = table_info['time_col'] # 'date' for D/W/M
+    if output not in READ_OUTPUT_FORMATS: print(f"Error getting OHLCV: Unsupported output format '{output}'"); return None
+    try: table_info = _get_ohlcv_table_name(interval); table_name = table_info['table']; time_col = table_info['time_col'] # 'date' for D/W/M, 'ts' intraday
     except ValueError as e: print(f"Error getting OHLCV: {e}"); return None
     print(f"Querying {interval} OHLCV from {table_name} for {symbol} ({exchange}) [{start_date} to {end_date}]")
-    sql = f""" SELECT {time_col}, open, high, low, close, volume FROM {table_name} WHERE symbol = ? AND exchange = ? AND {time_col} BETWEEN ? AND ? ORDER BY {time_col} ASC """
-    try:
-        con = get_db_connection(); df = con.execute(sql, [symbol.upper(), exchange.upper(), start_date, end_date]).fetchdf()
-        if df.empty: print(f"No {interval} OHLCV data found."); return None
-        # Convert source time column ('date') to datetime and set as index named 'time'
-        df['time'] = pd.to_datetime(df[time_col])
-        if time_col != 'time': df.drop(columns=[time_col], inplace=True)
-        df.set_index('time', inplace=True) # Ensure DatetimeIndex named 'time'
-        print(f"Retrieved {len(df)} {interval} records for {symbol}/{exchange}."); return df
+    try:
+        con = get_db_connection(read_only=True)
+        instrument_id = _get_instrument_id(con, symbol, exchange); first_date = start_date
+        if instrument_id is not None and lookback_bars > 0:
+            warmup_start = _lookback_start(con, table_info, instrument_id, start_date, lookback_bars)
+            if warmup_start is not None: print(f"Including {lookback_bars} warm-up bars: reading from {warmup_start}"); start_date = warmup_start
+        if overlay is not None: data = _read_ohlcv_overlaid(con, interval, instrument_id, start_date, end_date, overlay, output, first_date, lookback_bars)
+        else:
+            source_sql = _ohlcv_source_sql(con, table_info, start_date, end_date, [instrument_id]) if instrument_id is not None else None
+            if source_sql is None: print(f"No {interval} OHLCV data (unknown stock or no partitions for range)."); return None
+            # Time column is cast to TIMESTAMP and named 'time' in SQL, so no pandas-side conversion/rename is needed
+            select_sql, tail_sql = _ohlcv_select_sql(table_info)
+            sql = f""" SELECT {select_sql} FROM {source_sql} WHERE instrument_id = ? AND {_time_range_sql(time_col)} {tail_sql} """
+            data = _fetch_ohlcv_result(con.execute(sql, [instrument_id, start_date, end_date]), output)
+        if data is None: print(f"No {interval} OHLCV data found."); return None
+        if output == 'pandas': data.set_index('time', inplace=True) # Ensure DatetimeIndex named 'time'
+        print(f"Retrieved {len(data) if output != 'numpy' else len(data['time'])} {interval} records for {symbol}/{exchange}."); return data
     except Exception as e: print(f"Error getting {interval} OHLCV data via SQL: {e}"); return None
 
+def _read_ohlcv_overlaid(con, interval: str, instrument_id: Optional[int], start_date: Any, end_date: Any, overlay: pd.DataFrame,
+                         output: str, first_date: Any, lookback_bars: int):
+    """
+    get_ohlcv_data over the stored bars of the storage interval merged with 'overlay' (overlay wins on equal times),
+    aggregated to 'interval' the way rebuild_derived_bars (W/M) and the bucketed read (15M/1H) do. start_date already
+    includes the stored warm-up; overlaid bars before first_date count towards the lookback_bars as well.
+    """
+    table_info = _get_ohlcv_table_name(interval); base_info = _get_ohlcv_table_name(get_storage_interval(interval))
+    time_col = base_info['time_col']; time_type = 'DATE' if time_col == 'date' else 'TIMESTAMP'
+    price_type = base_info.get('price_type', 'DOUBLE'); volume_type = base_info.get('volume_type', 'BIGINT')
+    bars, columns, _ = _as_ingest_source(overlay)
+    lower_map = {col.lower(): col for col in columns}
+    time_src = next(lower_map[c] for c in _TIME_COL_CANDIDATES if c in lower_map)
+    # Cast like the staged rows of add_ohlcv_bulk (and the last of equal times wins), so overlaid bars read back exactly
+    # as they will once stored. arg_max, not QUALIFY: DuckDB 1.x fails to push the range filter through UNION ALL into a window
+    overlay_sql = (f'SELECT CAST("{time_src}" AS {time_type}) AS {time_col}, '
+                   + ", ".join(f'arg_max(TRY_CAST("{lower_map[col]}" AS {volume_type if col == "volume" else price_type}), ordinal) AS {col}' for col in OHLCV_VALUE_COLS)
+                   + f' FROM ohlcv_read_overlay WHERE "{time_src}" IS NOT NULL GROUP BY ALL')
+    stored_sql = _ohlcv_source_sql(con, base_info, start_date, end_date, [instrument_id]) if instrument_id is not None else None
+    overlay_start = pd.to_datetime(bars[time_src]).min() if lookback_bars > 0 else pd.NaT
+    if not pd.isna(overlay_start) and overlay_start < pd.Timestamp(start_date): # Overlaid warm-up bars (a W/M rollup keeps its partial first period)
+        start_date = overlay_start.to_period({'week': 'W', 'month': 'M'}[table_info['period']]).start_time.date() if 'period' in table_info else overlay_start.date()
+    merged_sql = overlay_sql if stored_sql is None else f""" SELECT {time_col}, {", ".join(OHLCV_VALUE_COLS)} FROM {stored_sql}
+        WHERE instrument_id = {int(instrument_id)} AND {time_col} NOT IN (SELECT {time_col} FROM ({overlay_sql})) UNION ALL {overlay_sql} """
+    if 'period' in table_info: # W/M: whole periods starting inside the range, like the stored rollups
+        price = lambda col: _price_sql(table_info, col); period = table_info['period']
+        sql = f""" SELECT * FROM (SELECT CAST(date_trunc('{period}', date) AS TIMESTAMP) AS time, {price('arg_min(open, date)')} AS open,
+                   {price('max(high)')} AS high, {price('min(low)')} AS low, {price('arg_max(close, date)')} AS close, CAST(sum(volume) AS BIGINT) AS volume
+                   FROM ({merged_sql}) WHERE date BETWEEN ? AND ? GROUP BY ALL) WHERE CAST(time AS DATE) BETWEEN ? AND ? ORDER BY time """
+        params = [start_date, end_date, start_date, end_date]
+    else:
+        select_sql, tail_sql = _ohlcv_select_sql(table_info)
+        sql = f""" SELECT {select_sql} FROM ({merged_sql}) WHERE {_time_range_sql(time_col)} {tail_sql} """; params = [start_date, end_date]
+    if lookback_bars > 0: # Warm-up from the day _lookback_start would find over the merged bars
+        if 'bucket' in table_info:
+            counted_sql = f"SELECT {time_col} AS time FROM ({merged_sql})"; counted_params = []
+            lookback_bars = (lookback_bars + 1) * int(pd.Timedelta(table_info['bucket']) / pd.Timedelta(minutes=5))
+        else: counted_sql = sql; counted_params = list(params)
+        sql = f""" SELECT * FROM ({sql}) WHERE time >= COALESCE((SELECT CAST(min(time) AS DATE) FROM (SELECT time FROM ({counted_sql})
+                   WHERE time < CAST(? AS DATE) ORDER BY time DESC LIMIT {int(lookback_bars)})), CAST(? AS DATE)) ORDER BY time """
+        params += counted_params + [first_date, first_date]
+    con.register('ohlcv_read_overlay', bars.assign(ordinal=np.arange(len(bars))))
+    try: return _fetch_ohlcv_result(con.execute(sql, params), output)
+    finally: con.unregister('ohlcv_read_overlay')
+
+# get_ohlcv_data_many function
+def get_ohlcv_data_many(symbols: List[str], exchange: str, start_date: str, end_date: str, interval: str = '1D',
+                        pivot: bool = False, output: str = 'pandas') -> Optional[Union[pd.DataFrame, Dict[str, Any], Any]]:
+    """
+    Retrieves OHLCV data for many symbols with ONE query (a single scan of the interval table).
+    Returns a long-format DataFrame (symbol, time, open, high, low, close, volume) sorted by symbol/time,
+    or with pivot=True a dict of wide panels {'close': ..., 'volume': ...} (index 'time', one column per symbol).
+    output='arrow' / 'numpy' return the long result without building a DataFrame (pivot is pandas-only).
+    """
+    initialize_database()
+    if not symbols: return None
+    if output not in READ_OUTPUT_FORMATS or (pivot and output != 'pandas'): print(f"Error getting OHLCV (many): Unsupported output '{output}' (pivot={pivot})"); return None
+    try: table_info = _get_ohlcv_table_name(interval); table_name = table_info['table']; time_col = table_info['time_col']
+    except ValueError as e: print(f"Error getting OHLCV (many): {e}"); return None
+    symbol_list = sorted({s.upper() for s in symbols})
+    print(f"Querying {interval} OHLCV from {table_name} for {len(symbol_list)} symbols ({exchange}) [{start_date} to {end_date}]")
+    try:
+        con = get_db_connection(read_only=True)
+        instrument_ids = [row[0] for row in con.execute("SELECT instrument_id FROM stocks WHERE exchange = ? AND symbol IN (SELECT unnest(?::VARCHAR[]))",
+                                                        [exchange.upper(), symbol_list]).fetchall()]
+        source_sql = _ohlcv_source_sql(con, table_info, start_date, end_date, instrument_ids) if instrument_ids else None
+        if source_sql is None: print(f"No {interval} OHLCV data (unknown stocks or no partitions for range)."); return None
+        select_sql, tail_sql = _ohlcv_select_sql(table_info)
+        if 'bucket' not in table_info: tail_sql = f"ORDER BY symbol, {time_col}"
+        sql = f""" SELECT s.symbol, {select_sql} FROM {source_sql} o JOIN stocks s USING (instrument_id)
+                   WHERE s.exchange = ? AND s.symbol IN (SELECT unnest(?::VARCHAR[])) AND {_time_range_sql(time_col)} {tail_sql} """
+        df = _fetch_ohlcv_result(con.execute(sql, [exchange.upper(), symbol_list, start_date, end_date]), output)
+        if df is None: print(f"No {interval} OHLCV data found for requested symbols."); return None
+        if output != 'pandas': print(f"Retrieved {interval} records ({output}) for {len(symbol_list)} requested symbols ({exchange})."); return df
+        print(f"Retrieved {len(df)} {interval} records for {df['symbol'].nunique()}/{len(symbol_list)} symbols ({exchange}).")
+        if not pivot: return df
+        return {field: df.pivot(index='time', columns='symbol', values=field) for field in PANEL_FIELDS}
+    except Exception as e: print(f"Error getting {interval} OHLCV data (many) via SQL: {e}"); return None
+
 # get_ohlcv_date_range function
 def get_ohlcv_date_range(symbol: str, exchange: str, interval: str = '1D') -> Optional[Dict[str, Any]]:
     initialize_database();
     try: table_info = _get_ohlcv_table_name(interval); table_name = table_info['table']; time_col = table_info['time_col']
     except ValueError as e: print(f"Error getting OHLCV range: {e}"); return None
-    print(f"Querying {interval} time range from {table_name} for: {symbol} ({exchange})"); sql = f"SELECT MIN({time_col}) AS min_time, MAX({time_col}) AS max_time FROM {table_name} WHERE symbol = ? AND exchange = ?"
+    print(f"Querying {interval} time range from {table_name} for: {symbol} ({exchange})")
     try:
-        con = get_db_connection(); result = con.execute(sql, [symbol.upper(), exchange.upper()]).fetchone()
+        con = get_db_connection(read_only=True)
+        instrument_id = _get_instrument_id(con, symbol, exchange)
+        source_sql = _ohlcv_source_sql(con, table_info, instrument_ids=[instrument_id]) if instrument_id is not None else None
+        if source_sql is None: print(f"No {interval} OHLCV data found for range."); return None
+        sql = f"SELECT MIN({time_col}) AS min_time, MAX({time_col}) AS max_time FROM {source_sql} WHERE instrument_id = ?"
+        result = con.execute(sql, [instrument_id]).fetchone()
         if result and result[0] is not None and result[1] is not None:
              min_t = result[0]; max_t = result[1]; print(f"Found {interval} time range: {min_t} to {max_t}"); return {"min_time": min_t, "max_time": max_t}
         else: print(f"No {interval} OHLCV data found for range."); return None
-    except Exception as e: print(f"Error getting {interval} OHLCV range: {e}"); return None
\ No newline at end of file
+    except Exception as e: print(f"Error getting {interval} OHLCV range: {e}"); return None
+
+# --- Cold Tier (Parquet Archive) ---
+# Archived bars live in <COLD_STORAGE_DIR>/interval=1D/exchange=NSE/symbol=TCS/year=2018/data.parquet (one file per
+# instrument-year, also carrying instrument_id); ohlcv_cold_archive catalogs them so reads never glob the directory tree.
+COLD_TABLE_INTERVALS = {'ohlcv_daily': '1D', 'ohlcv_weekly': '1W', 'ohlcv_monthly': '1M', 'ohlcv_5min': '5M'}
+
+def _cold_files(con, table_info: Dict[str, Any], instrument_ids: Optional[List[int]], start_date: Any = None, end_date: Any = None) -> List[str]:
+    """Absolute paths of archived Parquet files for the instruments (all if None) overlapping the year range."""
+    sql = "SELECT path FROM ohlcv_cold_archive WHERE bar_interval = ?"; params: List[Any] = [COLD_TABLE_INTERVALS[table_info['table']]]
+    if instrument_ids is not None: sql += " AND instrument_id IN (SELECT unnest(?::INTEGER[]))"; params.append(instrument_ids)
+    if start_date is not None: sql += " AND year >= ?"; params.append(pd.to_datetime(start_date).year)
+    if end_date is not None: sql += " AND year <= ?"; params.append(pd.to_datetime(end_date).year)
+    return [os.path.join(Config.COLD_STORAGE_DIR, path) for (path,) in con.execute(sql + " ORDER BY path", params).fetchall()]
+
+def _hot_archive_candidates(con, before_year: int) -> List[Tuple[Dict[str, Any], str]]:
+    """(table_info, hot table) pairs that can hold bars older than before_year."""
+    candidates = [(_get_ohlcv_table_name(interval), table) for table, interval in COLD_TABLE_INTERVALS.items() if table != 'ohlcv_5min']
+    intraday_info = _get_ohlcv_table_name('5M')
+    candidates += [(intraday_info, _partition_table('ohlcv_5min', y)) for y in _list_partition_years(con, 'ohlcv_5min') if y < before_year]
+    return candidates
+
+@writer_operation(None)
+def archive_cold_years(before_year: int) -> Optional[Dict[str, int]]:
+    """
+    Moves all bars dated before Jan 1 of before_year from DuckDB into the Parquet cold tier. Years archived earlier are
+    rewritten merged with any newer hot rows (hot wins). Files are put in place before the hot rows are deleted, so
+    an interrupted run never loses bars. Returns {'files', 'rows'} or None on error.
+    """
+    initialize_database()
+    print(f"Archiving OHLCV bars before {before_year} to cold storage at {Config.COLD_STORAGE_DIR}...")
+    staging_dir = os.path.join(Config.COLD_STORAGE_DIR, '_staging')
+    totals = {'files': 0, 'rows': 0}; con = None
+    try:
+        os.makedirs(Config.COLD_STORAGE_DIR, exist_ok=True); con = get_db_connection()
+        id_paths = {iid: (sym, exch) for iid, sym, exch in con.execute("SELECT instrument_id, symbol, exchange FROM stocks").fetchall()}
+        cutoff = date(before_year, 1, 1)
+        for table_info, hot_table in _hot_archive_candidates(con, before_year):
+            time_col = table_info['time_col']; interval = COLD_TABLE_INTERVALS[table_info['table']]
+            targets = con.execute(f"SELECT DISTINCT instrument_id, year({time_col}) FROM {hot_table} WHERE {time_col} < ?", [cutoff]).fetchall()
+            if not targets: continue
+            instrument_ids = sorted({iid for iid, _ in targets}); years = sorted({y for _, y in targets})
+            # Hybrid rows (hot + previously archived) of exactly the instrument-years being moved
+            source_sql = _ohlcv_source_sql(con, table_info, date(years[0], 1, 1), date(years[-1], 12, 31), instrument_ids)
+            con.execute("CREATE OR REPLACE TEMP TABLE cold_targets (instrument_id INTEGER, year INTEGER)")
+            con.executemany("INSERT INTO cold_targets VALUES (?, ?)", targets)
+            rows_sql = f""" SELECT o.instrument_id AS part_instrument, year(o.{time_col}) AS part_year, o.*
+                FROM {source_sql} o SEMI JOIN cold_targets t ON t.instrument_id = o.instrument_id AND t.year = year(o.{time_col}) """
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            con.execute(f""" COPY ({rows_sql} ORDER BY o.instrument_id, o.{time_col}) TO '{staging_dir}'
+                (FORMAT parquet, COMPRESSION zstd, PARTITION_BY (part_instrument, part_year), FILENAME_PATTERN 'data_{{i}}') """)
+            stats = con.execute(f""" SELECT part_instrument, part_year, COUNT(*), MIN(CAST({time_col} AS TIMESTAMP)), MAX(CAST({time_col} AS TIMESTAMP))
+                FROM ({rows_sql}) GROUP BY ALL """).fetchall()
+            catalog_rows = []
+            for instrument_id, year, row_count, min_time, max_time in stats:
+                symbol, exchange = id_paths[instrument_id]
+                rel_path = os.path.join(f"interval={interval}", f"exchange={exchange}", f"symbol={symbol}", f"year={year}", "data.parquet")
+                final_path = os.path.join(Config.COLD_STORAGE_DIR, rel_path)
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(os.path.join(staging_dir, f"part_instrument={instrument_id}", f"part_year={year}", "data_0.parquet"), final_path)
+                catalog_rows.append([interval, instrument_id, year, rel_path, row_count, min_time, max_time])
+            con.begin()
+            con.executemany(""" INSERT OR REPLACE INTO ohlcv_cold_archive (bar_interval, instrument_id, year, path, row_count, min_time, max_time)
+                                VALUES (?, ?, ?, ?, ?, ?, ?) """, catalog_rows)
+            if table_info.get('partitioned'): con.execute(f"DROP TABLE {hot_table}") # Whole yearly partition is older than the cutoff
+            else: con.execute(f"DELETE FROM {hot_table} WHERE {time_col} < ?", [cutoff])
+            con.commit()
+            totals['files'] += len(catalog_rows); totals['rows'] += sum(row[4] for row in catalog_rows)
+            print(f"Archived {hot_table}: {len(catalog_rows)} instrument-years, {sum(row[4] for row in catalog_rows)} bars.")
+        con.execute("DROP TABLE IF EXISTS cold_targets")
+        try: checkpoint() # Freed blocks are reused by new hot data
+        except duckdb.Error as e: print(f"Cold archive: checkpoint deferred ({e})") # DuckDB checkpoints on its own later
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        print(f"Cold archive done: {totals}"); return totals
+    except Exception as e:
+        print(f"Error archiving OHLCV bars to cold storage: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return None
+
+# --- Upstream Coverage Index ---
+def _seed_coverage_from_daily(con):
+    """One-time seed for databases created before the coverage table: stored daily span counts as checked."""
+    if con.execute("SELECT COUNT(*) FROM ohlcv_coverage").fetchone()[0] > 0: return
+    seeded = con.execute(""" INSERT INTO ohlcv_coverage (symbol, exchange, bar_interval, start_date, end_date)
+        SELECT s.symbol, s.exchange, '1D', MIN(o.date), MAX(o.date) FROM ohlcv_daily o JOIN stocks s USING (instrument_id)
+        GROUP BY s.symbol, s.exchange """).fetchone()
+    if seeded and seeded[0]: print(f"Seeded upstream coverage for {seeded[0]} stocks from existing daily data.")
+
+@writer_operation(False)
+def record_coverage(symbol: str, exchange: str, interval: str, start_date: Any, end_date: Any) -> bool:
+    """Marks [start_date, end_date] as checked against upstream, merging with overlapping/adjacent ranges."""
+    initialize_database()
+    start_d = pd.to_datetime(start_date).date(); end_d = pd.to_datetime(end_date).date()
+    if end_d < start_d: return True
+    symbol = symbol.upper(); exchange = exchange.upper(); interval = interval.upper()
+    select_sql = """ SELECT start_date, end_date FROM ohlcv_coverage WHERE symbol = ? AND exchange = ? AND bar_interval = ?
+                     AND start_date <= ? AND end_date >= ? """
+    con = None
+    try:
+        con = get_db_connection(); con.begin()
+        # Adjacent ranges (touching by one day) are merged too, so the table stays one row per contiguous span
+        touching = con.execute(select_sql, [symbol, exchange, interval, end_d + timedelta(days=1), start_d - timedelta(days=1)]).fetchall()
+        for row_start, row_end in touching:
+            start_d = min(start_d, row_start); end_d = max(end_d, row_end)
+        con.execute("DELETE FROM ohlcv_coverage WHERE symbol = ? AND exchange = ? AND bar_interval = ? AND start_date BETWEEN ? AND ?",
+                    [symbol, exchange, interval, start_d, end_d])
+        con.execute("INSERT INTO ohlcv_coverage (symbol, exchange, bar_interval, start_date, end_date) VALUES (?, ?, ?, ?, ?)",
+                    [symbol, exchange, interval, start_d, end_d])
+        con.commit()
+        print(f"Coverage recorded for {symbol}/{exchange}/{interval}: [{start_d} - {end_d}]"); return True
+    except Exception as e:
+        print(f"Error recording coverage for {symbol}/{exchange}/{interval}: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return False
+
+def get_coverage_gaps(symbol: str, exchange: str, interval: str, start_date: Any, end_date: Any) -> List[Tuple[date, date]]:
+    """Returns the sub-ranges of [start_date, end_date] that were never checked against upstream (in date order)."""
+    initialize_database()
+    start_d = pd.to_datetime(start_date).date(); end_d = pd.to_datetime(end_date).date()
+    if end_d < start_d: return []
+    sql = """ SELECT start_date, end_date FROM ohlcv_coverage WHERE symbol = ? AND exchange = ? AND bar_interval = ?
+              AND start_date <= ? AND end_date >= ? ORDER BY start_date """
+    try:
+        con = get_db_connection(read_only=True)
+        covered = con.execute(sql, [symbol.upper(), exchange.upper(), interval.upper(), end_d, start_d]).fetchall()
+    except Exception as e: print(f"Error reading coverage for {symbol}/{exchange}/{interval}: {e}"); return [(start_d, end_d)]
+    gaps = []; cursor_d = start_d
+    for row_start, row_end in covered:
+        if row_start > cursor_d: gaps.append((cursor_d, min(row_start - timedelta(days=1), end_d)))
+        cursor_d = max(cursor_d, row_end + timedelta(days=1))
+        if cursor_d > end_d: break
+    if cursor_d <= end_d: gaps.append((cursor_d, end_d))
+    return gaps
+
+# --- Backfill Progress ---
+@writer_operation(None)
+def create_backfill_job(job_id: str, exchange: str, interval: str, start_date: Any, end_date: Any, symbols: List[str]) -> Optional[int]:
+    """Registers a job and its symbols (idempotent - re-running a job only adds new symbols); returns the pending count."""
+    initialize_database()
+    con = None
+    try:
+        con = get_db_connection(); con.begin()
+        con.execute("INSERT INTO backfill_jobs (job_id, exchange, bar_interval, start_date, end_date) VALUES (?, ?, ?, ?, ?) ON CONFLICT (job_id) DO UPDATE SET finished_at = NULL",
+                    [job_id, exchange.upper(), interval.upper(), pd.to_datetime(start_date).date(), pd.to_datetime(end_date).date()])
+        con.register('backfill_symbols_view', pd.DataFrame({'symbol': [s.upper() for s in symbols]}))
+        con.execute("INSERT INTO backfill_items (job_id, symbol) SELECT DISTINCT ?, symbol FROM backfill_symbols_view ON CONFLICT DO NOTHING", [job_id])
+        con.unregister('backfill_symbols_view')
+        pending = con.execute("SELECT COUNT(*) FROM backfill_items WHERE job_id = ? AND status != 'done'", [job_id]).fetchone()[0]
+        con.commit(); return pending
+    except Exception as e:
+        print(f"Error creating backfill job {job_id}: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return None
+
+@writer_operation(False)
+def mark_backfill_item(job_id: str, symbol: str, status: str, rows_stored: Optional[int] = None, error: Optional[str] = None) -> bool:
+    try:
+        get_db_connection().execute(""" UPDATE backfill_items SET status = ?, rows_stored = ?, error = ?, attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                                        WHERE job_id = ? AND symbol = ? """, [status, rows_stored, error, job_id, symbol.upper()])
+        return True
+    except Exception as e: print(f"Error updating backfill item {job_id}/{symbol}: {e}"); return False
+
+@writer_operation(False)
+def finish_backfill_job(job_id: str) -> bool:
+    try: get_db_connection().execute("UPDATE backfill_jobs SET finished_at = CURRENT_TIMESTAMP WHERE job_id = ?", [job_id]); return True
+    except Exception as e: print(f"Error finishing backfill job {job_id}: {e}"); return False
+
+def get_backfill_pending(job_id: str) -> List[str]:
+    """Symbols of a job not yet done (pending or failed), in symbol order."""
+    initialize_database()
+    try:
+        rows = get_db_connection(read_only=True).execute("SELECT symbol FROM backfill_items WHERE job_id = ? AND status != 'done' ORDER BY symbol", [job_id]).fetchall()
+        return [row[0] for row in rows]
+    except Exception as e: print(f"Error reading backfill job {job_id}: {e}"); return []
+
+def get_backfill_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Stored job definition with per-status symbol counts and rows stored; None if unknown."""
+    initialize_database()
+    try:
+        con = get_db_connection(read_only=True)
+        job = con.execute("SELECT job_id, exchange, bar_interval, start_date, end_date, created_at, finished_at FROM backfill_jobs WHERE job_id = ?", [job_id]).fetchone()
+        if job is None: return None
+        counts = dict(con.execute("SELECT status, COUNT(*) FROM backfill_items WHERE job_id = ? GROUP BY status", [job_id]).fetchall())
+        rows_stored = con.execute("SELECT COALESCE(SUM(rows_stored), 0) FROM backfill_items WHERE job_id = ?", [job_id]).fetchone()[0]
+    except Exception as e: print(f"Error reading backfill job {job_id}: {e}"); return None
+    keys = ['job_id', 'exchange', 'interval', 'start_date', 'end_date', 'created_at', 'finished_at']
+    return {**dict(zip(keys, job)), 'total': sum(counts.values()), 'done': counts.get('done', 0), 'failed': counts.get('failed', 0),
+            'pending': counts.get('pending', 0), 'rows_stored': int(rows_stored)}
+
+# --- End-of-Day Updates ---
+def get_last_daily_bars(exchange: Optional[str] = None) -> List[Tuple[str, str, date]]:
+    """
+    (symbol, exchange, date of the newest stored daily bar) for every stock with daily bars, by exchange and symbol.
+    Only the hot table is scanned: a stock whose newest bar is already archived has not been updated for years.
+    """
+    initialize_database()
+    sql = """ SELECT s.symbol, s.exchange, MAX(o.date) FROM ohlcv_daily o JOIN stocks s USING (instrument_id)
+              {where} GROUP BY s.symbol, s.exchange ORDER BY s.exchange, s.symbol """
+    try:
+        con = get_db_connection(read_only=True)
+        if exchange: return con.execute(sql.format(where="WHERE s.exchange = ?"), [exchange.upper()]).fetchall()
+        return con.execute(sql.format(where="")).fetchall()
+    except Exception as e: print(f"Error reading last daily bars: {e}"); return []
+
+@writer_operation(False)
+def record_eod_run(run_date: Any, started_at: datetime, finished_at: datetime, symbols: int, rows_stored: int, failed: int) -> bool:
+    try:
+        get_db_connection().execute(""" INSERT INTO eod_update_runs (run_date, started_at, finished_at, symbols, rows_stored, failed)
+            VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (run_date) DO UPDATE SET started_at = excluded.started_at,
+            finished_at = excluded.finished_at, symbols = excluded.symbols, rows_stored = excluded.rows_stored, failed = excluded.failed """,
+            [pd.to_datetime(run_date).date(), started_at, finished_at, symbols, rows_stored, failed])
+        return True
+    except Exception as e: print(f"Error recording EOD run for {run_date}: {e}"); return False
+
+def get_last_eod_run() -> Optional[Dict[str, Any]]:
+    """The most recent finished end-of-day update, or None if it never ran."""
+    initialize_database()
+    try:
+        row = get_db_connection(read_only=True).execute(""" SELECT run_date, started_at, finished_at, symbols, rows_stored, failed
+                                                            FROM eod_update_runs ORDER BY run_date DESC LIMIT 1 """).fetchone()
+    except Exception as e: print(f"Error reading EOD runs: {e}"); return None
+    return dict(zip(['run_date', 'started_at', 'finished_at', 'symbols', 'rows_stored', 'failed'], row)) if row else None
+
+# --- Indicator State ---
+def get_close_history(instrument_ids: List[int], interval: str = '1D', since: Optional[Dict[int, Any]] = None) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    Stored closes per instrument as (times, closes) NumPy arrays, oldest first, read with ONE query: the whole history,
+    or with `since` each instrument's bars from since[instrument_id] on (inclusive). Prices are widened like chart reads.
+    """
+    initialize_database()
+    if not instrument_ids: return {}
+    try: table_info = _get_ohlcv_table_name(interval); time_col = table_info['time_col']
+    except ValueError as e: print(f"Error getting close history: {e}"); return {}
+    if 'bucket' in table_info: print(f"Error getting close history: {interval} is bucketed on read, not stored."); return {}
+    ids = sorted(set(instrument_ids))
+    since_times = [pd.Timestamp(since[i]).to_pydatetime() for i in ids] if since else [None] * len(ids)
+    try:
+        con = get_db_connection(read_only=True)
+        source_sql = _ohlcv_source_sql(con, table_info, min(since_times) if since else None, None, ids)
+        if source_sql is None: return {}
+        sql = f""" SELECT o.instrument_id, CAST(o.{time_col} AS TIMESTAMP) AS time, {_price_sql(table_info, 'o.close')} AS close
+                   FROM {source_sql} o JOIN (SELECT unnest(?::INTEGER[]) AS instrument_id, unnest(?::TIMESTAMP[]) AS since) s USING (instrument_id)
+                   WHERE s.since IS NULL OR o.{time_col} >= s.since ORDER BY o.instrument_id, o.{time_col} """
+        arrays = con.execute(sql, [ids, since_times]).fetchnumpy()
+    except Exception as e: print(f"Error getting {interval} close history for {len(ids)} instruments: {e}"); return {}
+    instruments = np.asarray(arrays['instrument_id']); times = np.asarray(arrays['time'])
+    closes = np.asarray(np.ma.filled(arrays['close'].astype(np.float64), np.nan)) # NULL closes (masked) -> NaN
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(instruments)) + 1, [len(instruments)]))
+    return {int(instruments[lo]): (times[lo:hi], closes[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo}
+
+def get_indicator_states(instrument_ids: List[int], interval: str = '1D') -> Dict[int, Dict[str, Dict[str, Any]]]:
+    """{instrument_id: {indicator: {'time', 'close', 'state', 'prev', 'values'}}} for the instruments that have states."""
+    initialize_database()
+    if not instrument_ids: return {}
+    try:
+        rows = get_db_connection(read_only=True).execute(""" SELECT instrument_id, indicator, last_time, last_close, state, latest FROM indicator_state
+            WHERE bar_interval = ? AND instrument_id IN (SELECT unnest(?::INTEGER[])) """, [_canonical_interval(interval), sorted(set(instrument_ids))]).fetchall()
+    except Exception as e: print(f"Error reading indicator states: {e}"); return {}
+    states: Dict[int, Dict[str, Dict[str, Any]]] = {}
+    for instrument_id, indicator, last_time, last_close, state, latest in rows:
+        snapshot = json.loads(state)
+        states.setdefault(instrument_id, {})[indicator] = {'time': pd.Timestamp(last_time), 'close': last_close, 'state': snapshot['state'],
+                                                            'prev': snapshot['prev'], 'values': json.loads(latest) if latest else {}}
+    return states
+
+@writer_operation(False)
+def save_indicator_states(interval: str, records: List[Tuple[int, str, Any, float, Dict[str, Any], Dict[str, Any], Dict[str, float]]]) -> bool:
+    """Upserts (instrument_id, indicator, last_time, last_close, state, prev, values) records in one transaction."""
+    initialize_database()
+    if not records: return True
+    frame = pd.DataFrame({'instrument_id': [r[0] for r in records], 'indicator': [r[1] for r in records],
+                          'last_time': [pd.Timestamp(r[2]) for r in records], 'last_close': [r[3] for r in records],
+                          'state': [json.dumps({'state': r[4], 'prev': r[5]}) for r in records],
+                          'latest': [json.dumps({k: float(v) for k, v in r[6].items()}) for r in records]})
+    con = None
+    try:
+        con = get_db_connection(); con.begin()
+        con.register('indicator_state_batch', frame)
+        try:
+            con.execute(""" INSERT INTO indicator_state (instrument_id, bar_interval, indicator, last_time, last_close, state, latest, updated_at)
+                SELECT instrument_id, ?, indicator, last_time, last_close, state, latest, now() FROM indicator_state_batch
+                ON CONFLICT (instrument_id, bar_interval, indicator) DO UPDATE SET last_time = excluded.last_time, last_close = excluded.last_close,
+                state = excluded.state, latest = excluded.latest, updated_at = excluded.updated_at """, [_canonical_interval(interval)])
+        finally: con.unregister('indicator_state_batch')
+        con.commit(); return True
+    except Exception as e:
+        print(f"Error saving {len(records)} {interval} indicator states: {e}")
+        if con is not None:
+            try: con.rollback()
+            except Exception: pass
+        return False
+
+def get_latest_indicator_values(exchange: str, indicator: str, interval: str = '1D') -> List[Dict[str, Any]]:
+    """Latest values of one tracked indicator for every stock of an exchange, from the state table (no bars are read)."""
+    initialize_database()
+    try:
+        rows = get_db_connection(read_only=True).execute(""" SELECT s.symbol, i.last_time, i.last_close, i.latest FROM indicator_state i
+            JOIN stocks s USING (instrument_id) WHERE s.exchange = ? AND i.bar_interval = ? AND i.indicator = ? ORDER BY s.symbol """,
+            [exchange.upper(), _canonical_interval(interval), indicator.upper()]).fetchall()
+    except Exception as e: print(f"Error reading latest {indicator} values: {e}"); return []
+    return [{'symbol': symbol, 'time': last_time, 'close': last_close,
+             'values': {k: (None if v != v else v) for k, v in json.loads(latest or '{}').items()}} # NaN (warming up) -> null
+            for symbol, last_time, last_close, latest in rows]
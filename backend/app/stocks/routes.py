@@ -5,17 +5,21 @@
 from flask import Blueprint, jsonify, request, abort
 from datetime import date, datetime, timezone ,timedelta# Import datetime & timezone
 import pandas as pd
+import numpy as np
 from typing import Dict, List, Any
 
 # Import manager and repository functions needed
 from .manager import stock_manager
-from .repository import get_ohlcv_date_range
+from .repository import get_ohlcv_date_range, screen_materialized_indicators
 from app.indicators import get_available_indicator_info # Use dynamic list getter
 from .fetcher import get_cached_instrument_list
+from .backfill import start_backfill, get_backfill_progress
+from .eod import eod_scheduler, start_eod_update
+from .indicator_state import get_latest_values
 
 print("Stock routes module loaded (Final v5 - Epoch Time Output)")
 
-SUPPORTED_INTERVALS = ['1D', '1W', '1M'] # Removed '1H'
+SUPPORTED_INTERVALS = ['1D', '1W', '1M', '1H', '15M', '5M'] # 15M/1H are bucketed from stored 5M bars
 
 stocks_bp = Blueprint('stocks', __name__)
 
@@ -35,8 +39,9 @@ def prepare_data_for_json(data_list_of_dicts: List[Dict], interval: str) -> List
     for record in data_list_of_dicts:
         processed_record = {}; processed_time_val = None
         original_time_val = record.get(time_key_in_dict)
-        # Convert pandas Timestamp, datetime, or date object to epoch seconds
-        if original_time_val is not None:
+        # Convert pandas Timestamp, datetime, or date object to epoch seconds (ints are already epoch seconds)
+        if isinstance(original_time_val, (int, np.integer)): processed_time_val = int(original_time_val)
+        elif original_time_val is not None:
             try:
                 dt = pd.to_datetime(original_time_val) # Convert input to datetime
                 if not pd.isna(dt):
@@ -86,6 +91,8 @@ def get_stock_data_route(exchange: str, symbol: str):
     if ohlcv_data is None or ohlcv_data.empty: abort(404, description=f"No {interval} data for {symbol}/{exchange} in range [{start_date_str} - {end_date_str}].")
 
     ohlcv_data_reset = ohlcv_data.reset_index() # Index ('time') becomes column
+    # Vectorized epoch-second conversion (naive times treated as UTC, same as prepare_data_for_json)
+    ohlcv_data_reset['time'] = ohlcv_data_reset['time'].values.astype('datetime64[s]').astype('int64')
     data_list_of_dicts = ohlcv_data_reset.to_dict(orient='records')
     # REMOVED line: ohlcv_data_processed = ohlcv_data_reset.where(pd.notnull(ohlcv_data_reset), None)
     prepared_data = prepare_data_for_json(data_list_of_dicts, interval) # Use helper directly
@@ -136,6 +143,31 @@ def get_available_indicators():
         available = [] # Fallback to empty list on error
     return jsonify(available), 200
 
+# ============================================================
+# Route to Get the Latest Values of a Tracked Indicator (All Stocks of an Exchange)
+# ============================================================
+@stocks_bp.route('/indicators/latest', methods=['GET'])
+def get_latest_indicator_values():
+    """Latest values of a tracked indicator (Config.INDICATOR_STATE_SPECS) per stock, from the incremental state - no bars are read."""
+    exchange = request.args.get('exchange', 'NSE').upper(); interval = request.args.get('interval', '1D').upper()
+    indicator = request.args.get('indicator', 'RSI_14').upper()
+    values = get_latest_values(exchange, indicator, interval)
+    if values is None: abort(400, description=f"Indicator '{indicator}' is not tracked. Set INDICATOR_STATE_SPECS to include it.")
+    for row in values: row['time'] = int(pd.Timestamp(row['time']).tz_localize('UTC').timestamp()) # Epoch seconds, like /data
+    return jsonify({'exchange': exchange, 'interval': interval, 'indicator': indicator, 'count': len(values), 'values': values}), 200
+
+@stocks_bp.route('/indicators/screen', methods=['GET'])
+def screen_indicators():
+    """Newest daily row of the materialized indicators (Config.MATERIALIZED_INDICATORS) per stock, optionally min <= indicator <= max."""
+    exchange = request.args.get('exchange', 'NSE').upper(); indicator = request.args.get('indicator')
+    try: min_value, max_value = (float(request.args[key]) if request.args.get(key) else None for key in ('min', 'max'))
+    except ValueError: abort(400, description="min/max must be numbers.")
+    if indicator is None and (min_value is not None or max_value is not None): abort(400, description="min/max need an indicator.")
+    rows = screen_materialized_indicators(exchange, indicator, min_value, max_value)
+    if rows is None: abort(400, description=f"Indicator '{indicator}' is not materialized. Set MATERIALIZED_INDICATORS to include it.")
+    for row in rows: row['time'] = int(pd.Timestamp(row['time']).tz_localize('UTC').timestamp()) # Epoch seconds, like /data
+    return jsonify({'exchange': exchange, 'indicator': indicator.upper() if indicator else None, 'count': len(rows), 'values': rows}), 200
+
 # ============================================================
 # Route to Get Stock List for Search/Combobox
 # ============================================================
@@ -146,4 +178,47 @@ def get_stock_list():
     print(f"API: Request received for stock list for exchange: {exchange}")
     stock_list = get_cached_instrument_list(exchange) # Function from fetcher.py
     if not stock_list: print(f"API: No stocks found for {exchange}."); return jsonify([])
-    return jsonify(stock_list)
\ No newline at end of file
+    return jsonify(stock_list)
+
+# ============================================================
+# Routes to Start / Monitor a Universe Backfill
+# ============================================================
+@stocks_bp.route('/backfill', methods=['POST'])
+def start_backfill_route():
+    """Starts (or resumes) a background backfill. JSON body: exchange, symbols[], interval, start_date, end_date, workers, limit, job_id."""
+    params = request.get_json(silent=True) or {}
+    interval = str(params.get('interval', '1D')).upper()
+    if interval not in SUPPORTED_INTERVALS: abort(400, description=f"Unsupported interval: {interval}")
+    symbols = params.get('symbols')
+    if isinstance(symbols, str): symbols = symbols.split(',')
+    try:
+        job = start_backfill(str(params.get('exchange', 'NSE')).upper(), symbols, interval, params.get('start_date'), params.get('end_date'),
+                             params.get('workers'), params.get('limit'), params.get('job_id'))
+    except (ValueError, TypeError) as e: abort(400, description=str(e))
+    if job is None: abort(404, description="Backfill universe is empty (instrument list unavailable?).")
+    print(f"API: Backfill {job.job_id} started for {len(job.symbols)} symbols.")
+    return jsonify(job.progress()), 202
+
+@stocks_bp.route('/backfill/<string:job_id>', methods=['GET'])
+def get_backfill_route(job_id: str):
+    """Progress/throughput of a backfill job (live if running in this process, else its stored summary)."""
+    progress = get_backfill_progress(job_id)
+    if progress is None: abort(404, description=f"Unknown backfill job: {job_id}")
+    return jsonify(progress), 200
+
+# ============================================================
+# Routes to Trigger / Monitor the End-of-Day Update
+# ============================================================
+@stocks_bp.route('/eod-update', methods=['POST'])
+def start_eod_update_route():
+    """Runs the end-of-day incremental update now, in the background. Optional JSON body: exchange."""
+    params = request.get_json(silent=True) or {}
+    exchange = str(params['exchange']).upper() if params.get('exchange') else None
+    if not start_eod_update(exchange): abort(409, description="An end-of-day update is already running.")
+    print(f"API: End-of-day update started for {exchange or 'all exchanges'}.")
+    return jsonify(eod_scheduler.status()), 202
+
+@stocks_bp.route('/eod-update', methods=['GET'])
+def get_eod_update_route():
+    """Schedule, running state and last result of the end-of-day update."""
+    return jsonify(eod_scheduler.status()), 200
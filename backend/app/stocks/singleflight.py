@@ -0,0 +1,39 @@
+# backend/app/stocks/singleflight.py
+# In-flight de-duplication: concurrent calls with the same key run the function once; the others wait for it and get
+# the same result (or the same exception). Nothing is cached - a call after the leader finished runs again.
+
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event(); self.result: Any = None; self.error: BaseException = None
+
+class SingleFlight:
+    """Per-process request coalescing (like Go's singleflight.Group)."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock(); self._calls: Dict[Hashable, _Call] = {}
+        self.stats = {'calls': 0, 'executed': 0, 'coalesced': 0}
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            self.stats['calls'] += 1
+            call = self._calls.get(key)
+            if call is not None: self.stats['coalesced'] += 1; leader = False
+            else: call = self._calls[key] = _Call(); self.stats['executed'] += 1; leader = True
+        if not leader:
+            print(f"SingleFlight {self.name}: Waiting for in-flight {key}")
+            call.done.wait()
+            if call.error is not None: raise call.error
+            return call.result
+        try: call.result = fn(*args, **kwargs)
+        except BaseException as e: call.error = e; raise
+        finally:
+            with self._lock: self._calls.pop(key, None) # Later callers start a fresh call
+            call.done.set()
+        return call.result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock: return {**self.stats, 'in_flight': len(self._calls)}
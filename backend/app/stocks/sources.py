@@ -0,0 +1,185 @@
+# backend/app/stocks/sources.py
+# Upstream source health: a circuit breaker plus error/latency EWMAs per source (Upstox, yfinance), a TTL negative
+# cache for symbols a source does not know, and fetch_ohlcv(), which tries the sources in health/latency order.
+# A source that keeps failing (or has no access token) is skipped instead of costing every request a failed call first.
+
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from app.config import Config
+from . import fetcher
+
+print("Source health module loaded")
+
+EWMA_ALPHA = 0.2 # Weight of the newest call in the latency/error averages
+ERROR_RATE_WEIGHT = 4 # Ordering score = latency * (1 + ERROR_RATE_WEIGHT * error rate) * priority penalty
+
+class CircuitBreaker:
+    """
+    closed -> open after `threshold` consecutive failures; open rejects calls for `open_seconds` (doubling on every
+    re-open, up to `max_open_seconds`); then half_open lets ONE trial call through - success closes, failure re-opens.
+    """
+
+    def __init__(self, threshold: int, open_seconds: float, max_open_seconds: float):
+        self.threshold = threshold; self.open_seconds = open_seconds; self.max_open_seconds = max_open_seconds
+        self.state = 'closed'; self.failures = 0; self.trips = 0; self.opened_at = 0.0; self._trial_in_flight = False
+
+    def _cooldown(self) -> float:
+        return min(self.max_open_seconds, self.open_seconds * 2 ** max(0, self.trips - 1))
+
+    def _advance(self, now: float):
+        if self.state == 'open' and now - self.opened_at >= self._cooldown(): self.state = 'half_open'; self._trial_in_flight = False
+
+    def rank(self, now: float) -> int:
+        """Ordering rank: 0 = trial call due (probe a recovering source first), 1 = closed, 2 = open/trial already running."""
+        self._advance(now)
+        if self.state == 'half_open' and not self._trial_in_flight: return 0
+        return 1 if self.state == 'closed' else 2
+
+    def allow(self, now: float) -> bool:
+        self._advance(now)
+        if self.state == 'closed': return True
+        if self.state == 'half_open' and not self._trial_in_flight: self._trial_in_flight = True; return True
+        return False
+
+    def on_success(self):
+        self.state = 'closed'; self.failures = 0; self.trips = 0; self._trial_in_flight = False
+
+    def on_failure(self, now: float) -> bool:
+        """Returns True if this failure opened the breaker."""
+        self.failures += 1; self._trial_in_flight = False
+        if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+            self.state = 'open'; self.opened_at = now; self.trips += 1; return True
+        return False
+
+    def retry_in(self, now: float) -> Optional[float]:
+        return max(0.0, self._cooldown() - (now - self.opened_at)) if self.state == 'open' else None
+
+class SourceHealth:
+    """Breaker + stats of one upstream source."""
+
+    def __init__(self, name: str, priority: int):
+        self.name = name; self.priority = priority
+        self.breaker = CircuitBreaker(Config.SOURCE_FAILURE_THRESHOLD, Config.SOURCE_OPEN_SECONDS, Config.SOURCE_MAX_OPEN_SECONDS)
+        self.latency_ms: Optional[float] = None; self.error_rate = 0.0
+        self.stats = {'calls': 0, 'successes': 0, 'failures': 0, 'not_found': 0, 'skipped_open': 0, 'skipped_unavailable': 0, 'skipped_negative': 0}
+        self.last_error: Optional[str] = None
+
+    def score(self) -> float:
+        latency = self.latency_ms if self.latency_ms is not None else float('inf') # Untried: configured order decides (ties -> priority)
+        return latency * (1 + ERROR_RATE_WEIGHT * self.error_rate) * (1 if self.priority == 0 else Config.SOURCE_FALLBACK_PENALTY)
+
+    def observe(self, seconds: float, ok: bool):
+        ms = seconds * 1000
+        self.latency_ms = ms if self.latency_ms is None else (1 - EWMA_ALPHA) * self.latency_ms + EWMA_ALPHA * ms
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA * (0.0 if ok else 1.0)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {'state': self.breaker.state, 'consecutive_failures': self.breaker.failures, 'retry_in_seconds': self.breaker.retry_in(now),
+                'latency_ewma_ms': round(self.latency_ms, 1) if self.latency_ms is not None else None,
+                'error_rate_ewma': round(self.error_rate, 3), 'priority': self.priority, 'last_error': self.last_error, **self.stats}
+
+# --- Source Adapters ---
+# name -> (available(), not_found_before_call(symbol, exchange), fetch(symbol, exchange, interval, start, end), not_found_after_failure(symbol, exchange))
+FetchFn = Callable[[str, str, str, str, str], Optional[pd.DataFrame]]
+SOURCE_ADAPTERS: Dict[str, Tuple[Callable[[], bool], Callable[[str, str], bool], FetchFn, Callable[[str, str], bool]]] = {
+    'upstox': (fetcher.upstox_available, fetcher.upstox_symbol_not_found, fetcher.fetch_stock_data_upstox, lambda symbol, exchange: False),
+    'yfinance': (lambda: True, lambda symbol, exchange: False,
+                 lambda symbol, exchange, interval, start, end: fetcher.fetch_stock_data_yf(symbol, start, end, exchange, interval=interval),
+                 fetcher.yf_symbol_not_found),
+}
+
+class UpstreamSources:
+    """Health-aware access to the OHLCV sources, shared by all requests and backfill workers of the process."""
+
+    def __init__(self, order: List[str]):
+        unknown = [name for name in order if name not in SOURCE_ADAPTERS]
+        if unknown: raise ValueError(f"Unknown upstream source(s): {unknown}")
+        self._lock = threading.Lock()
+        self._sources = {name: SourceHealth(name, priority) for priority, name in enumerate(order)}
+        self._not_found: Dict[Tuple[str, str, str], float] = {} # (source, symbol, exchange) -> expires at
+
+    def is_not_found(self, source: str, symbol: str, exchange: str) -> bool:
+        key = (source, symbol.upper(), exchange.upper())
+        with self._lock:
+            expires = self._not_found.get(key)
+            if expires is not None and expires <= time.time(): del self._not_found[key]; expires = None
+            return expires is not None
+
+    def mark_not_found(self, source: str, symbol: str, exchange: str):
+        with self._lock: self._not_found[(source, symbol.upper(), exchange.upper())] = time.time() + Config.NEGATIVE_CACHE_SECONDS
+        print(f"Sources: {symbol}/{exchange} not found on {source}; not asking it again for {Config.NEGATIVE_CACHE_SECONDS:g}s.")
+
+    @staticmethod
+    def _sorted(candidates: List[SourceHealth]) -> List[str]:
+        now = time.monotonic()
+        return [s.name for s in sorted(candidates, key=lambda s: (s.breaker.rank(now), s.score(), s.priority))]
+
+    def ordered(self, names: Optional[List[str]] = None) -> List[str]:
+        """
+        Sources by current health: a source whose circuit is due a trial call first (one request per cooldown probes
+        recovery), then closed circuits by latency/error score, open circuits last.
+        """
+        with self._lock: return self._sorted([self._sources[name] for name in (names or self._sources) if name in self._sources])
+
+    def fetch_ohlcv(self, symbol: str, exchange: str, interval: str, start_date: str, end_date: str,
+                    sources: Optional[List[str]] = None) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+        """
+        First non-empty frame from the sources in health order, else an empty frame (a source answered: no bars), else None.
+        Returns (frame, source name). Open breakers, missing credentials and negatively cached symbols skip a source.
+        """
+        empty_result: Tuple[Optional[pd.DataFrame], Optional[str]] = (None, None)
+        for name in self.ordered(sources):
+            source = self._sources[name]; available, known_missing, fetch, missing_after = SOURCE_ADAPTERS[name]
+            if not available():
+                with self._lock: source.stats['skipped_unavailable'] += 1
+                continue
+            if self.is_not_found(name, symbol, exchange):
+                with self._lock: source.stats['skipped_negative'] += 1
+                continue
+            if known_missing(symbol, exchange):
+                with self._lock: source.stats['not_found'] += 1
+                self.mark_not_found(name, symbol, exchange); continue
+            with self._lock:
+                allowed = source.breaker.allow(time.monotonic())
+                if not allowed: source.stats['skipped_open'] += 1
+            if not allowed: print(f"Sources: {name} circuit open, skipping for {symbol}/{exchange}."); continue
+
+            started = time.perf_counter()
+            try: data = fetch(symbol, exchange, interval, start_date, end_date)
+            except Exception as e: print(f"Sources: {name} raised for {symbol}/{exchange}: {e}"); data = None
+            elapsed = time.perf_counter() - started
+            not_found = data is None and missing_after(symbol, exchange)
+            with self._lock:
+                source.stats['calls'] += 1
+                if data is not None or not_found: # The source answered - a healthy call, even if the symbol is unknown
+                    source.observe(elapsed, True); source.breaker.on_success()
+                    source.stats['not_found' if not_found else 'successes'] += 1
+                else:
+                    source.observe(elapsed, False); source.stats['failures'] += 1
+                    source.last_error = f"{symbol}/{exchange} {interval} [{start_date} to {end_date}]"
+                    opened = source.breaker.on_failure(time.monotonic())
+                    if opened: print(f"Sources: {name} circuit OPEN after {source.breaker.failures} consecutive failures (retry in {source.breaker.retry_in(time.monotonic()):.0f}s).")
+            if not_found: self.mark_not_found(name, symbol, exchange); continue
+            if data is None: continue
+            if not data.empty: return data, name
+            if empty_result[0] is None: empty_result = (data, name)
+        return empty_result
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, expires in self._not_found.items() if expires <= time.time()]
+            for key in expired: del self._not_found[key]
+            return {'order': self._sorted(list(self._sources.values())),
+                    'sources': {name: source.snapshot(now) for name, source in self._sources.items()},
+                    'negative_cache_size': len(self._not_found)}
+
+# --- Instantiate the sources ---
+upstream_sources = UpstreamSources([name.strip() for name in Config.SOURCE_ORDER.split(',') if name.strip()])
+
+def get_source_health() -> Dict[str, Any]:
+    return upstream_sources.get_stats()
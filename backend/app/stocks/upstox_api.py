@@ -0,0 +1,132 @@
+# backend/app/stocks/upstox_api.py
+# Long-lived Upstox SDK client: one ApiClient (urllib3 keep-alive pool + SDK thread pool) per process instead of one
+# per fetch. Rebuilt when UPSTOX_ACCESS_TOKEN changes (Config or backend/.env); every call is timed.
+
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from dotenv import dotenv_values
+
+from app.config import Config, basedir
+from .ratelimit import upstox_limiter
+
+# --- Upstox SDK Imports ---
+try:
+    import upstox_client
+    from upstox_client.configuration import Configuration
+    from upstox_client.api_client import ApiClient
+    from upstox_client.rest import ApiException
+    from upstox_client.api.history_api import HistoryApi
+    print("Upstox SDK base and HistoryApi imported successfully.")
+    UPSTOX_SDK_AVAILABLE = True
+except ImportError as e:
+    print(f"WARNING: Failed to import Upstox SDK components ({e}). Upstox fetching will fail.")
+    upstox_client = None; Configuration = None; ApiClient = None; ApiException = Exception; HistoryApi = None
+    UPSTOX_SDK_AVAILABLE = False
+
+UPSTOX_API_VERSION = "2.0"
+ENV_FILE_PATH = os.path.join(basedir, '.env')
+
+# --- Access Token ---
+def _env_file_mtime() -> Optional[float]:
+    try: return os.path.getmtime(ENV_FILE_PATH)
+    except OSError: return None
+
+_env_mtime: Optional[float] = _env_file_mtime() # Config already loaded this version of .env
+_env_lock = threading.Lock()
+
+def get_access_token() -> Optional[str]:
+    """Current token: Config.UPSTOX_ACCESS_TOKEN, re-read from backend/.env whenever that file changes."""
+    global _env_mtime
+    mtime = _env_file_mtime()
+    if mtime is not None and mtime != _env_mtime:
+        with _env_lock:
+            if mtime != _env_mtime:
+                token = dotenv_values(ENV_FILE_PATH).get('UPSTOX_ACCESS_TOKEN')
+                if token and token != Config.UPSTOX_ACCESS_TOKEN:
+                    print("Upstox client: UPSTOX_ACCESS_TOKEN changed in .env.")
+                    Config.UPSTOX_ACCESS_TOKEN = token
+                _env_mtime = mtime
+    return Config.UPSTOX_ACCESS_TOKEN
+
+def set_access_token(token: str):
+    """Sets the token programmatically (e.g. after an OAuth login); the client is rebuilt on its next call."""
+    Config.UPSTOX_ACCESS_TOKEN = token
+
+# --- Persistent Client ---
+class UpstoxClient:
+    """Thread-safe wrapper around one SDK ApiClient/HistoryApi pair, shared by all fetches in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._api_client = None; self._history_api = None; self._token: Optional[str] = None
+        self.stats = {'calls': 0, 'errors': 0, 'clients_built': 0, 'total_call_seconds': 0.0, 'last_call_ms': None, 'max_call_ms': None}
+
+    def _build(self, token: str):
+        configuration = Configuration(); configuration.access_token = token
+        configuration.api_key['api-version'] = UPSTOX_API_VERSION
+        if Config.UPSTOX_API_HOST: configuration.host = Config.UPSTOX_API_HOST.rstrip('/')
+        configuration.connection_pool_maxsize = Config.UPSTOX_POOL_SIZE # Keep-alive connections per host
+        return ApiClient(configuration)
+
+    @staticmethod
+    def _close(api_client):
+        try: api_client.rest_client.pool_manager.clear() # Idle keep-alive sockets; in-flight ones close on release
+        except Exception as e: print(f"Upstox client: Error closing connection pool: {e}")
+        try: api_client.pool.close()
+        except Exception: pass
+
+    def _get_history_api(self) -> Optional[Any]:
+        token = get_access_token()
+        if not token: print("Error: Upstox Access Token not configured."); return None
+        with self._lock:
+            if self._history_api is None or token != self._token:
+                old_client = self._api_client
+                self._api_client = self._build(token); self._history_api = HistoryApi(self._api_client); self._token = token
+                self.stats['clients_built'] += 1
+                print(f"Upstox client: {'Rebuilt (token changed)' if old_client else 'Created'} client for {self._api_client.configuration.host} (pool {Config.UPSTOX_POOL_SIZE}).")
+                if old_client is not None: self._close(old_client)
+            return self._history_api
+
+    def get_historical_candle_data(self, instrument_key: str, interval: str, to_date: str, from_date: str):
+        """HistoryApi.get_historical_candle_data1 over the shared pool; raises ApiException like the SDK."""
+        history_api = self._get_history_api()
+        if history_api is None: return None
+        upstox_limiter.acquire() # Not counted in the call latency
+        started = time.perf_counter()
+        try:
+            return history_api.get_historical_candle_data1(
+                instrument_key=instrument_key, interval=interval, to_date=to_date, from_date=from_date,
+                api_version=UPSTOX_API_VERSION, _request_timeout=Config.UPSTOX_TIMEOUT_SECONDS)
+        except Exception:
+            with self._lock: self.stats['errors'] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.stats['calls'] += 1; self.stats['total_call_seconds'] += elapsed
+                self.stats['last_call_ms'] = round(elapsed * 1000, 1)
+                self.stats['max_call_ms'] = max(self.stats['max_call_ms'] or 0, self.stats['last_call_ms'])
+            print(f"Upstox client: {interval} candles for {instrument_key} [{from_date} to {to_date}] in {elapsed*1000:.0f} ms")
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats)
+            stats['avg_call_ms'] = round(stats['total_call_seconds'] / stats['calls'] * 1000, 1) if stats['calls'] else None
+            stats['total_call_seconds'] = round(stats['total_call_seconds'], 3)
+            stats['host'] = self._api_client.configuration.host if self._api_client else Config.UPSTOX_API_HOST
+            stats['rate_limit'] = upstox_limiter.get_stats()
+            return stats
+
+    def close(self):
+        with self._lock:
+            if self._api_client is not None: self._close(self._api_client)
+            self._api_client = None; self._history_api = None; self._token = None
+
+# --- Instantiate the client ---
+upstox_client_instance = UpstoxClient()
+
+def get_upstox_stats() -> Dict[str, Any]:
+    return upstox_client_instance.get_stats()
@@ -0,0 +1,24 @@
+# backend/archive.py
+# Moves OHLCV bars older than the hot window (Config.HOT_DATA_YEARS) into the Parquet cold tier (Config.COLD_STORAGE_DIR).
+# Reads keep seeing the full history: repository queries union hot DuckDB rows with the archived files.
+# In the default DB_ACCESS_MODE=single the running web app holds the DuckDB file lock - while it is up, use the
+# writer/reader setup instead (python ingest.py, then the app and this CLI with DB_ACCESS_MODE=reader).
+#   python archive.py                   -> keep the current year + HOT_DATA_YEARS-1 previous years hot
+#   python archive.py --before-year 2020
+import argparse
+from datetime import date
+import os
+os.environ.setdefault('EOD_SCHEDULER_ENABLED', 'false') # One-off CLI - the end-of-day update belongs to the app/ingest process
+
+from app import app
+from app.stocks import repository
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive old OHLCV bars to Parquet cold storage")
+    parser.add_argument('--before-year', type=int, default=None, help="Archive bars dated before Jan 1 of this year")
+    args = parser.parse_args()
+    before_year = args.before_year or date.today().year - app.config['HOT_DATA_YEARS'] + 1
+    with app.app_context():
+        result = repository.archive_cold_years(before_year)
+    if result is None: raise SystemExit(1)
+    print(f"Archived {result['rows']} bars into {result['files']} Parquet files (before {before_year}).")
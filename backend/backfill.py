@@ -0,0 +1,36 @@
+# backend/backfill.py
+# Backfills metadata + history for a universe of symbols (default: every NSE EQ instrument) through a worker pool,
+# paced by the Upstox/yfinance rate limits. Interrupt with Ctrl+C and re-run the same command to resume.
+# In the default DB_ACCESS_MODE=single the running web app holds the DuckDB file lock - while it is up, use the
+# writer/reader setup instead (python ingest.py, then the app and this CLI with DB_ACCESS_MODE=reader).
+#   python backfill.py                                    -> 10 years of daily bars for all NSE equities
+#   python backfill.py --symbols TCS,INFY --start 2015-01-01 --workers 4
+#   python backfill.py --exchange BSE --limit 100 --interval 5M --start 2026-09-01
+import argparse
+import os
+os.environ.setdefault('EOD_SCHEDULER_ENABLED', 'false') # One-off CLI - the end-of-day update belongs to the app/ingest process
+
+from app import app
+from app.stocks.backfill import start_backfill
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Concurrent, resumable historical backfill for a universe of symbols")
+    parser.add_argument('--exchange', default='NSE'); parser.add_argument('--interval', default='1D')
+    parser.add_argument('--symbols', default=None, help="Comma-separated symbols (default: all EQ instruments of the exchange)")
+    parser.add_argument('--limit', type=int, default=None, help="Only the first N symbols of the universe")
+    parser.add_argument('--start', default=None, help="YYYY-MM-DD (default: 10 years ago)")
+    parser.add_argument('--end', default=None, help="YYYY-MM-DD (default: today)")
+    parser.add_argument('--workers', type=int, default=None, help=f"Default {app.config['BACKFILL_WORKERS']}")
+    parser.add_argument('--job-id', default=None, help="Resume/name a job (default derived from exchange, interval and the dates given; a resume keeps the stored range)")
+    args = parser.parse_args()
+    job = start_backfill(args.exchange, args.symbols.split(',') if args.symbols else None, args.interval, args.start, args.end,
+                         args.workers, args.limit, args.job_id)
+    if job is None: raise SystemExit(1)
+    try:
+        while not job.join(timeout=1): pass
+    except KeyboardInterrupt:
+        print("Interrupted - finishing symbols in flight; re-run the same command to resume.")
+        job.cancel(); job.join()
+    progress = job.progress()
+    print(f"Backfill {progress['job_id']} {progress['state']}: {progress['done']} done, {progress['failed']} failed, {progress['rows_stored']} rows in {progress['elapsed_seconds']}s.")
+    if progress['failed'] or progress['state'] != 'finished': raise SystemExit(1)
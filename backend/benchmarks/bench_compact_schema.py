@@ -0,0 +1,104 @@
+# backend/benchmarks/bench_compact_schema.py
+# Compares the old symbol/exchange-keyed OHLCV layout with the integer instrument_id layout (DOUBLE and FLOAT prices).
+# Standalone (DuckDB + NumPy only) so it never touches data/stocks.db; schemas mirror app/stocks/repository.py.
+#   python benchmarks/bench_compact_schema.py [--symbols 2000] [--years 10] [--queries 500]
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import duckdb
+import numpy as np
+import pandas as pd
+
+LAYOUTS = {
+    'legacy (symbol/exchange VARCHAR, DOUBLE)': {
+        'stocks': "CREATE TABLE stocks ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, name VARCHAR, PRIMARY KEY (symbol, exchange));",
+        'daily': "CREATE TABLE ohlcv_daily ( symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, date DATE NOT NULL, open DOUBLE, high DOUBLE, low DOUBLE, close DOUBLE, volume BIGINT, PRIMARY KEY (symbol, exchange, date), FOREIGN KEY (symbol, exchange) REFERENCES stocks(symbol, exchange));",
+        'price': 'DOUBLE', 'keyed_by_id': False,
+    },
+    'instrument_id, DOUBLE': {
+        'stocks': "CREATE TABLE stocks ( instrument_id INTEGER PRIMARY KEY, symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, name VARCHAR, UNIQUE (symbol, exchange));",
+        'daily': "CREATE TABLE ohlcv_daily ( instrument_id INTEGER NOT NULL, date DATE NOT NULL, open DOUBLE, high DOUBLE, low DOUBLE, close DOUBLE, volume BIGINT, PRIMARY KEY (instrument_id, date), FOREIGN KEY (instrument_id) REFERENCES stocks(instrument_id));",
+        'price': 'DOUBLE', 'keyed_by_id': True,
+    },
+    'instrument_id, FLOAT (OHLCV_FLOAT32_PRICES)': {
+        'stocks': "CREATE TABLE stocks ( instrument_id INTEGER PRIMARY KEY, symbol VARCHAR NOT NULL, exchange VARCHAR NOT NULL, name VARCHAR, UNIQUE (symbol, exchange));",
+        'daily': "CREATE TABLE ohlcv_daily ( instrument_id INTEGER NOT NULL, date DATE NOT NULL, open FLOAT, high FLOAT, low FLOAT, close FLOAT, volume BIGINT, PRIMARY KEY (instrument_id, date), FOREIGN KEY (instrument_id) REFERENCES stocks(instrument_id));",
+        'price': 'FLOAT', 'keyed_by_id': True,
+    },
+}
+
+def make_dataset(n_symbols: int, years: int, seed: int = 7) -> pd.DataFrame:
+    """Random-walk daily bars (paise-rounded) for n_symbols over `years` years of business days."""
+    days = pd.bdate_range(end='2026-10-16', periods=years * 252)
+    rng = np.random.default_rng(seed)
+    n_days = len(days)
+    close = np.round(np.exp(np.cumsum(rng.normal(0, 0.015, (n_symbols, n_days)), axis=1)) * rng.uniform(20, 3000, (n_symbols, 1)), 2)
+    spread = np.round(close * rng.uniform(0.001, 0.02, close.shape), 2)
+    return pd.DataFrame({
+        'instrument_id': np.repeat(np.arange(1, n_symbols + 1, dtype=np.int32), n_days),
+        'symbol': np.repeat(np.array([f"SYM{i:05d}" for i in range(1, n_symbols + 1)]), n_days),
+        'date': np.tile(days.values.astype('datetime64[D]'), n_symbols),
+        'open': (close - spread / 2).ravel(), 'high': (close + spread).ravel(), 'low': (close - spread).ravel(), 'close': close.ravel(),
+        'volume': rng.integers(1_000, 5_000_000, n_symbols * n_days),
+    })
+
+def build(path: str, layout: dict, bars: pd.DataFrame) -> float:
+    con = duckdb.connect(path)
+    con.execute(layout['stocks']); con.execute(layout['daily'])
+    stocks = bars[['instrument_id', 'symbol']].drop_duplicates()
+    con.register('bench_stocks', stocks); con.register('bench_bars', bars)
+    started = time.perf_counter()
+    if layout['keyed_by_id']:
+        con.execute("INSERT INTO stocks SELECT instrument_id, symbol, 'NSE', symbol FROM bench_stocks")
+        con.execute("INSERT INTO ohlcv_daily SELECT instrument_id, date, open, high, low, close, volume FROM bench_bars ORDER BY instrument_id, date")
+    else:
+        con.execute("INSERT INTO stocks SELECT symbol, 'NSE', symbol FROM bench_stocks")
+        con.execute("INSERT INTO ohlcv_daily SELECT symbol, 'NSE', date, open, high, low, close, volume FROM bench_bars ORDER BY symbol, date")
+    con.execute("CHECKPOINT"); con.close()
+    return time.perf_counter() - started
+
+def bench_reads(path: str, layout: dict, symbols: list, n_queries: int) -> dict:
+    con = duckdb.connect(path, read_only=True)
+    rng = random.Random(11)
+    picks = [(rng.choice(symbols), rng.randint(0, 8)) for _ in range(n_queries)]
+    ids = dict(con.execute("SELECT symbol, instrument_id FROM stocks").fetchall()) if layout['keyed_by_id'] else None
+    price = (lambda c: f"round(CAST({c} AS DOUBLE), 2)") if layout['price'] == 'FLOAT' else (lambda c: c)
+    select_sql = f"CAST(date AS TIMESTAMP) AS time, {price('open')} AS open, {price('high')} AS high, {price('low')} AS low, {price('close')} AS close, volume"
+    started = time.perf_counter()
+    for symbol, year_offset in picks: # Same shape as repository.get_ohlcv_data: one symbol, ~1 year
+        start = f"{2017 + year_offset}-01-01"; end = f"{2017 + year_offset}-12-31"
+        if ids is not None: con.execute(f"SELECT {select_sql} FROM ohlcv_daily WHERE instrument_id = ? AND date BETWEEN ? AND ? ORDER BY date", [ids[symbol], start, end]).fetchnumpy()
+        else: con.execute(f"SELECT {select_sql} FROM ohlcv_daily WHERE symbol = ? AND exchange = ? AND date BETWEEN ? AND ? ORDER BY date", [symbol, 'NSE', start, end]).fetchnumpy()
+    point_reads = time.perf_counter() - started
+    key = 'instrument_id' if ids is not None else 'symbol, exchange'
+    started = time.perf_counter()
+    for _ in range(3): con.execute(f"SELECT {key}, avg(close), max(high), sum(volume) FROM ohlcv_daily GROUP BY ALL").fetchall()
+    full_scan = (time.perf_counter() - started) / 3
+    con.close()
+    return {'point_reads_ms': point_reads / n_queries * 1000, 'full_scan_s': full_scan}
+
+def main():
+    parser = argparse.ArgumentParser(description="Legacy vs instrument_id OHLCV layout: file size and scan time")
+    parser.add_argument('--symbols', type=int, default=2000); parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+    bars = make_dataset(args.symbols, args.years); symbols = bars['symbol'].unique().tolist()
+    print(f"Dataset: {args.symbols} symbols x {args.years} years = {len(bars):,} daily bars (duckdb {duckdb.__version__})")
+    work_dir = tempfile.mkdtemp(prefix='bench_compact_')
+    try:
+        print(f"{'layout':<46}{'file MB':>10}{'load s':>9}{'1y read ms':>12}{'full scan s':>13}")
+        for i, (name, layout) in enumerate(LAYOUTS.items()):
+            path = os.path.join(work_dir, f"layout{i}.db")
+            load_s = build(path, layout, bars)
+            size_mb = os.path.getsize(path) / 1024 / 1024
+            reads = bench_reads(path, layout, symbols, args.queries)
+            print(f"{name:<46}{size_mb:>10.1f}{load_s:>9.1f}{reads['point_reads_ms']:>12.2f}{reads['full_scan_s']:>13.3f}")
+    finally: shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
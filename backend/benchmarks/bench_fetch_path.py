@@ -0,0 +1,138 @@
+# backend/benchmarks/bench_fetch_path.py
+# Drives StockManager.get_stock_data cold (new symbol: instrument index, metadata, 10-year bulk fetch, gap fill, store)
+# and warm (range already checked: coverage lookup, DB read, indicators - served by the indicator result cache; set
+# INDICATOR_CACHE_MB=0 to compute them every time) and reports latency per stage.
+# Upstream is benchmarks/fake_upstox_server.py (default), fixtures recorded earlier (--replay DIR) or live Upstox/yfinance
+# while recording fixtures (--record DIR, needs a real token in backend/.env). Fixtures match requests exactly (dates
+# included; the bulk fetch counts back from today), so replay a recording on the day it was made.
+# Uses a temporary data directory - never touches data/stocks.db.
+#   python benchmarks/bench_fetch_path.py [--symbols 20] [--intervals 1D,1W] [--warm-repeats 5] [--days 365]
+#                                         [--indicators SMA_20,EMA,RSI,MACD] [--latency-ms 5] [--connect-ms 40]
+
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Callable, Dict, List
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR); sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstox_server import start_server
+
+class StageTimer:
+    """Times calls of wrapped functions per stage (inclusive: nested stages are also counted in their callers)."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def wrap(self, owner, attr: str, stage: str):
+        original: Callable = getattr(owner, attr)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try: return original(*args, **kwargs)
+            finally: self.samples[stage].append((time.perf_counter() - started) * 1000)
+        setattr(owner, attr, timed)
+
+    def take(self) -> Dict[str, List[float]]:
+        samples = dict(self.samples); self.samples.clear(); return samples
+
+def instrument(timer: StageTimer):
+    """Wraps the stages of the fetch path (module attributes are looked up at call time, so wrapping them is enough)."""
+    import app.stocks.manager as manager_module
+    from app.stocks import fetcher, repository
+    from app.stocks.manager import stock_manager
+    from app.stocks.sources import upstream_sources
+    from app.stocks.upstox_api import upstox_client_instance
+    timer.wrap(stock_manager, 'get_stock_data', 'get_stock_data (total)')
+    timer.wrap(stock_manager, 'ensure_stock_metadata', 'metadata (incl. bulk fetch if new)')
+    timer.wrap(stock_manager, 'fill_coverage_gaps', 'coverage gap fill')
+    timer.wrap(fetcher, 'get_instrument_index', 'instrument index lookup')
+    timer.wrap(upstream_sources, 'fetch_ohlcv', 'upstream fetch (all sources)')
+    timer.wrap(upstox_client_instance, 'get_historical_candle_data', '  upstox http (per window)')
+    timer.wrap(fetcher, '_yf_download', '  yfinance download')
+    timer.wrap(repository, 'get_coverage_gaps', 'db: coverage lookup')
+    timer.wrap(repository, 'add_ohlcv_data', 'db: store bars')
+    timer.wrap(repository, 'record_coverage', 'db: record coverage')
+    timer.wrap(repository, 'get_ohlcv_data', 'db: read bars')
+    timer.wrap(manager_module, 'calculate_indicator_columns', 'indicators (one engine pass)')
+
+def report(phase: str, samples: Dict[str, List[float]]):
+    print(f"\n== {phase} ==")
+    print(f"{'stage':<38} {'calls':>6} {'total ms':>10} {'mean ms':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for stage, values in sorted(samples.items(), key=lambda item: -sum(item[1])):
+        values = np.array(values)
+        print(f"{stage:<38} {len(values):>6} {values.sum():>10.1f} {values.mean():>9.2f} {np.percentile(values, 50):>8.2f} {np.percentile(values, 95):>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="get_stock_data cold/warm latency per stage")
+    parser.add_argument('--symbols', type=int, default=20, help="Symbols fetched cold (BENCH0000, ... on the fake server)")
+    parser.add_argument('--symbol-list', default=None, help="Comma-separated symbols instead of BENCHnnnn (e.g. for --record)")
+    parser.add_argument('--intervals', default='1D,1W'); parser.add_argument('--warm-repeats', type=int, default=5)
+    parser.add_argument('--days', type=int, default=365, help="Requested range, counting back from today")
+    parser.add_argument('--indicators', default='SMA_20,EMA,RSI,MACD')
+    parser.add_argument('--port', type=int, default=8797); parser.add_argument('--connect-ms', type=float, default=40)
+    parser.add_argument('--latency-ms', type=float, default=5)
+    upstream = parser.add_mutually_exclusive_group()
+    upstream.add_argument('--replay', metavar='DIR', help="Serve upstream from fixtures recorded with --record/UPSTREAM_MODE=record")
+    upstream.add_argument('--record', metavar='DIR', help="Call live Upstox/yfinance and save responses as fixtures")
+    parser.add_argument('--verbose', action='store_true', help="Show the app's log output")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench_fetch_path_')
+    os.environ.update({'DB_PATH': os.path.join(data_dir, 'stocks.db'), 'INSTRUMENT_CACHE_DIR': data_dir, 'DB_ACCESS_MODE': 'single', 'EOD_SCHEDULER_ENABLED': 'false',
+                       'COLD_STORAGE_DIR': os.path.join(data_dir, 'cold'), 'SNAPSHOT_DIR': os.path.join(data_dir, 'snapshots')})
+    server = None
+    if args.replay: os.environ.update({'UPSTREAM_MODE': 'replay', 'UPSTREAM_FIXTURES_DIR': os.path.abspath(args.replay)}); source = f"replay of {args.replay}"
+    elif args.record: os.environ.update({'UPSTREAM_MODE': 'record', 'UPSTREAM_FIXTURES_DIR': os.path.abspath(args.record)}); source = f"live, recording to {args.record}"
+    else:
+        server = start_server(args.port, args.connect_ms, args.latency_ms, instruments=max(args.symbols, 10) + 10)
+        host = f"http://127.0.0.1:{args.port}"
+        os.environ.update({'UPSTOX_API_HOST': host, 'UPSTOX_INSTRUMENTS_URL': host + '/instruments/{exchange}.json.gz',
+                           'UPSTOX_ACCESS_TOKEN': 'bench-token', 'UPSTOX_RATE_LIMITS': '100000/1'})
+        source = f"fake server (connect {args.connect_ms} ms, latency {args.latency_ms} ms)"
+
+    symbols = [s.strip().upper() for s in args.symbol_list.split(',')] if args.symbol_list else [f"BENCH{i:04d}" for i in range(args.symbols)]
+    intervals = [i.strip().upper() for i in args.intervals.split(',') if i.strip()]
+    indicators = [i.strip() for i in args.indicators.split(',') if i.strip()]
+    end_date = date.today().strftime('%Y-%m-%d'); start_date = (date.today() - timedelta(days=args.days)).strftime('%Y-%m-%d')
+    print(f"Upstream: {source}; {len(symbols)} symbols, intervals {intervals}, [{start_date} to {end_date}], indicators {indicators}")
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with quiet:
+            started = time.perf_counter()
+            from app import app # Startup: DB init + default stock (RELIANCE), also loads the instrument index
+            from app.stocks.manager import stock_manager
+            startup_ms = (time.perf_counter() - started) * 1000
+            timer = StageTimer(); instrument(timer)
+            phases = []
+            for interval in intervals:
+                for symbol in symbols: stock_manager.get_stock_data(symbol, 'NSE', start_date, end_date, interval=interval, indicators=indicators)
+                phases.append((f"cold {interval} ({len(symbols)} calls: first request per symbol/interval)", timer.take()))
+                for _ in range(args.warm_repeats):
+                    for symbol in symbols: stock_manager.get_stock_data(symbol, 'NSE', start_date, end_date, interval=interval, indicators=indicators)
+                phases.append((f"warm {interval} ({len(symbols) * args.warm_repeats} calls)", timer.take()))
+            from app.stocks.recorder import upstream_recorder
+            from app.stocks.upstox_api import get_upstox_stats
+            from app.stocks.indicator_cache import get_indicator_cache_stats
+            recorder_stats = upstream_recorder.get_stats(); upstox_stats = get_upstox_stats(); cache_stats = get_indicator_cache_stats()
+        print(f"App startup (DB init, default stock): {startup_ms:.0f} ms")
+        for phase, samples in phases: report(phase, samples)
+        print(f"\nUpstox client: {upstox_stats['calls']} calls, avg {upstox_stats['avg_call_ms']} ms; recorder: {recorder_stats}")
+        print(f"Indicator cache: {cache_stats}")
+        if server is not None: print(f"Fake server: {server.stats}")
+    finally:
+        if server is not None: server.shutdown()
+        if 'app.database' in sys.modules: sys.modules['app.database'].close_db()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# backend/benchmarks/bench_upstox_client.py
+# Per-call Upstox ApiClient (old fetcher behaviour) vs one shared, pooled client, against benchmarks/fake_upstox_server.py.
+# Standalone (Upstox SDK only); the shared-client side mirrors app/stocks/upstox_api.py.
+#   python benchmarks/bench_upstox_client.py [--calls 200] [--threads 8] [--connect-ms 40] [--latency-ms 5]
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from upstox_client.api.history_api import HistoryApi
+from upstox_client.api_client import ApiClient
+from upstox_client.configuration import Configuration
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_upstox_server import start_server
+
+def make_client(host: str, pool_size: int) -> ApiClient:
+    configuration = Configuration(); configuration.access_token = 'bench-token'; configuration.api_key['api-version'] = '2.0'
+    configuration.host = host; configuration.connection_pool_maxsize = pool_size
+    return ApiClient(configuration)
+
+def fetch(history_api: HistoryApi, i: int):
+    response = history_api.get_historical_candle_data1(instrument_key=f"NSE_EQ|BENCH{i % 50:04d}", interval='day',
+                                                       to_date='2026-10-16', from_date='2026-01-01', api_version='2.0')
+    assert response.status == 'success' and response.data.candles
+
+def run(label: str, server, calls: int, threads: int, call):
+    before = dict(server.stats); started = time.perf_counter()
+    if threads == 1:
+        for i in range(calls): call(i)
+    else:
+        with ThreadPoolExecutor(threads) as pool: list(pool.map(call, range(calls)))
+    elapsed = time.perf_counter() - started
+    connections = server.stats['connections'] - before['connections']
+    print(f"{label:<34}{threads:>8}{elapsed:>10.2f}{elapsed / calls * 1000:>11.1f}{calls / elapsed:>10.1f}{connections:>13}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-call vs shared Upstox client against a local stand-in API")
+    parser.add_argument('--calls', type=int, default=200); parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--connect-ms', type=float, default=40); parser.add_argument('--latency-ms', type=float, default=5)
+    parser.add_argument('--port', type=int, default=8799)
+    args = parser.parse_args()
+    server = start_server(args.port, args.connect_ms, args.latency_ms); host = f"http://127.0.0.1:{args.port}"
+    print(f"{args.calls} daily-candle calls, connect {args.connect_ms} ms, server latency {args.latency_ms} ms")
+    print(f"{'client':<34}{'threads':>8}{'total s':>10}{'ms/call':>11}{'calls/s':>10}{'connections':>13}")
+
+    def per_call(i): # Old fetcher: new Configuration/ApiClient/HistoryApi for every fetch
+        api_client = make_client(host, args.threads); fetch(HistoryApi(api_client), i); api_client.pool.close()
+    shared_api = HistoryApi(make_client(host, args.threads))
+    def shared(i): fetch(shared_api, i)
+
+    for threads in (1, args.threads):
+        run('per-call ApiClient', server, args.calls, threads, per_call)
+        run('shared pooled ApiClient', server, args.calls, threads, shared)
+    server.shutdown()
+
+if __name__ == '__main__':
+    main()
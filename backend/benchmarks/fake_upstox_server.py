@@ -0,0 +1,134 @@
+# backend/benchmarks/fake_upstox_server.py
+# Local stand-in for the Upstox v2 historical-candle endpoint, for testing/benchmarking the fetch path offline.
+# HTTP/1.1 keep-alive; --connect-ms adds a per-connection setup cost (stands in for the TLS handshake to api.upstox.com)
+# and --latency-ms a per-request cost. Like the real API, one request returns at most MAX_DAYS_PER_REQUEST days
+# (older candles are dropped); --fail-rate makes a share of requests fail with 503 to exercise retries.
+# Also serves a synthetic instrument master at /instruments/{NSE|BSE}.json.gz (--instruments EQ symbols: the well-known
+# ones below plus BENCH0000, BENCH0001, ..., and some F&O rows that the app filters out).
+# Point the app at it with UPSTOX_API_HOST=http://127.0.0.1:8799 and
+# UPSTOX_INSTRUMENTS_URL=http://127.0.0.1:8799/instruments/{exchange}.json.gz.
+#   python benchmarks/fake_upstox_server.py [--port 8799] [--connect-ms 40] [--latency-ms 5] [--fail-rate 0.05] [--instruments 2000]
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+
+INTERVALS = {'day': None, 'week': 'W-MON', 'month': 'MS', '1minute': 1, '5minute': 5, '15minute': 15, '30minute': 30, '60minute': 60}
+MAX_DAYS_PER_REQUEST = {'day': 365, 'week': 3650, 'month': 3650, '1minute': 30, '5minute': 30, '15minute': 30, '30minute': 365, '60minute': 365}
+IST_OFFSET = '+05:30'
+KNOWN_SYMBOLS = ['RELIANCE', 'TCS', 'INFY', 'HDFCBANK', 'ICICIBANK', 'SBIN', 'ITC', 'LT', 'AXISBANK', 'KOTAKBANK']
+
+def make_instrument_file(exchange: str, count: int) -> bytes:
+    """Gzipped JSON list shaped like Upstox's instrument master: `count` EQ rows plus an F&O row per 10 of them."""
+    symbols = (KNOWN_SYMBOLS + [f"BENCH{i:04d}" for i in range(max(0, count - len(KNOWN_SYMBOLS)))])[:count]
+    rows = [{'segment': f"{exchange}_EQ", 'name': f"{symbol} LIMITED", 'exchange': exchange, 'isin': f"INE{i:06d}01",
+             'instrument_type': 'EQ', 'instrument_key': f"{exchange}_EQ|INE{i:06d}01", 'trading_symbol': symbol, 'lot_size': 1, 'tick_size': 0.05}
+            for i, symbol in enumerate(symbols)]
+    rows += [{'segment': f"{exchange}_FO", 'name': symbol, 'exchange': exchange, 'instrument_type': 'FUT',
+              'instrument_key': f"{exchange}_FO|{50000 + i}", 'trading_symbol': f"{symbol} FUT", 'lot_size': 500}
+             for i, symbol in enumerate(symbols[::10])]
+    return gzip.compress(json.dumps(rows).encode())
+
+def make_candles(instrument_key: str, interval: str, from_date: date, to_date: date) -> List[list]:
+    """Deterministic random-walk candles (newest first, like Upstox) for business days in [from_date, to_date]."""
+    days = pd.bdate_range(from_date, to_date)
+    if interval in ('week', 'month'): stamps = pd.date_range(from_date, to_date, freq=INTERVALS[interval])
+    elif interval == 'day': stamps = days
+    else: # Intraday: 09:15 to 15:30 IST
+        minutes = INTERVALS[interval]
+        offsets = pd.timedelta_range(start='9h15min', end='15h29min', freq=f'{minutes}min')
+        stamps = pd.DatetimeIndex([d + o for d in days for o in offsets])
+    if len(stamps) == 0: return []
+    rng = np.random.default_rng(zlib.crc32(f"{instrument_key}|{interval}|{from_date}".encode()))
+    close = np.round(np.exp(np.cumsum(rng.normal(0, 0.01, len(stamps)))) * 1000, 2)
+    spread = np.round(close * 0.01, 2); volume = rng.integers(1_000, 1_000_000, len(stamps))
+    candles = [[ts.strftime('%Y-%m-%dT%H:%M:%S') + IST_OFFSET, float(c - s / 2), float(c + s), float(c - s), float(c), int(v), 0]
+               for ts, c, s, v in zip(stamps, close, spread, volume)]
+    return candles[::-1]
+
+class FakeUpstoxHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep-alive, like api.upstox.com
+    server_version = 'FakeUpstox/1.0'
+    wbufsize = 64 * 1024; disable_nagle_algorithm = True # One write per response - no Nagle/delayed-ACK stalls on reused sockets
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock: self.server.stats['connections'] += 1
+        if self.server.connect_ms: time.sleep(self.server.connect_ms / 1000)
+
+    def log_message(self, format, *args):
+        if self.server.verbose: super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: dict):
+        self._send_body(status, json.dumps(payload).encode(), 'application/json')
+
+    def _send_body(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type); self.send_header('Content-Length', str(len(body)))
+        self.end_headers(); self.wfile.write(body)
+
+    def do_GET(self):
+        with self.server.stats_lock: self.server.stats['requests'] += 1
+        if self.server.latency_ms: time.sleep(self.server.latency_ms / 1000)
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if parts == ['stats']:
+            with self.server.stats_lock: return self._send_json(200, dict(self.server.stats))
+        if len(parts) == 2 and parts[0] == 'instruments' and parts[1] in ('NSE.json.gz', 'BSE.json.gz'):
+            exchange = parts[1].split('.')[0]
+            with self.server.stats_lock:
+                body = self.server.instrument_files.get(exchange)
+                if body is None: body = self.server.instrument_files[exchange] = make_instrument_file(exchange, self.server.instruments)
+            return self._send_body(200, body, 'application/gzip') # The file itself is gzip, like the real .json.gz
+        if self.server.fail_rate and random.random() < self.server.fail_rate:
+            with self.server.stats_lock: self.server.stats['failed'] += 1
+            return self._send_json(503, {'status': 'error', 'errors': [{'message': 'Service temporarily unavailable (injected)'}]})
+        # /v2/historical-candle/{instrumentKey}/{interval}/{to_date}[/{from_date}]
+        if len(parts) not in (5, 6) or parts[:2] != ['v2', 'historical-candle'] or parts[3] not in INTERVALS:
+            return self._send_json(404, {'status': 'error', 'errors': [{'message': f'Unknown path {self.path}'}]})
+        try:
+            to_date = datetime.strptime(parts[4], '%Y-%m-%d').date()
+            from_date = datetime.strptime(parts[5], '%Y-%m-%d').date() if len(parts) == 6 else to_date - timedelta(days=365)
+        except ValueError: return self._send_json(400, {'status': 'error', 'errors': [{'message': 'Invalid date'}]})
+        from_date = max(from_date, to_date - timedelta(days=MAX_DAYS_PER_REQUEST[parts[3]] - 1)) # Per-request cap
+        instrument_key = unquote(parts[2])
+        self._send_json(200, {'status': 'success', 'data': {'candles': make_candles(instrument_key, parts[3], from_date, to_date)}})
+
+def start_server(port: int = 8799, connect_ms: float = 0, latency_ms: float = 0, verbose: bool = False, fail_rate: float = 0,
+                 instruments: int = 2000) -> ThreadingHTTPServer:
+    """Starts the server on a daemon thread (for benchmarks/tests); call .shutdown() to stop it."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), FakeUpstoxHandler)
+    server.daemon_threads = True
+    server.connect_ms = connect_ms; server.latency_ms = latency_ms; server.verbose = verbose; server.fail_rate = fail_rate
+    server.instruments = instruments; server.instrument_files = {}
+    server.stats = {'connections': 0, 'requests': 0, 'failed': 0}; server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name='fake-upstox', daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Upstox historical-candle API")
+    parser.add_argument('--port', type=int, default=8799)
+    parser.add_argument('--connect-ms', type=float, default=40, help="Per-connection setup cost (TLS handshake stand-in)")
+    parser.add_argument('--latency-ms', type=float, default=5, help="Per-request server time")
+    parser.add_argument('--fail-rate', type=float, default=0, help="Share of requests answered with 503")
+    parser.add_argument('--instruments', type=int, default=2000, help="EQ instruments in the synthetic instrument master")
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+    server = start_server(args.port, args.connect_ms, args.latency_ms, args.verbose, args.fail_rate, args.instruments)
+    print(f"Fake Upstox API on http://127.0.0.1:{args.port} (connect {args.connect_ms} ms, latency {args.latency_ms} ms). Ctrl+C to stop.")
+    try:
+        while True: time.sleep(3600)
+    except KeyboardInterrupt: server.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+# backend/eod_update.py
+# Runs the end-of-day incremental update once - for cron/Task Scheduler setups instead of the in-process scheduler
+# (set EOD_SCHEDULER_ENABLED=false for the web app then). Every stored stock gets its new daily bars only.
+# In the default DB_ACCESS_MODE=single the running web app holds the DuckDB file lock - while it is up, use the
+# writer/reader setup instead (python ingest.py, then the app and this CLI with DB_ACCESS_MODE=reader).
+#   python eod_update.py
+#   python eod_update.py --exchange NSE
+import argparse
+import os
+os.environ.setdefault('EOD_SCHEDULER_ENABLED', 'false') # This process runs the update itself
+
+from app import app
+from app.stocks.eod import run_eod_update
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append new daily bars for every stored stock")
+    parser.add_argument('--exchange', default=None, help="Only this exchange's stocks (default: all)")
+    args = parser.parse_args()
+    summary = run_eod_update(args.exchange.upper() if args.exchange else None)
+    if summary is None: raise SystemExit(1)
+    print(f"Stored {summary['rows_stored']} bars for {summary['symbols']} stocks ({summary['failed']} failed) in {summary['seconds']}s.")
+    if summary['failed']: raise SystemExit(2)
@@ -0,0 +1,16 @@
+# backend/ingest.py
+# Single-writer ingestion service. This process owns data/stocks.db: it applies repository writes forwarded by
+# reader processes over a local connection (Config.INGEST_SERVICE_HOST/PORT) and publishes read-only snapshots
+# (Config.SNAPSHOT_DIR) that the readers query. Start it first, then the web workers in reader mode:
+#   python ingest.py
+#   DB_ACCESS_MODE=reader gunicorn -w 4 -b 127.0.0.1:5000 run:app
+import os
+os.environ['DB_ACCESS_MODE'] = 'writer' # Must be set before app.config is imported
+
+from app import app # Initializes/migrates the schema as the owning process
+from app.ingest_service import IngestService
+
+if __name__ == '__main__':
+    service = IngestService()
+    try: service.serve_forever()
+    except KeyboardInterrupt: print("Ingest service: Stopping..."); service.stop()
@@ -1,4 +1,5 @@
 # This file is the main entry point to run the Flask application.
+import os
 import sys
 print("--- run.py ---")
 print("SYS.PATH:", sys.path) # See where Python is looking for modules
@@ -9,6 +10,8 @@ except Exception as e:
     print(f"SDK IMPORT FAIL in run.py: {e}")
 print("--------------")
 
+if __name__ == '__main__':
+    os.environ.setdefault('APP_DEBUG_RELOADER', '1') # Reloader parent skips DB startup (see app/__init__.py)
 from app import app # Import the app instance from our app package
 
 if __name__ == '__main__':